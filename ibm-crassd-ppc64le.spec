@@ -10,6 +10,7 @@ Summary     : IBM POWER LC Cluster RAS Service Package
 
 Requires: java >= 1.7.0
 Requires: python3
+Requires: python3-numpy
 Requires: python-configparser
 Requires: libstdc++
 Requires: pexpect
@@ -40,6 +41,11 @@ systemctl daemon-reload 2> /dev/null || true
 /opt/ibm/ras/bin/__init__.py
 /opt/ibm/ras/bin/notificationlistener.py
 /opt/ibm/ras/bin/telemetryServer.py
+/opt/ibm/ras/bin/websocketMux.py
+/opt/ibm/ras/bin/tlsSessions.py
+/opt/ibm/ras/bin/telemetryHistory.py
+/opt/ibm/ras/bin/telemetryAggregates.py
+/opt/ibm/ras/bin/telemetryRules.py
 %attr(755,root,root) /opt/ibm/ras/bin/updateNodeTimes.py
 /opt/ibm/ras/bin/plugins/logstash/__init__.py
 /opt/ibm/ras/bin/plugins/logstash/logstashnotify.py
@@ -33,7 +33,7 @@ def createCommandParser():
 def getxcatData():
     output = None
     try:
-        output = subprocess.check_output(['/opt/xcat/bin/lsdef', 'compute', '-i', 'bmc,servicenode,mgt', '-c']).decode('utf-8')
+        output = subprocess.check_output(['/opt/xcat/bin/lsdef', 'compute', '-i', 'bmc,servicenode,mgt,groups', '-c']).decode('utf-8')
     except Exception as e:
         print("Error: Unable to get info from xcat, aborting.")
         print(e)
@@ -69,6 +69,8 @@ def parseXcatOutput(output):
                 nodeInfo['accessType'] = 'ipmi'
         elif 'servicenode=' in info:
             nodeInfo['serviceNode'] = info.split('=')[1].split(',')[0]
+        elif 'groups=' in info:
+            nodeInfo['groups'] = info.split('=')[1].strip().split(',')
         else: 
             continue
     return bysnDict
@@ -19,6 +19,7 @@ except ImportError:
     import queue
 import threading
 import syslog
+import re
 import sys
 import multiprocessing
 
@@ -30,6 +31,11 @@ global notifyList
 notifyList = {}
 global mynodelist
 mynodelist = []
+global nodeRegistry
+nodeRegistry = {'byXcatName': {}, 'byBmcHostname': {}, 'byHandle': {}, 'byID': [], 'byGroup': {}}
+#most names a single noderange element can expand to, unless more nodes are monitored
+global maxNoderangeNames
+maxNoderangeNames = 100000
 global missingEvents
 missingEvents = {}
 global lock
@@ -53,16 +59,100 @@ pluginConfigs = {}
 global pluginVars
 pluginVars = {}
 
+global interestFilters
+interestFilters = {}
+
+global interestIndex
+interestIndex = {'byCerID': {}, 'anyCerID': [], 'order': []}
+
+global interestRoutes
+interestRoutes = {}
+
+global pluginInitTimeout
+pluginInitTimeout = 120
+
+global notifyFailureThreshold
+notifyFailureThreshold = 3
+
+global notifyRetryInterval
+notifyRetryInterval = 30
+
+global websocketLoops
+websocketLoops = 1
+
+global websocketConnectors
+websocketConnectors = 8
+
+global websocketTimeout
+websocketTimeout = 30
+
+global websocketFrameTimeout
+websocketFrameTimeout = 5
+
+global websocketReconnectBase
+websocketReconnectBase = 2
+
+global websocketReconnectMax
+websocketReconnectMax = 300
+
+global websocketPingInterval
+websocketPingInterval = 10
+
+global websocketPingTimeout
+websocketPingTimeout = 5
+
 global telemPort
 telemPort = 53322
 
+global telemCompressionLevel
+telemCompressionLevel = 6
+
+global telemMaxSensors
+telemMaxSensors = 256
+
+global telemHistorySamples
+telemHistorySamples = 300
+
+global telemHistory10sBuckets
+telemHistory10sBuckets = 90
+
+global telemHistory1mBuckets
+telemHistory1mBuckets = 60
+
+global telemHistoryDir
+telemHistoryDir = ''
+
+global telemHistoryDays
+telemHistoryDays = 7
+
+global telemGatherers
+telemGatherers = 0
+
+global telemRebalanceInterval
+telemRebalanceInterval = 0
+
+#aggregate sensors computed by the telemetry server, from the telemetry_aggregates section
+global telemAggregates
+telemAggregates = []
+
+#rules checked against the telemetry readings, from the telemetry_rules section
+global telemRules
+telemRules = []
+
+#carries the nodeID of nodes to poll from the telemetry gatherer processes to the main process, and 
+#the events raised by the telemetry rules as ('rule', nodeID, event)
 global alertMessageQueue
-alertMessageQueue = multiprocessing.Queue()
+alertMessageQueue = multiprocessing.SimpleQueue()
+
+#events raised by the telemetry rules, waiting to be sent to the notify entities
+global telemEvents
+telemEvents = queue.Queue()
 
 global configFileName
 configFileName = '/opt/ibm/ras/etc/ibm-crassd.config'
 updateNodeTimesfile = '/opt/ibm/ras/etc/updateNodes.ini'
 bmclastreports = '/opt/ibm/ras/etc'
+pluginManifest = '/opt/ibm/ras/etc/pluginManifest.json'
 if(sys.version_info<= (3,0)):
     pyString = 'python'
 else:
@@ -91,3 +181,181 @@ def errorLogger(severity, message):
     else:
         syslog.openlog(ident="ibm-crassd", logoption=syslog.LOG_PID|syslog.LOG_NOWAIT)
         syslog.syslog(severity, message)    
+
+def registerNode(node):
+    """
+         Adds a node to the registry, so it can be found by its xCAT node name, BMC hostname, nodeID or
+         the xCAT groups it belongs to.
+         The nodeID is a small integer assigned here, used to refer to the node across processes. 
+           
+         @param node: dictionary containing the properties of the node
+    """
+    with lock:
+        if 'nodeID' not in node:
+            node['nodeID'] = len(nodeRegistry['byID'])
+            nodeRegistry['byID'].append(node)
+        nodeRegistry['byXcatName'][node['xcatNodeName']] = node
+        nodeRegistry['byBmcHostname'][node['bmcHostname']] = node
+        groups = node.get('groups', [])
+        if not isinstance(groups, list):
+            groups = str(groups).split(',')
+        for group in groups:
+            group = group.strip()
+            if group and node not in nodeRegistry['byGroup'].setdefault(group, []):
+                nodeRegistry['byGroup'][group].append(node)
+
+def getNodeByXcatName(xcatNodeName):
+    """
+         Returns the node with the xCAT node name, or None if it is not monitored
+    """
+    return nodeRegistry['byXcatName'].get(xcatNodeName)
+
+def getNodeByBmcHostname(bmcHostname):
+    """
+         Returns the node with the BMC hostname, or None if it is not monitored
+    """
+    return nodeRegistry['byBmcHostname'].get(bmcHostname)
+
+def getNodesByGroup(group):
+    """
+         Returns the list of nodes in an xCAT group, empty if no monitored node is in the group
+    """
+    return list(nodeRegistry['byGroup'].get(group, []))
+
+def splitNoderange(noderange):
+    """
+         Splits a noderange on the commas that are not inside brackets
+    """
+    items = []
+    depth = 0
+    item = ''
+    for char in noderange:
+        if char == '[':
+            depth += 1
+        elif char == ']':
+            depth -= 1
+        if char == ',' and depth == 0:
+            items.append(item.strip())
+            item = ''
+        else:
+            item += char
+    items.append(item.strip())
+    return [item for item in items if item]
+
+def getNoderangeLimit():
+    """
+         Returns the most names a noderange element can expand to, the larger of maxNoderangeNames and
+         the number of monitored nodes
+    """
+    return max(maxNoderangeNames, len(nodeRegistry['byID']))
+
+def expandNoderangeItem(item, limit=None):
+    """
+         Expands a single noderange element into the names it stands for. Supports bracket ranges and
+         lists, such as node[01-10] or node[1,3,5], and numeric ranges such as node01-node10. Numbers keep
+         the zero padding of the start of the range.
+           
+         @param item: the noderange element
+         @param limit: the most names the element can expand to, defaults to getNoderangeLimit()
+         @return: list of names, or a list with the element itself if it is not a range
+         @raise ValueError: if the element expands to more than limit names, checked before they are built
+    """
+    if limit is None:
+        limit = getNoderangeLimit()
+    bracket = re.match(r'^(.*?)\[([^\]]+)\](.*)$', item)
+    if bracket is not None:
+        prefix, inner, suffix = bracket.groups()
+        names = []
+        for part in inner.split(','):
+            bounds = part.split('-')
+            if len(bounds) == 2 and bounds[0].isdigit() and bounds[1].isdigit():
+                width = len(bounds[0])
+                if int(bounds[1]) - int(bounds[0]) + 1 > limit - len(names):
+                    raise ValueError(item)
+                for num in range(int(bounds[0]), int(bounds[1]) + 1):
+                    names.extend(expandNoderangeItem(prefix + str(num).zfill(width) + suffix, limit - len(names)))
+            else:
+                names.extend(expandNoderangeItem(prefix + part + suffix, limit - len(names)))
+            if len(names) > limit:
+                raise ValueError(item)
+        return names
+    if limit < 1:
+        raise ValueError(item)
+    dashed = re.match(r'^(.*?)(\d+)-(.*?)(\d+)$', item)
+    if dashed is not None and dashed.group(1) == dashed.group(3):
+        prefix, first, last = dashed.group(1), dashed.group(2), dashed.group(4)
+        width = len(first)
+        if int(last) - int(first) + 1 > limit:
+            raise ValueError(item)
+        return [prefix + str(num).zfill(width) for num in range(int(first), int(last) + 1)]
+    return [item]
+
+def resolveNoderange(noderange):
+    """
+         Resolves an xCAT style noderange against the registry. Elements are separated by commas, and 
+         can be node names, groups or ranges. An element starting with - is excluded from the result. 
+         Ranges expanding to more names than getNoderangeLimit() are logged and ignored. 
+           
+         @param noderange: the noderange string, for example rack1,node[01-10],-node05
+         @return: tuple with the list of matching nodes in nodeID order, and the list of elements that 
+                  matched no monitored node
+    """
+    selected = []
+    excluded = []
+    unknown = []
+    for item in splitNoderange(noderange):
+        target = selected
+        if item.startswith('-'):
+            target = excluded
+            item = item[1:]
+        matched = getNodesByGroup(item)
+        if not matched:
+            try:
+                names = expandNoderangeItem(item)
+            except ValueError:
+                errorLogger(syslog.LOG_ERR, "The noderange element {item} covers more than {limit} nodes and is ignored.".format(item=item, limit=getNoderangeLimit()))
+                names = []
+            for name in names:
+                node = getNodeByXcatName(name)
+                if node is not None:
+                    matched.append(node)
+        if not matched:
+            unknown.append(item)
+        target.extend(matched)
+    nodes = {}
+    for node in selected:
+        nodes[node['nodeID']] = node
+    for node in excluded:
+        nodes.pop(node['nodeID'], None)
+    return [nodes[nodeID] for nodeID in sorted(nodes)], unknown
+
+def getNodeByID(nodeID):
+    """
+         Returns the node with the nodeID, or None if there is no such node
+    """
+    if 0 <= nodeID < len(nodeRegistry['byID']):
+        return nodeRegistry['byID'][nodeID]
+    return None
+
+def bindHandle(handle, node):
+    """
+         Associates a connection handle, such as a websocket, with a node
+           
+         @param handle: the connection object
+         @param node: dictionary containing the properties of the node
+    """
+    with lock:
+        nodeRegistry['byHandle'][handle] = node
+
+def unbindHandle(handle):
+    """
+         Removes the association between a connection handle and its node
+    """
+    with lock:
+        nodeRegistry['byHandle'].pop(handle, None)
+
+def getNodeByHandle(handle):
+    """
+         Returns the node using the connection handle, or None if the handle is not bound
+    """
+    return nodeRegistry['byHandle'].get(handle)
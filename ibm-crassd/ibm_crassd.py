@@ -27,11 +27,13 @@ except ImportError:
 import subprocess
 import json
 import math
+import re
 import config
 from config import *
-import imp
+import importlib.util
 import socket
 import telemetryServer
+import websocketMux
 import traceback
 
 def sigHandler(signum, frame):
@@ -49,6 +51,12 @@ def sigHandler(signum, frame):
         config.killNow = True
     elif(signum == signal.SIGUSR1):
         errorLogger(syslog.LOG_INFO,"Queue size: " + str(nodes2poll.qsize()))
+        reconnectState = websocketMux.getReconnectState()
+        waiting = [bmc for bmc in reconnectState if reconnectState[bmc]['state'] != 'connected']
+        if waiting:
+            errorLogger(syslog.LOG_INFO, "Websockets not connected: " + ", ".join(
+                "{bmc} ({state}, {attempts} attempts)".format(bmc=bmc, state=reconnectState[bmc]['state'],
+                    attempts=reconnectState[bmc]['attempts']) for bmc in waiting))
     else:
         print("Signal received" + signum)
 
@@ -66,18 +74,18 @@ def updateTimesforLastReports(signum, frame):
             try:
                 for section in Updatesconfparser.sections(): 
                     nodes = dict(Updatesconfparser.items(section))
-                    for node in config.mynodelist:
-                        for markedNode in Updatesconfparser[section]:
-                            if node['xcatNodeName'] == str(markedNode):
-                                bmcHostname = node['bmcHostname']
-                                impactednode = node['xcatNodeName']
-                                updateNotifyTimesData = {'entity': section, 'bmchostname': node['bmcHostname'], 'lastLogTime': nodes[markedNode],
-                                                         'dupTimeIDList': []}
-                                updateConfFile.put(updateNotifyTimesData)
-                                updatedNodes.append(markedNode)
-                                with lock: 
-                                    notifyList[section][bmcHostname]['lastLogTime'] = nodes[markedNode]
-                                    del notifyList[section][bmcHostname]['dupTimeIDList'][:]
+                    for markedNode in Updatesconfparser[section]:
+                        node = config.getNodeByXcatName(str(markedNode))
+                        if node is None:
+                            continue
+                        bmcHostname = node['bmcHostname']
+                        updateNotifyTimesData = {'entity': section, 'bmchostname': bmcHostname, 'lastLogTime': nodes[markedNode],
+                                                 'dupTimeIDList': []}
+                        updateConfFile.put(updateNotifyTimesData)
+                        updatedNodes.append(markedNode)
+                        with lock: 
+                            notifyList[section][bmcHostname]['lastLogTime'] = nodes[markedNode]
+                            del notifyList[section][bmcHostname]['dupTimeIDList'][:]
             except Exception as e:
                 exc_type, exc_obj, exc_tb = sys.exc_info()
                 fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
@@ -299,20 +307,171 @@ def analyzeit(event, username, bmcHostname, password, accessType):
                 config.analyzeIDcount[event['CerID']] +=1
     return analysisPassed
        
-def processAlert(event, bmcHostname, impactednode, username, password, accessType):   
+def breakerAllowsCall(key):
+    """
+        Checks the circuit breaker for the specified notify entity. While the breaker is open the entity
+        is not called. Once the retry interval has passed a single call is let through to probe the entity.
+        A probe whose result was never recorded expires after another retry interval.
+        
+        @param key: the name of the entity in the notifyList
+        @return: True if the entity can be called, False if the call should take the failure path
+    """
+    with lock:
+        entity = notifyList[key]
+        if entity['breakerState'] == 'closed':
+            return True
+        if (entity['breakerState'] in ('open', 'halfOpen') and 
+            time.time() - entity['breakerOpenedTime'] >= config.notifyRetryInterval):
+            entity['breakerState'] = 'halfOpen'
+            entity['breakerOpenedTime'] = time.time()
+            return True
+    return False
+
+def callNotify(key, func, event, impactednode):
+    """
+        Calls the notify function of an entity. An exception raised by the plugin is logged and treated as
+        a failed notification, so the result of every call reaches the circuit breaker. 
+        
+        @param key: the name of the entity in the notifyList
+        @param func: the notify function of the entity
+        @param event: Dictionary containing all the alert properties
+        @param impactednode: the node that had the alert
+        @return: True if notification was successful, False otherwise
+    """
+    try:
+        return func(event, impactednode, notifyList)
+    except Exception as e:
+        errorLogger(syslog.LOG_ERR, "Notify entity {entity} raised an exception reporting {id} on {thenode}: {err}".format(
+            entity=key, id=event.get('CerID'), thenode=impactednode, err=e))
+        return False
+
+def recordNotifyResult(key, success):
+    """
+        Updates the circuit breaker for the specified notify entity with the outcome of a call. 
+        The breaker opens after notifyFailureThreshold consecutive failures or a failed probe, 
+        and closes on the first success.
+        
+        @param key: the name of the entity in the notifyList
+        @param success: boolean, True if the entity was successfully notified
+    """
+    message = None
+    with lock:
+        entity = notifyList[key]
+        if success:
+            if entity['breakerState'] != 'closed':
+                message = (syslog.LOG_INFO, "Notify entity {entity} has recovered. Resuming notifications.".format(entity=key))
+            entity['breakerState'] = 'closed'
+            entity['consecutiveFailures'] = 0
+        else:
+            entity['consecutiveFailures'] += 1
+            if entity['breakerState'] == 'halfOpen' or entity['consecutiveFailures'] >= config.notifyFailureThreshold:
+                if entity['breakerState'] == 'closed':
+                    message = (syslog.LOG_ERR, "Notify entity {entity} failed {count} consecutive times. Suspending notifications for {interval} seconds between retries.".format(
+                        entity=key, count=entity['consecutiveFailures'], interval=config.notifyRetryInterval))
+                entity['breakerState'] = 'open'
+                entity['breakerOpenedTime'] = time.time()
+    if message is not None:
+        errorLogger(*message)
+
+def registerInterest(key, interest):
+    """
+        Stores the interest filter declared by the plugin for a notify entity. 
+        
+        @param key: the name of the entity in the notifyList
+        @param interest: dictionary that may contain CerIDs, excludeCerIDs, severities and serviceable. 
+                         A missing or None value matches every event. 
+    """
+    compiled = {'CerIDs': None, 'excludeCerIDs': frozenset(), 'severities': None, 'serviceable': None}
+    if interest:
+        if interest.get('CerIDs') is not None:
+            compiled['CerIDs'] = frozenset(interest['CerIDs'])
+        if interest.get('excludeCerIDs') is not None:
+            compiled['excludeCerIDs'] = frozenset(interest['excludeCerIDs'])
+        if interest.get('severities') is not None:
+            compiled['severities'] = frozenset(sev.lower() for sev in interest['severities'])
+        if interest.get('serviceable') is not None:
+            compiled['serviceable'] = bool(interest['serviceable'])
+    with lock:
+        config.interestFilters[key] = compiled
+    compileInterestIndex()
+
+def compileInterestIndex():
+    """
+        Builds the index used to route events to the entities interested in them. Entities are indexed by 
+        the CerIDs they declared, entities without a CerID list are checked for every event. 
+    """
+    byCerID = {}
+    anyCerID = []
+    with lock:
+        for key in notifyList:
+            interest = config.interestFilters.get(key)
+            if interest is None or interest['CerIDs'] is None:
+                anyCerID.append(key)
+            else:
+                for cerID in interest['CerIDs']:
+                    byCerID.setdefault(cerID, []).append(key)
+        config.interestIndex = {'byCerID': byCerID, 'anyCerID': anyCerID, 'order': list(notifyList)}
+        config.interestRoutes = {}
+
+def isServiceable(event):
+    """
+        Returns True if the event is marked as serviceable
+    """
+    return str(event.get('serviceable', '')).lower() in ('yes', 'true')
+
+def interestedEntities(event):
+    """
+        Gets the entities that want to be notified of the event. Results are cached by the event properties 
+        used in the interest filters.
+        
+        @param event: Dictionary containing all the alert properties
+        @return: tuple of entity names in notifyList order
+    """
+    routeKey = (event['CerID'], str(event.get('severity', '')).lower(), isServiceable(event))
+    route = config.interestRoutes.get(routeKey)
+    if route is not None:
+        return route
+    with lock:
+        index = config.interestIndex
+        candidates = set(index['byCerID'].get(routeKey[0], ())).union(index['anyCerID'])
+        entities = []
+        for key in index['order']:
+            if key not in candidates or key not in notifyList:
+                continue
+            interest = config.interestFilters.get(key)
+            if interest is not None:
+                if routeKey[0] in interest['excludeCerIDs']:
+                    continue
+                if interest['severities'] is not None and routeKey[1] not in interest['severities']:
+                    continue
+                if interest['serviceable'] is not None and interest['serviceable'] != routeKey[2]:
+                    continue
+            entities.append(key)
+        route = tuple(entities)
+        config.interestRoutes[routeKey] = route
+    return route
+
+def processAlert(event, bmcHostname, impactednode, username, password, accessType, entities=None):   
     """
         Processes the given alert and notifies the correct entity. If unable to report, increments pollNotifyFailed
-        for the notify entity. 
+        for the notify entity. Alerts for entities whose plugin is still initializing are queued until it is ready.
        
        @param event: Dictionary containing all the alert properties
+       @param entities: optional list of entities to limit the notification to
        @return: True if the notifyTimes need updated, False otherwise
     """
     updateTimes = False
     analysisPassed = None
-    for key in notifyList:
+    for key in interestedEntities(event):
+        if entities is not None and key not in entities:
+            continue
         updateNotifyTimes = False
         
         with lock:
+            if notifyList[key]['pluginState'] == 'initializing':
+                pendingKey = (bmcHostname, event['timestamp'], event['CerID'])
+                notifyList[key]['pendingEvents'][pendingKey] = (event, bmcHostname, impactednode, username, password, accessType)
+                continue
             receiveEntityStatus = notifyList[key]['receiveEntityDown']
             dupList = notifyList[key][bmcHostname]['dupTimeIDList']
             func = notifyList[key]['function']
@@ -329,32 +488,32 @@ def processAlert(event, bmcHostname, impactednode, username, password, accessTyp
                 analysisPassed = analyzeit(event, username, bmcHostname, password, accessType)
             if analysisPassed:
                 #process the valid alert
-                repsuccess = func(event, impactednode, notifyList) 
-                with lock:
-                    notifyList[key]['successfullyReported'] = repsuccess
-                if repsuccess:
-                    updateTrackingTimes(event, notifyList[key], bmcHostname)
-                    updateNotifyTimes = True
-                else:
+                if breakerAllowsCall(key):
+                    repsuccess = callNotify(key, func, event, impactednode) 
                     with lock:
-                        notifyList[key]['failedFirstTry'] = True
-                        receiveEntityStatus = notifyList[key]['receiveEntityDown']
-                    if(receiveEntityStatus== False):
+                        notifyList[key]['successfullyReported'] = repsuccess
+                    if not repsuccess:
                         with lock:
-                            func = notifyList[key]['function']
-                        repsuccess = func(event, impactednode, notifyList)
-                        
-                        with lock:
-                            notifyList[key]['successfullyReported'] = repsuccess 
-                        if(repsuccess):
-                            updateTrackingTimes(event, notifyList[key], bmcHostname)
-                            updateNotifyTimes = True
-                        else:
+                            notifyList[key]['failedFirstTry'] = True
+                            receiveEntityStatus = notifyList[key]['receiveEntityDown']
+                        if(receiveEntityStatus== False):
                             with lock:
-                                notifyList[key][bmcHostname]['pollNotifyFailed'] += 1
+                                func = notifyList[key]['function']
+                            repsuccess = callNotify(key, func, event, impactednode)
+                            
+                            with lock:
+                                notifyList[key]['successfullyReported'] = repsuccess 
+                    recordNotifyResult(key, repsuccess)
+                    if repsuccess:
+                        updateTrackingTimes(event, notifyList[key], bmcHostname)
+                        updateNotifyTimes = True
                     else:
                         with lock:
                             notifyList[key][bmcHostname]['pollNotifyFailed'] += 1
+                else:
+                    #the entity is known to be down, report on a later poll without calling it
+                    with lock:
+                        notifyList[key][bmcHostname]['pollNotifyFailed'] += 1
             else:
                 #analysis found a false alert, filter it
                 updateTrackingTimes(event, notifyList[key], bmcHostname)
@@ -367,6 +526,59 @@ def processAlert(event, bmcHostname, impactednode, username, password, accessTyp
                 updateConfFile.put(updateNotifyTimesData)
 
  
+def processTelemetryAlert(event, node, entities=None):
+    """
+        Notifies the entities interested in an event raised by a telemetry rule. These events don't come from
+        the SEL of the BMC, so they are not compared with or recorded in the last reported times of the BMC. 
+        Events for entities whose plugin is still initializing are queued until it is ready.
+        
+        @param event: Dictionary containing all the alert properties
+        @param node: dictionary containing the properties of the node the event is for
+        @param entities: optional list of entities to limit the notification to
+    """
+    bmcHostname = node['bmcHostname']
+    impactednode = node['xcatNodeName']
+    for key in interestedEntities(event):
+        if entities is not None and key not in entities:
+            continue
+        with lock:
+            if notifyList[key]['pluginState'] == 'initializing':
+                pendingKey = ('telemetry', bmcHostname, event['timestamp'], event['CerID'], event['compInstance'])
+                notifyList[key]['pendingEvents'][pendingKey] = (event, node)
+                continue
+            func = notifyList[key]['function']
+            notifyList[key]['failedFirstTry'] = False
+        repsuccess = False
+        if breakerAllowsCall(key):
+            repsuccess = callNotify(key, func, event, impactednode)
+            if not repsuccess:
+                with lock:
+                    notifyList[key]['failedFirstTry'] = True
+                    receiveEntityStatus = notifyList[key]['receiveEntityDown']
+                if(receiveEntityStatus == False):
+                    repsuccess = callNotify(key, func, event, impactednode)
+            with lock:
+                notifyList[key]['successfullyReported'] = repsuccess
+            recordNotifyResult(key, repsuccess)
+        if not repsuccess:
+            errorLogger(syslog.LOG_ERR, "Unable to report telemetry event {id} for {sensor} on {thenode} to {entity}".format(
+                id=event['CerID'], sensor=event['compInstance'], thenode=impactednode, entity=key))
+
+def telemetryEventProcessor():
+    """
+        Sends the events raised by the telemetry rules to the notify entities. Run in a thread of the main process. 
+    """
+    while not killNow:
+        event, node = config.telemEvents.get()
+        try:
+            processTelemetryAlert(event, node)
+        except Exception as e:
+            errorLogger(syslog.LOG_ERR, "Error processing a telemetry event.")
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+            print("exception: ", exc_type, fname, exc_tb.tb_lineno)
+            print(e)
+ 
 def BMCEventProcessor():
     """
          processes alerts and is run in child threads
@@ -460,12 +672,12 @@ def loadBMCLastReports():
         try:
             for key in notifyList:
                 bmcs = dict(confParser.items(str(key) + '_bmcs'))
-                for node in mynodelist:
-                    if node['bmcHostname'] in bmcs:
-                        bmcString = str(bmcs[node['bmcHostname']]).replace("\'", "\"")
-                        bmcs[node['bmcHostname']]= json.loads(bmcString)
-                        notifyList[key][node['bmcHostname']]['lastLogTime'] = str(bmcs[node['bmcHostname']]['lastLogTime'])
-                        notifyList[key][node['bmcHostname']]['dupTimeIDList'] = bmcs[node['bmcHostname']]['dupTimeIDList']
+                for bmcHostname in bmcs:
+                    if config.getNodeByBmcHostname(bmcHostname) is not None:
+                        bmcString = str(bmcs[bmcHostname]).replace("\'", "\"")
+                        bmcs[bmcHostname]= json.loads(bmcString)
+                        notifyList[key][bmcHostname]['lastLogTime'] = str(bmcs[bmcHostname]['lastLogTime'])
+                        notifyList[key][bmcHostname]['dupTimeIDList'] = bmcs[bmcHostname]['dupTimeIDList']
             if 'statistics' in confParser:
                 for key in dict(confParser['statistics']):
                     id = key.split('suppressed_')[1].upper()
@@ -475,40 +687,132 @@ def loadBMCLastReports():
         except configparser.NoSectionError:
             errorLogger(syslog.LOG_ERR, "No section: "+str(key) +"_bmcs in ini file. All bmc events will be forwarded to entities being notified. ")
 
+def getPluginSignature(plugindir):
+    """
+        Builds a signature of the plugin directory tree used to validate the cached plugin manifest
+        
+        @param plugindir: the directory containing the plugins
+        @return: dictionary containing the modification time of each directory in the plugin tree
+    """
+    signature = {}
+    for dirpath, dirnames, filenames in os.walk(plugindir):
+        dirnames[:] = [d for d in dirnames if d != '__pycache__']
+        signature[dirpath] = os.path.getmtime(dirpath)
+    return signature
+
+def scanPlugins(plugindir):
+    """
+        Walks the plugin directory looking for modules that could be plugins. Nothing is imported.
+        
+        @param plugindir: the directory containing the plugins
+        @return: a list of dictionaries containing the name and path of each potential plugin
+    """
+    plugins = []
+    mainmodule = "__init__"
+    for dirpath, dirnames, filenames in os.walk(plugindir):
+        dirnames[:] = sorted(d for d in dirnames if d != '__pycache__')
+        for filename in sorted(filenames):
+            if filename.endswith(".py") and mainmodule not in filename:
+                #is a potential module
+                plugins.append({"name": filename[:-len(".py")], "path": os.path.join(dirpath, filename)})
+    return plugins
+
 def getPlugins():
     """
-        gets a list of valid plugins from the plugin directory
+        gets a list of valid plugins from the plugin directory. The list is cached in a manifest file and
+        is only rebuilt when the plugin directory has changed. 
        
-       @return: a list containing valid files to import 
+       @return: a list containing the name and path of the files to import 
     """
-    
-    plugins = []
     plugindir = "plugins"
-    mainmodule = "__init__"
-    files = os.listdir(plugindir)
-    for filename in files:
-        fullpath = os.path.join(plugindir, filename)
-        if os.path.isdir(fullpath):
-            for f in os.listdir(fullpath):
-                addFile = os.path.join(filename, f)
-                files.append(addFile)
-        if not os.path.isdir(fullpath) and ".py" in filename and not mainmodule in filename and not ".pyc" in filename:
-            #is a potential module
-            modname = os.path.basename(fullpath).split('.py')[0]
-            pathonly = os.path.split(fullpath)[0]
-            info = imp.find_module(modname ,[pathonly])
-            if info not in plugins:
-                plugins.append({"name":modname, "info":info})
-        
+    signature = getPluginSignature(plugindir)
+    try:
+        with open(config.pluginManifest, 'r') as manifestFile:
+            manifest = json.load(manifestFile)
+        if manifest['signature'] == signature:
+            return manifest['plugins']
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+    
+    plugins = scanPlugins(plugindir)
+    try:
+        with open(config.pluginManifest, 'w') as manifestFile:
+            json.dump({'signature': signature, 'plugins': plugins}, manifestFile)
+    except (IOError, OSError) as e:
+        errorLogger(syslog.LOG_DEBUG, "Unable to write the plugin manifest {filename}: {err}".format(filename=config.pluginManifest, err=e))
     return plugins
 
 def loadPlugins(plugin):
     """
         Loads the specified plugin
-        @plugin: the absolute path and filename to the module to load
+        @plugin: dictionary with the module name and the path to the module to load
         @return: loaded module 
     """ 
-    return imp.load_module(plugin["name"], *plugin["info"])
+    startTime = time.time()
+    spec = importlib.util.spec_from_file_location(plugin["name"], plugin["path"])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[plugin["name"]] = module
+    spec.loader.exec_module(module)
+    errorLogger(syslog.LOG_INFO, "Loaded plugin {name} in {elapsed:.3f} seconds".format(name=plugin["name"], elapsed=time.time()-startTime))
+    return module
+
+def initializePlugin(plugin, name, keys):
+    """
+        Runs the initialize function of a plugin with a time limit. Run in its own thread so plugins initialize 
+        concurrently while the BMCs are polled. When the plugin is ready, the alerts queued for its entities 
+        are processed. A plugin that fails or times out stops the service. 
+        
+        @param plugin: the loaded plugin module
+        @param name: the name of the plugin module
+        @param keys: list of the notify entities served by the plugin
+    """
+    global killNow
+    result = {'success': False}
+    def runInitialize():
+        try:
+            result['success'] = plugin.initialize()
+        except Exception as e:
+            errorLogger(syslog.LOG_ERR, 'Plugin: {name} raised an exception during initialization: {err}'.format(name=name, err=e))
+    startTime = time.time()
+    t = threading.Thread(target=runInitialize)
+    t.daemon = True
+    t.start()
+    t.join(config.pluginInitTimeout)
+    if t.is_alive():
+        errorLogger(syslog.LOG_CRIT, 'Plugin: {name} did not initialize within {timeout} seconds. Aborting now.'.format(name=name, timeout=config.pluginInitTimeout))
+        killNow = True
+        config.killNow = True
+        return
+    if not result['success']:
+        errorLogger(syslog.LOG_CRIT, 'Plugin: ' + name + ' failed to initialize. Aborting now.')
+        killNow = True
+        config.killNow = True
+        return
+    errorLogger(syslog.LOG_INFO, "Initialized plugin {name} in {elapsed:.3f} seconds".format(name=name, elapsed=time.time()-startTime))
+    
+    for key in keys:
+        if key not in notifyList:
+            continue
+        if hasattr(plugin, 'interestFilter'):
+            registerInterest(key, plugin.interestFilter())
+        with lock:
+            notifyList[key]['pluginState'] = 'ready'
+            pending = notifyList[key]['pendingEvents']
+            notifyList[key]['pendingEvents'] = {}
+        if pending:
+            errorLogger(syslog.LOG_INFO, "Processing {count} alerts queued for {entity} during initialization".format(count=len(pending), entity=key))
+        for pendingKey, alert in pending.items():
+            try:
+                if pendingKey[0] == 'telemetry':
+                    processTelemetryAlert(*alert, entities=[key])
+                else:
+                    processAlert(*alert, entities=[key])
+            except Exception as e:
+                errorLogger(syslog.LOG_ERR, "Failed to process alert {id} queued for {entity} during initialization".format(id=alert[0].get('CerID'), entity=key))
+                exc_type, exc_obj, exc_tb = sys.exc_info()
+                fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+                print("exception: ", exc_type, fname, exc_tb.tb_lineno)
+                print(e)
 
 def createNodeList(confParser):
     """
@@ -537,6 +841,7 @@ def createNodeList(confParser):
                 notifyList[entity][mynodelist[-1]['bmcHostname']] = {
                     'lastLogTime': mynodelist[-1]['lastLogTime'],
                     'dupTimeIDList': mynodelist[-1]['dupTimeIDList']}
+            config.registerNode(mynodelist[-1])
                 
     except Exception as e:
         exc_type, exc_obj, exc_tb = sys.exc_info()
@@ -573,6 +878,7 @@ def validatePluginNotifications(confParser):
     #remove entities to notify that don't have the associated plugin
     for plugin in missingPlugins:
         del notifyList[plugin]
+    compileInterestIndex()
 
 def getConfigPaths(forceHostname=False):
     '''
@@ -619,7 +925,12 @@ def setupNotifications():
                     notifyList[key] = {"function": test[key+'function'], 
                                         "receiveEntityDown":False,
                                         "failedFirstTry": False,
-                                        "successfullyReported": True}
+                                        "successfullyReported": True,
+                                        "breakerState": 'closed',
+                                        "consecutiveFailures": 0,
+                                        "breakerOpenedTime": 0,
+                                        "pluginState": 'ready',
+                                        "pendingEvents": {}}
                     if confParser.has_section(key):
                         pluginConfSettings = {key: dict(confParser.items(key))}
                         config.pluginConfigs.update(pluginConfSettings)
@@ -630,18 +941,31 @@ def setupNotifications():
         errorLogger(syslog.LOG_ERR, "No section: notify in file ibm-crassd.config. Alerts will not be forwarded. Terminating")
         sys.exit() 
     
+    try:
+        config.pluginInitTimeout = int(confParser['base_configuration'].get('pluginInitTimeout', config.pluginInitTimeout))
+    except (KeyError, ValueError):
+        errorLogger(syslog.LOG_ERR, "Invalid pluginInitTimeout in the base configuration. Using the default.")
+    
     #get the nodes to push alerts to
     createNodeList(confParser)
     
     for i in getPlugins():
+        #only import plugins for entities that are enabled
+        enabledEntities = [key for key in notifyList if key in i["name"]]
+        if not enabledEntities:
+            continue
         print("Loading Plugin " + i["name"])
         plugin = loadPlugins(i)
-        for key in notifyList:
-            if key in i["name"]:
-                if hasattr(plugin, 'initialize'):
-                    if not plugin.initialize():
-                        errorLogger(syslog.LOG_CRIT, 'Plugin: ' + i['name'] + ' failed to initialize. Aborting now.')
-                        sys.exit()
+        if hasattr(plugin, 'initialize'):
+            #initialize in the background, alerts for these entities are queued until it completes
+            for key in enabledEntities:
+                notifyList[key]['pluginState'] = 'initializing'
+            t = threading.Thread(target=initializePlugin, args=[plugin, i['name'], enabledEntities])
+            t.daemon = True
+            t.start()
+        elif hasattr(plugin, 'interestFilter'):
+            for key in enabledEntities:
+                registerInterest(key, plugin.interestFilter())
         for entity in notifyList:
             if isString(notifyList[entity]['function']):
                 if hasattr(plugin, notifyList[entity]["function"]):
@@ -650,15 +974,13 @@ def setupNotifications():
     
 def configurePushNotifications():   
     """
-        configures a websocket to listen for push notifications from openbmc. Spawns 1 thread per push notification. 
-        updates the node list by adding information on the thread for each websocket 
+        configures a websocket to listen for push notifications from openbmc. The websockets are multiplexed
+        on the websocketMux event loops, and their state is kept in the node's listenerState. websocketMux
+        reconnects them with backoff when they close. 
     """ 
     for node in mynodelist:
         if node['accessType'] == 'openbmcRest':
-            t = threading.Thread(target=notificationlistener.openSocket, args=[node['bmcHostname'], node['username'], node['password']])
-            node['listener'] = t
-            t.daemon = True
-            t.start()  
+            notificationlistener.openSocket(node)
 def queryAllNodes():
     """
         Queries all nodes to get initial status upon starting up. 
@@ -741,6 +1063,7 @@ def autoConfigureNodes(confParser):
                 mynodelist.append({'xcatNodeName': nodes2monitor[node]['xcatNodeName'], 
                                    'bmcHostname': nodes2monitor[node]['bmcHostname'],
                                    'accessType': nodes2monitor[node]['accessType'],
+                                   'groups': nodes2monitor[node].get('groups', []),
                                    'pollFailedCount': 0,
                                    'lastLogTime': '0',
                                    'dupTimeIDList': []})
@@ -752,6 +1075,7 @@ def autoConfigureNodes(confParser):
                     notifyList[entity][mynodelist[-1]['bmcHostname']] = {
                     'lastLogTime': mynodelist[-1]['lastLogTime'],
                     'dupTimeIDList': mynodelist[-1]['dupTimeIDList']}
+                config.registerNode(mynodelist[-1])
             if len(mynodelist)<1:
                 errorLogger(syslog.LOG_CRIT, "Unable to auto-configure ibm-crassd. Please ensure nodes are configured in the configuration file at /opt/ibm/ras/etc/ibm-crassd.config")
                 killNow = True
@@ -776,6 +1100,61 @@ def autoConfigureNodes(confParser):
         killNow = True
         sys.exit(1)
 
+def getTelemetryAggregates(confParser):
+    """
+        Loads the aggregate sensors the telemetry server computes from the telemetry_aggregates section. 
+        Each entry is name = function(sensor) or name = function(sensor, noderange), where the function
+        is sum, avg, min, max or count. Invalid entries are logged and skipped. 
+        @confParser: the configuration parser object
+    """
+    if 'telemetry_aggregates' not in confParser:
+        return
+    for name in confParser['telemetry_aggregates']:
+        definition = confParser['telemetry_aggregates'][name].strip()
+        match = re.match(r'^(\w+)\s*\(\s*([^,\s\)]+)\s*(?:,\s*([^\)]+?)\s*)?\)$', definition)
+        if match is None or match.group(1) not in ['sum', 'avg', 'min', 'max', 'count']:
+            errorLogger(syslog.LOG_ERR, "Invalid telemetry aggregate {name} = {value}. It will not be computed.".format(name=name, value=definition))
+            continue
+        config.telemAggregates.append({'name': name,
+                                       'function': match.group(1),
+                                       'sensor': match.group(2),
+                                       'noderange': match.group(3)})
+
+def getTelemetryRules(confParser):
+    """
+        Loads the rules the telemetry server checks the readings against from the telemetry_rules section. 
+        Each entry is name = sensor=<sensor name> or type=<sensor type>, followed by any of high, low, hysteresis, 
+        rate, ratehold and noderange given as option=value and separated by spaces. Invalid entries are logged 
+        and skipped. 
+        @confParser: the configuration parser object
+    """
+    if 'telemetry_rules' not in confParser:
+        return
+    for name in confParser['telemetry_rules']:
+        definition = confParser['telemetry_rules'][name].strip()
+        rule = {'name': name, 'sensor': None, 'type': None, 'noderange': None, 'high': None, 'low': None,
+                'hysteresis': 0.0, 'rate': None, 'ratehold': 60.0}
+        valid = True
+        try:
+            for option in definition.split():
+                key, value = option.split('=', 1)
+                key = key.lower()
+                if key in ['high', 'low', 'hysteresis', 'rate', 'ratehold']:
+                    rule[key] = float(value)
+                elif key in ['sensor', 'type', 'noderange'] and value:
+                    rule[key] = value
+                else:
+                    valid = False
+        except ValueError:
+            valid = False
+        if (not valid or (rule['sensor'] is None) == (rule['type'] is None) or
+                (rule['high'] is None and rule['low'] is None and rule['rate'] is None) or
+                rule['hysteresis'] < 0 or rule['ratehold'] < 0 or (rule['rate'] is not None and rule['rate'] <= 0) or
+                (rule['high'] is not None and rule['low'] is not None and rule['high'] <= rule['low'])):
+            errorLogger(syslog.LOG_ERR, "Invalid telemetry rule {name} = {value}. It will not be checked.".format(name=name, value=definition))
+            continue
+        config.telemRules.append(rule)
+
 def getIDstoAnalyze(confParser):
     directory = os.getcwd() + os.sep
     filelist = [afile for afile in os.listdir(directory) if os.path.isfile(''.join([directory, afile]))]
@@ -870,6 +1249,20 @@ def initialize():
             config.useTelem = True
         else:
             config.useTelem = False
+    try:
+        config.notifyFailureThreshold = int(confParser['base_configuration'].get('notifyFailureThreshold', config.notifyFailureThreshold))
+        config.notifyRetryInterval = int(confParser['base_configuration'].get('notifyRetryInterval', config.notifyRetryInterval))
+    except (KeyError, ValueError):
+        errorLogger(syslog.LOG_ERR, "Invalid notify retry settings in the base configuration. Using the defaults.")
+    try:
+        config.websocketLoops = int(confParser['base_configuration'].get('websocketLoops', config.websocketLoops))
+        config.websocketConnectors = int(confParser['base_configuration'].get('websocketConnectors', config.websocketConnectors))
+        config.websocketReconnectBase = int(confParser['base_configuration'].get('websocketReconnectBase', config.websocketReconnectBase))
+        config.websocketReconnectMax = int(confParser['base_configuration'].get('websocketReconnectMax', config.websocketReconnectMax))
+        config.websocketPingInterval = int(confParser['base_configuration'].get('websocketPingInterval', config.websocketPingInterval))
+        config.websocketPingTimeout = int(confParser['base_configuration'].get('websocketPingTimeout', config.websocketPingTimeout))
+    except (KeyError, ValueError):
+        errorLogger(syslog.LOG_ERR, "Invalid websocket settings in the base configuration. Using the defaults.")
     try:
         maxThreads = int(confParser['base_configuration']['maxThreads'])
     except KeyError:
@@ -903,6 +1296,33 @@ def initialize():
             if 'telemetryPort' in confParser['base_configuration']:
                 config.telemPort = int(confParser['base_configuration']['telemetryPort'])
                 config.useTelem = True
+            try:
+                config.telemCompressionLevel = int(confParser['base_configuration'].get('telemetryCompressionLevel', config.telemCompressionLevel))
+            except (KeyError, ValueError):
+                errorLogger(syslog.LOG_ERR, "Invalid telemetryCompressionLevel in the base configuration. Using the default.")
+            try:
+                config.telemMaxSensors = int(confParser['base_configuration'].get('telemetryMaxSensors', config.telemMaxSensors))
+            except (KeyError, ValueError):
+                errorLogger(syslog.LOG_ERR, "Invalid telemetryMaxSensors in the base configuration. Using the default.")
+            try:
+                config.telemHistorySamples = int(confParser['base_configuration'].get('telemetryHistorySamples', config.telemHistorySamples))
+                config.telemHistory10sBuckets = int(confParser['base_configuration'].get('telemetryHistory10sBuckets', config.telemHistory10sBuckets))
+                config.telemHistory1mBuckets = int(confParser['base_configuration'].get('telemetryHistory1mBuckets', config.telemHistory1mBuckets))
+                config.telemHistoryDays = int(confParser['base_configuration'].get('telemetryHistoryDays', config.telemHistoryDays))
+            except (KeyError, ValueError):
+                errorLogger(syslog.LOG_ERR, "Invalid telemetry history size in the base configuration. Using the defaults.")
+            config.telemHistoryDir = confParser['base_configuration'].get('telemetryHistoryDir', config.telemHistoryDir).strip()
+            try:
+                config.telemGatherers = int(confParser['base_configuration'].get('telemetryGatherers', config.telemGatherers))
+                config.telemRebalanceInterval = int(confParser['base_configuration'].get('telemetryRebalanceInterval', config.telemRebalanceInterval))
+            except (KeyError, ValueError):
+                errorLogger(syslog.LOG_ERR, "Invalid telemetryGatherers or telemetryRebalanceInterval in the base configuration. Using the defaults.")
+            getTelemetryAggregates(confParser)
+            getTelemetryRules(confParser)
+            if config.telemRules:
+                t = threading.Thread(target=telemetryEventProcessor)
+                t.daemon = True
+                t.start()
             telemThread = threading.Thread(target=telemetryServer.main)
             telemThread.daemon = True  
             telemThread.start()
@@ -932,16 +1352,8 @@ def pollNodes(interval):
         if node['accessType'] == 'ipmi':
             #load nodes that are using polling into the queue
             nodes2poll.put(node)
-        elif node['accessType'] == 'openbmcRest':
-            if not config.useTelem:
-                if 'listener' in node and not node['listener'].isAlive():
-                    print("Main process opening new connection to {bmc}".format(bmc=node['bmcHostname']))
-                    t = threading.Thread(target=notificationlistener.openSocket, args=[node['bmcHostname'], node['username'], node['password']])
-                    node['listener'] = t
-                    t.daemon = True
-                    t.start()  
     
-    #check for dead push notification
+    #closed push notification websockets are reconnected by websocketMux
     
   
 if __name__ == '__main__':
@@ -13,66 +13,62 @@
    See the License for the specific language governing permissions and
    limitations under the License.
 """
-import websocket
-
-import openbmctool
-import ssl
+import requests
 import json
 import config
 import syslog
-import threading
 import sys
+import websocketMux
+import tlsSessions
 
-def getNode():
-    """
-        returns the hostname of the bmc
-    """
-    thisnode = ""
-    for node in config.mynodelist:
-        if 'listener' in node:
-            if node['listener'].getName() == threading.currentThread().getName():
-                thisnode = node
-                break
-    return thisnode
+def login(node):
+    """
+        Logs into the bmc of the node. Failed logins are retried by the websocketMux reconnect scheduler. 
+        The session resumes the cached TLS session of the bmc. 
+        
+        @param node: dictionary containing the properties of the node
+        @return: the session object, or the error string
+    """
+    httpHeader = {'Content-Type':'application/json'}
+    mysession = tlsSessions.session()
+    try:
+        r = mysession.post('https://'+node['bmcHostname']+'/login', headers=httpHeader, 
+                           json = {"data": [node['username'], node['password']]}, verify=False, timeout=30)
+        loginMessage = r.json()
+        if (loginMessage['status'] != "ok"):
+            return "Login Failed: {descript}".format(descript=loginMessage['data'].get('description'))
+    except(requests.exceptions.RequestException, ValueError, KeyError) as err:
+        return "Login Failed: {err}".format(err=err)
+    node['session'] = mysession
+    return mysession
 
-def on_message(ws, message):
+def on_message(node, message):
     """
         websocket message handler
     """
-
-    node = getNode()
     config.nodes2poll.put(node)
 
-def on_error(ws, wserror):
-    """
-        websocket error handler
-    """
-    node = getNode()
-    config.errorLogger(syslog.LOG_ERR, "Websocket error: {bmc}: {err}".format(bmc=node['bmcHostname'], err=wserror))
-
-def on_close(ws):
+def on_close(node, reason):
     """
         websocket close event handler
     """
-    node = getNode()
+    if reason is not None:
+        config.errorLogger(syslog.LOG_ERR, "Websocket error: {bmc}: {err}".format(bmc=node['bmcHostname'], err=reason))
     config.errorLogger(syslog.LOG_INFO, "{bmc} websocket closed.".format(bmc=node['bmcHostname']))
 
-def on_open(ws):
+def on_open(node, ws):
     """
         sends the filters needed to listen to the logging interface. 
     """
     data = {"paths": ["/xyz/openbmc_project/logging"]}
     ws.send(json.dumps(data))
-    node = getNode()
     config.nodes2poll.put(node)
 
 
-def reportNodeDown(jsonEvent):
+def reportNodeDown(node, error):
     """
         This is called to configure a notification that a bmc is not able to be reached
     """
-    global bmcHostname
-    node = getNode()
     node['pollFailedCount'] = 1
     config.nodes2poll.put(node)
 def isString(var):
@@ -83,38 +79,19 @@ def isString(var):
         return isinstance(var, basestring)
     else:
         return isinstance(var, str)  
-def openSocket(hostname, username, password):
-    """
-        opens a long running websocket to the specified bmc
-    """
-    global bmcHostname
-    bmcHostname = hostname
-    node = getNode()
-    websocket.enableTrace(False)
-    failedConCount = 0
-    for i in range(3):
-        mysession = openbmctool.login(hostname,username, password, True)
-        if not isString(mysession):
-            break;
-        else:
-            failedConCount += 1
-    if failedConCount >=3:
-        reportNodeDown(mysession)
-    else:
-        node['session'] = mysession
-        cookie= mysession.cookies.get_dict()
-        cookieStr = ""
-        for key in cookie:
-            if cookieStr != "":
-                cookieStr = cookieStr + ";"
-            cookieStr = cookieStr + key +"=" + cookie[key]
-        ws = websocket.WebSocketApp("wss://"+hostname+"/subscribe",
-                                  on_message = on_message,
-                                  on_error = on_error,
-                                  on_close = on_close,
-                                  cookie = cookieStr)
-        ws.on_open = on_open
-        ws.run_forever(sslopt={"cert_reqs": ssl.CERT_NONE})
 
+handlers = {'login': login,
+            'on_open': on_open,
+            'on_message': on_message,
+            'on_close': on_close,
+            'on_login_failed': reportNodeDown}
 
-    
+def openSocket(node):
+    """
+        opens a long running websocket to the bmc of the node. The websocket is managed by the 
+        websocketMux event loop instead of a dedicated thread. 
+        
+        @param node: dictionary containing the properties of the node
+    """
+    websocketMux.start()
+    websocketMux.addConnection(node, handlers)
@@ -40,6 +40,15 @@ def initialize():
     else:
         return False
    
+def interestFilter():
+    """
+        Declares the events this plugin wants to receive. Events disabled in the CSM policy table are skipped, 
+        events missing from the table are still forwarded to CSM. 
+    """
+    excluded = [cerID for cerID in config.pluginPolicies['csmPolicy'] 
+                if config.pluginPolicies['csmPolicy'][cerID].get('CSMEnabled') == False]
+    return {'excludeCerIDs': excluded}
+
 def createArgString(cerEvent):
     argString = ""
     index = 0
@@ -17,6 +17,11 @@ import syslog
 import config
 import os
 import subprocess
+import threading
+try:
+    import Queue as queue
+except ImportError:
+    import queue
 
 def errorLogger(severity, message):
     """
@@ -29,44 +34,134 @@ def errorLogger(severity, message):
     syslog.openlog(ident="ibm-crassd", logoption=syslog.LOG_PID|syslog.LOG_NOWAIT)
     syslog.syslog(severity, message)    
 
-def notifymmhealth(cerEvent, impactedNode, entityAttr):
+mmsysmoncPath = '/usr/lpp/mmfs/bin/mmsysmonc'
+eventsToReport = frozenset(["FQPSPPW0006M","FQPSPPW0019I","FQPSPPW0007M","FQPSPPW0016I","FQPSPPW0008M","FQPSPPW0020I",
+                            "FQPSPPW0009M","FQPSPPW0017I","FQPSPPW0010M","FQPSPPW0021I","FQPSPPW0011M","FQPSPPW0018M"])
+defaultWorkers = 8
+workQueue = queue.Queue()
+poolThreads = []
+poolLock = threading.Lock()
+
+def getMaxWorkers():
     """
-         sends alert to mmhealth
-           
+        Gets the maximum number of mmsysmonc commands to run at the same time
+        
+        @return: integer, the size of the worker pool used for batches of events
+    """
+    try:
+        workers = int(config.pluginConfigs['ess']['workers'])
+    except (KeyError, ValueError):
+        workers = defaultWorkers
+    if workers < 1:
+        workers = 1
+    return workers
+
+def raiseEvent(cerEvent, impactedNode, entityAttr):
+    """
+         raises a single event in mmhealth using mmsysmonc
+         
          @param cerEvent: dict, the cerEvent to send
          @param impactedNode; the node that had the alert
          @param entityAttr: dictionary, contains the list of known attributes for the entity to report to
-    """  
-    mmHealthDown = entityAttr['ess']['receiveEntityDown']
-    eventsToReportList = ["FQPSPPW0006M","FQPSPPW0019I","FQPSPPW0007M","FQPSPPW0016I","FQPSPPW0008M","FQPSPPW0020I",
-                          "FQPSPPW0009M","FQPSPPW0017I","FQPSPPW0010M","FQPSPPW0021I","FQPSPPW0011M","FQPSPPW0018M"]
-    eventsToReportList.sort()
-    if os.path.exists('/usr/lpp/mmfs/bin/mmsysmonc'):
-        if(cerEvent['CerID'] in eventsToReportList):
-            result = subprocess.check_output(['/usr/lpp/mmfs/bin/mmsysmonc', 'event', 'powerhw', cerEvent['CerID'], str(cerEvent['compInstance']), impactedNode]).decode('utf-8')
-            if mmHealthDown:
-                with config.lock:
-                    entityAttr['ess']['receiveEntityDown'] = False
-                
-            if "Event "+ cerEvent['CerID'] + " raised" in result:
-                return True
-            else: 
-                errorLogger(syslog.LOG_ERR, "Failed to raise event to mmhealth:" + str(cerEvent['CerID']) + ": "+ str(cerEvent['message']))
-                return False
-        else:
-            return True
-    else:
-        if not mmHealthDown:
+         @return: True if mmhealth accepted the event, False otherwise
+    """
+    try:
+        result = subprocess.check_output([mmsysmoncPath, 'event', 'powerhw', cerEvent['CerID'], str(cerEvent['compInstance']), impactedNode]).decode('utf-8')
+    except (subprocess.CalledProcessError, OSError) as e:
+        errorLogger(syslog.LOG_ERR, "Failed to raise event to mmhealth:" + str(cerEvent['CerID']) + ": " + str(e))
+        return False
+    with config.lock:
+        entityAttr['ess']['receiveEntityDown'] = False
+    if "Event "+ cerEvent['CerID'] + " raised" in result:
+        return True
+    else: 
+        errorLogger(syslog.LOG_ERR, "Failed to raise event to mmhealth:" + str(cerEvent['CerID']) + ": "+ str(cerEvent.get('message')))
+        return False
+
+def startWorkers():
+    """
+        Starts the worker threads that run the mmsysmonc commands. The workers are shared by every 
+        caller of the plugin and kept for the life of the service, so the number of mmsysmonc commands 
+        running at the same time never exceeds the configured number of workers. 
+    """
+    with poolLock:
+        while len(poolThreads) < getMaxWorkers():
+            t = threading.Thread(target=poolWorker, name="essWorker-" + str(len(poolThreads)))
+            t.daemon = True
+            t.start()
+            poolThreads.append(t)
+
+def poolWorker():
+    """
+        Raises the events placed in the work queue. Run in the worker threads of the plugin. 
+    """
+    while True:
+        item = workQueue.get()
+        try:
+            item['result'] = raiseEvent(item['event'], item['node'], item['entityAttr'])
+        except Exception as e:
+            errorLogger(syslog.LOG_ERR, "Failed to raise event to mmhealth:" + str(item['event'].get('CerID')) + ": " + str(e))
+            item['result'] = False
+        finally:
+            item['done'].set()
+
+def notifymmhealthBatch(eventBatch, entityAttr):
+    """
+         sends a batch of alerts to mmhealth. The mmsysmonc commands for the batch are run in parallel
+         by the worker threads of the plugin. 
+           
+         @param eventBatch: list of (cerEvent, impactedNode) tuples to send
+         @param entityAttr: dictionary, contains the list of known attributes for the entity to report to
+         @return: list of booleans, True for each event successfully reported or not needing to be reported
+    """
+    if not os.path.exists(mmsysmoncPath):
+        if not entityAttr['ess']['receiveEntityDown']:
             errorLogger(syslog.LOG_CRIT, "Unable to find mmsysmonc. Ensure the utility is installed properly and part of the PATH")
             with config.lock:
                 entityAttr['ess']['receiveEntityDown'] = True
+        return [False] * len(eventBatch)
     
-    return False
+    items = []
+    for cerEvent, impactedNode in eventBatch:
+        if cerEvent['CerID'] in eventsToReport:
+            items.append({'event': cerEvent, 'node': impactedNode, 'entityAttr': entityAttr, 
+                          'result': False, 'done': threading.Event()})
+        else:
+            items.append(None)
+    if any(items):
+        startWorkers()
+        for item in items:
+            if item is not None:
+                workQueue.put(item)
+    results = []
+    for item in items:
+        if item is None:
+            results.append(True)
+        else:
+            item['done'].wait()
+            results.append(item['result'])
+    return results
+
+def notifymmhealth(cerEvent, impactedNode, entityAttr):
+    """
+         sends alert to mmhealth
+           
+         @param cerEvent: dict, the cerEvent to send
+         @param impactedNode; the node that had the alert
+         @param entityAttr: dictionary, contains the list of known attributes for the entity to report to
+    """  
+    return notifymmhealthBatch([(cerEvent, impactedNode)], entityAttr)[0]
+
+def interestFilter():
+    """
+        Declares the events this plugin wants to receive. Only the powerhw events are sent to mmhealth. 
+    """
+    return {'CerIDs': eventsToReport}
 
 def initialize():
     """
         Initializes the plugin and checks to see if the powerhw component of mmhealth has been initialized.
-        
+        When it is still checking, a healthy event is raised for every monitored node as a single batch.
     """
     result = subprocess.check_output(['/usr/lpp/mmfs/bin/mmhealth', 'node', 'show', 'powerhw']).decode('utf-8')
     lines = result.split('\n')
@@ -74,7 +169,7 @@ def initialize():
     for line in lines:
         if 'POWERHW' in line:
             if 'CHECKING' in line:
-                for node in config.mynodelist:
-                    notifymmhealth(healthyAlert, node['xcatNodeName'], config.notifyList)
+                eventBatch = [(healthyAlert, node['xcatNodeName']) for node in config.mynodelist]
+                notifymmhealthBatch(eventBatch, config.notifyList)
                 break
     return True
@@ -0,0 +1,136 @@
+#  Copyright 2017 IBM Corporation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""
+    Computes the aggregate sensors configured in the telemetry_aggregates section, such as the total
+    power of the cluster or the highest GPU temperature of a rack, in the socket server process. They
+    are sent to the clients as the sensors of a virtual node named aggregates, so a dashboard can
+    subscribe to a few numbers instead of the readings of every node.
+
+    Each aggregate has the positions in the shared memory sensor table of the sensors it covers. All of
+    the aggregates using the same function are computed together, with one read of their sensors from
+    the table and one reduction, once per update interval.
+"""
+import syslog
+import config
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+global enabled
+enabled = False
+global aggregates
+aggregates = []
+global aggregateValues
+aggregateValues = {}
+global groups
+groups = None
+global table
+table = None
+global aggregateFunctions
+aggregateFunctions = ['sum', 'avg', 'min', 'max', 'count']
+
+def setup(sensorTable):
+    """
+        Prepares the aggregates configured in config.telemAggregates
+
+        @param sensorTable: the shared memory sensor table
+        @return: True if aggregates are computed
+    """
+    global enabled
+    global table
+    if not config.telemAggregates:
+        return False
+    if numpy is None:
+        config.errorLogger(syslog.LOG_WARNING, "The numpy package is not installed, telemetry aggregates are disabled.")
+        return False
+    table = {'values': numpy.frombuffer(sensorTable['values'], dtype=numpy.float64),
+             'scales': numpy.frombuffer(sensorTable['scales'], dtype=numpy.float64)}
+    for definition in config.telemAggregates:
+        aggregate = dict(definition)
+        aggregate['indexes'] = numpy.zeros(0, dtype=numpy.intp)
+        aggregate['type'] = ['count', ''] if aggregate['function'] == 'count' else None
+        aggregates.append(aggregate)
+    enabled = True
+    return True
+
+def getNames():
+    """
+        Returns the names of the aggregates, in configuration order
+    """
+    return [aggregate['name'] for aggregate in aggregates]
+
+def setIndexes(aggregate, indexes, sensorType):
+    """
+        Sets the sensors covered by an aggregate
+
+        @param aggregate: dictionary describing the aggregate
+        @param indexes: list of the positions in the sensor table of the sensors
+        @param sensorType: the type and unit of the sensors, used as the type of the aggregate
+    """
+    global groups
+    aggregate['indexes'] = numpy.array(indexes, dtype=numpy.intp)
+    if aggregate['function'] != 'count' and sensorType is not None:
+        aggregate['type'] = list(sensorType)
+    groups = None
+
+def buildGroups():
+    """
+        Groups the aggregates with sensors by function. Each group has the positions of the sensors of
+        all of its aggregates one after the other, and the offset where each aggregate starts.
+    """
+    global groups
+    groups = []
+    for function in ['sum', 'avg', 'min', 'max']:
+        members = [aggregate for aggregate in aggregates if aggregate['function'] == function and len(aggregate['indexes'])]
+        if not members:
+            continue
+        counts = numpy.array([len(aggregate['indexes']) for aggregate in members])
+        groups.append({'function': function,
+                       'names': [aggregate['name'] for aggregate in members],
+                       'indexes': numpy.concatenate([aggregate['indexes'] for aggregate in members]),
+                       'offsets': numpy.concatenate(([0], numpy.cumsum(counts)[:-1])),
+                       'counts': counts})
+
+def compute():
+    """
+        Computes the aggregates from the current readings in the sensor table. Aggregates without any
+        sensors have no value.
+    """
+    global aggregateValues
+    if not enabled:
+        return
+    if groups is None:
+        buildGroups()
+    values = {}
+    for aggregate in aggregates:
+        values[aggregate['name']] = float(len(aggregate['indexes'])) if aggregate['function'] == 'count' else None
+    for group in groups:
+        index = group['indexes']
+        sample = table['values'][index] * table['scales'][index]
+        if group['function'] == 'min':
+            results = numpy.minimum.reduceat(sample, group['offsets'])
+        elif group['function'] == 'max':
+            results = numpy.maximum.reduceat(sample, group['offsets'])
+        else:
+            results = numpy.add.reduceat(sample, group['offsets'])
+            if group['function'] == 'avg':
+                results = results / group['counts']
+        for name, result in zip(group['names'], results.tolist()):
+            values[name] = result
+    readings = {}
+    for aggregate in aggregates:
+        readings[aggregate['name']] = {'value': values[aggregate['name']], 'scale': 1, 'type': aggregate['type']}
+    aggregateValues = readings
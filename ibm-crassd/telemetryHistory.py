@@ -0,0 +1,408 @@
+#  Copyright 2017 IBM Corporation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""
+    Keeps a recent history of the telemetry readings in the socket server process. Every update interval
+    the readings of all of the sensors are copied from the shared memory sensor table into a ring buffer
+    of raw samples, and added into the minimum, maximum and average of the current 10 second and 1 minute
+    buckets. Finished buckets are kept in ring buffers of their own.
+
+    Each sensor is a column in the arrays, so recording a sample is a few array operations no matter how
+    many nodes are monitored. The number of samples and buckets are fixed by the configuration, so the
+    memory used by each sensor is known up front.
+
+    When a history directory is configured, the 1 minute buckets are also written to disk in segment
+    files, so ranges older than the buckets kept in memory can still be answered.
+"""
+import threading
+import syslog
+import json
+import os
+import time
+import config
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+global enabled
+enabled = False
+global history
+history = None
+global historyLock
+historyLock = threading.Lock()
+global segmentBuckets
+segmentBuckets = 60
+global tierSeconds
+tierSeconds = {'10s': 10, '1m': 60}
+
+def setup(sensorTable):
+    """
+        Prepares the history for the sensors in the shared memory sensor table. Columns are added as the
+        catalogues of the nodes are received.
+
+        @param sensorTable: the shared memory sensor table
+        @return: True if history is kept
+    """
+    global history
+    global enabled
+    if config.telemHistorySamples <= 0:
+        return False
+    if numpy is None:
+        config.errorLogger(syslog.LOG_WARNING, "The numpy package is not installed, telemetry history is disabled.")
+        return False
+    tiers = []
+    for name, buckets in (('10s', config.telemHistory10sBuckets), ('1m', config.telemHistory1mBuckets)):
+        if buckets > 0:
+            tiers.append({'name': name,
+                          'seconds': tierSeconds[name],
+                          'buckets': buckets,
+                          'pos': 0,
+                          'bucketStart': None,
+                          'sinceSegment': 0,
+                          'times': numpy.full(buckets, numpy.nan)})
+    history = {'values': numpy.frombuffer(sensorTable['values'], dtype=numpy.float64),
+               'scales': numpy.frombuffer(sensorTable['scales'], dtype=numpy.float64),
+               'rowSize': sensorTable['rowSize'],
+               'samples': config.telemHistorySamples,
+               'pos': 0,
+               'times': numpy.full(config.telemHistorySamples, numpy.nan),
+               'tiers': tiers,
+               'columns': {},
+               'nodeSlots': {},
+               'used': 0,
+               'capacity': 0}
+    resizeColumns(0)
+    if config.telemHistoryDir:
+        try:
+            if not os.path.isdir(config.telemHistoryDir):
+                os.makedirs(config.telemHistoryDir)
+        except OSError as e:
+            config.errorLogger(syslog.LOG_ERR, "Unable to create the telemetry history directory {path}: {err}".format(path=config.telemHistoryDir, err=e))
+    config.errorLogger(syslog.LOG_INFO, "Telemetry history keeps {samples} samples and {buckets} buckets, using {size} bytes for each sensor.".format(
+        samples=history['samples'], buckets=sum(tier['buckets'] for tier in tiers), size=getSensorSize()))
+    enabled = True
+    return True
+
+def columnArrays():
+    """
+        Lists the arrays holding a column for each sensor
+
+        @return: list of tuples with the dictionary holding the array, its key, the value of an empty
+                 column, the data type and the number of rows, or None for one dimensional arrays
+    """
+    arrays = [(history, 'raw', numpy.nan, numpy.float32, history['samples']),
+              (history, 'tableIndex', 0, numpy.intp, None)]
+    for tier in history['tiers']:
+        for key in ('min', 'max', 'avg'):
+            arrays.append((tier, key, numpy.nan, numpy.float32, tier['buckets']))
+        arrays.append((tier, 'accSum', 0, numpy.float64, None))
+        arrays.append((tier, 'accMin', numpy.inf, numpy.float64, None))
+        arrays.append((tier, 'accMax', -numpy.inf, numpy.float64, None))
+        arrays.append((tier, 'accCount', 0, numpy.int32, None))
+    return arrays
+
+def getSensorSize():
+    """
+        Returns the number of bytes of history kept for each sensor
+    """
+    size = 0
+    for holder, key, fill, dtype, rows in columnArrays():
+        size += numpy.dtype(dtype).itemsize * (1 if rows is None else rows)
+    return size
+
+def resizeColumns(capacity):
+    """
+        Reallocates the history arrays with room for a number of sensors. The columns of the nodes are
+        copied in order, which drops the columns left behind by nodes whose catalogue changed.
+
+        @param capacity: the number of sensor columns to allocate
+    """
+    order = sorted(history['columns'].items(), key=lambda item: item[1][0])
+    keep = [column for nodeID, (start, count) in order for column in range(start, start + count)]
+    for holder, key, fill, dtype, rows in columnArrays():
+        shape = (capacity,) if rows is None else (rows, capacity)
+        newArray = numpy.full(shape, fill, dtype=dtype)
+        if key in holder and keep:
+            newArray[..., :len(keep)] = holder[key][..., keep]
+        holder[key] = newArray
+    start = 0
+    for nodeID, (oldStart, count) in order:
+        history['columns'][nodeID] = (start, count)
+        start += count
+    history['used'] = start
+    history['capacity'] = capacity
+
+def setNodeSensors(nodeID, paths):
+    """
+        Gives a node a column for each sensor in its catalogue. The previous history of the node is
+        cleared, since it was recorded for other sensors.
+
+        @param nodeID: the nodeID of the node
+        @param paths: the full paths of the sensors in the catalogue of the node, in slot order
+    """
+    if not enabled:
+        return
+    sensorCount = len(paths)
+    with historyLock:
+        history['nodeSlots'][nodeID] = dict((path, slot) for slot, path in enumerate(paths))
+        columns = history['columns']
+        current = columns.get(nodeID)
+        if current is not None and current[1] == sensorCount:
+            start = current[0]
+            for holder, key, fill, dtype, rows in columnArrays():
+                holder[key][..., start:start + sensorCount] = fill
+        else:
+            columns.pop(nodeID, None)
+            if history['used'] + sensorCount > history['capacity']:
+                live = sum(count for start, count in columns.values()) + sensorCount
+                resizeColumns(max(2 * live, 64))
+            start = history['used']
+            history['used'] += sensorCount
+            columns[nodeID] = (start, sensorCount)
+        history['tableIndex'][start:start + sensorCount] = numpy.arange(sensorCount) + nodeID * history['rowSize']
+
+def closeBucket(tier):
+    """
+        Stores the minimum, maximum and average of the finished bucket of a tier and starts a new one
+
+        @param tier: dictionary holding the buckets of the tier
+    """
+    used = history['used']
+    pos = tier['pos']
+    count = tier['accCount'][:used]
+    empty = count == 0
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        tier['avg'][pos, :used] = tier['accSum'][:used] / count
+    tier['min'][pos, :used] = numpy.where(empty, numpy.nan, tier['accMin'][:used])
+    tier['max'][pos, :used] = numpy.where(empty, numpy.nan, tier['accMax'][:used])
+    tier['times'][pos] = tier['bucketStart']
+    tier['pos'] = (pos + 1) % tier['buckets']
+    if tier['name'] == '1m' and config.telemHistoryDir:
+        tier['sinceSegment'] += 1
+        if tier['sinceSegment'] >= min(segmentBuckets, tier['buckets']):
+            writeSegment(tier, tier['sinceSegment'])
+            tier['sinceSegment'] = 0
+    tier['accSum'].fill(0)
+    tier['accMin'].fill(numpy.inf)
+    tier['accMax'].fill(-numpy.inf)
+    tier['accCount'].fill(0)
+
+def record(now):
+    """
+        Records the current readings of all of the sensors. Called once per update interval.
+
+        @param now: the time of the sample, in seconds since the epoch
+    """
+    if not enabled:
+        return
+    with historyLock:
+        used = history['used']
+        index = history['tableIndex'][:used]
+        sample = history['values'][index] * history['scales'][index]
+        pos = history['pos']
+        history['raw'][pos, :used] = sample
+        history['times'][pos] = now
+        history['pos'] = (pos + 1) % history['samples']
+        for tier in history['tiers']:
+            bucketStart = now - now % tier['seconds']
+            if tier['bucketStart'] is not None and bucketStart != tier['bucketStart']:
+                closeBucket(tier)
+            tier['bucketStart'] = bucketStart
+            numpy.add(tier['accSum'][:used], sample, out=tier['accSum'][:used])
+            numpy.fmin(tier['accMin'][:used], sample, out=tier['accMin'][:used])
+            numpy.fmax(tier['accMax'][:used], sample, out=tier['accMax'][:used])
+            tier['accCount'][:used] += 1
+
+def getColumnMap():
+    """
+        Returns the column of each sensor, by xCAT node name and full sensor path
+    """
+    columnMap = {}
+    for nodeID, (start, count) in history['columns'].items():
+        node = config.getNodeByID(nodeID)
+        if node is None:
+            continue
+        columnMap[node['xcatNodeName']] = dict((path, start + slot) for path, slot in history['nodeSlots'][nodeID].items())
+    return columnMap
+
+def writeSegment(tier, count):
+    """
+        Writes the last buckets of a tier to a segment file in the history directory. The buckets are 
+        copied here and written by a separate thread, so the sampling is not held up by the disk.
+
+        @param tier: dictionary holding the buckets of the tier
+        @param count: the number of buckets to write
+    """
+    used = history['used']
+    rows = (numpy.arange(tier['pos'] - count, tier['pos'])) % tier['buckets']
+    segment = {'times': tier['times'][rows],
+               'min': tier['min'][rows, :used],
+               'max': tier['max'][rows, :used],
+               'avg': tier['avg'][rows, :used],
+               'columns': numpy.array(json.dumps(getColumnMap()))}
+    writer = threading.Thread(target=saveSegment, args=[segment])
+    writer.daemon = True
+    writer.start()
+
+def saveSegment(segment):
+    """
+        Saves a segment of buckets to the history directory and removes the segments older than
+        telemetryHistoryDays. Segment files are named after the times of their first and last buckets.
+
+        @param segment: dictionary with the arrays of the segment
+    """
+    try:
+        filename = os.path.join(config.telemHistoryDir, "telemetry-{first}-{last}.npz".format(
+            first=int(segment['times'][0]), last=int(segment['times'][-1])))
+        with open(filename + '.tmp', 'wb') as segmentFile:
+            numpy.savez_compressed(segmentFile, **segment)
+        os.rename(filename + '.tmp', filename)
+        oldest = time.time() - config.telemHistoryDays * 86400
+        for first, last, path in listSegments():
+            if last < oldest:
+                os.remove(path)
+    except Exception as e:
+        config.errorLogger(syslog.LOG_ERR, "Unable to write a telemetry history segment: {err}".format(err=e))
+
+def listSegments():
+    """
+        Returns the segment files in the history directory
+
+        @return: list of tuples with the times of the first and last buckets and the path of the file, oldest first
+    """
+    segments = []
+    if not config.telemHistoryDir or not os.path.isdir(config.telemHistoryDir):
+        return segments
+    for filename in os.listdir(config.telemHistoryDir):
+        parts = filename[:-len('.npz')].split('-')
+        if not filename.endswith('.npz') or len(parts) != 3 or parts[0] != 'telemetry':
+            continue
+        try:
+            segments.append((int(parts[1]), int(parts[2]), os.path.join(config.telemHistoryDir, filename)))
+        except ValueError:
+            continue
+    return sorted(segments)
+
+def takeColumns(array, rows, cols):
+    """
+        Returns the rows of the selected columns of an array, with missing columns set to NaN
+
+        @param array: two dimensional array with a row for each time
+        @param rows: array of the rows to take
+        @param cols: array of the columns to take, -1 for sensors without history
+        @return: array with a row for each time and a column for each sensor
+    """
+    data = array[numpy.ix_(rows, numpy.maximum(cols, 0))].astype(numpy.float64)
+    data[:, cols < 0] = numpy.nan
+    return data
+
+def readSegments(pairs, start, end, before):
+    """
+        Reads the 1 minute buckets of the selected sensors from the segment files, one file at a time
+
+        @param pairs: list of tuples with the xCAT node name and full path of each sensor
+        @param start: the time of the first bucket to read
+        @param end: the time of the last bucket to read
+        @param before: only buckets before this time are read, newer ones are in memory
+        @return: yields a tuple with the array of times and the dictionary with the min, max and avg 
+                 arrays of each file, oldest first
+    """
+    for first, last, path in listSegments():
+        if last < start or first > end or first >= before:
+            continue
+        try:
+            with numpy.load(path) as segment:
+                columnMap = json.loads(str(segment['columns']))
+                cols = numpy.array([columnMap.get(xcatNodeName, {}).get(sensorPath, -1) for xcatNodeName, sensorPath in pairs], dtype=numpy.intp)
+                segmentTimes = segment['times']
+                rows = numpy.nonzero((segmentTimes >= start) & (segmentTimes <= end) & (segmentTimes < before))[0]
+                times = segmentTimes[rows]
+                data = dict((key, takeColumns(segment[key], rows, cols)) for key in ('min', 'max', 'avg'))
+        except Exception as e:
+            config.errorLogger(syslog.LOG_ERR, "Unable to read the telemetry history segment {path}: {err}".format(path=path, err=e))
+            continue
+        if len(times):
+            yield times, data
+
+def getResolution(start):
+    """
+        Returns the finest resolution that still holds the readings at a time
+        
+        @param start: the time of the first reading wanted
+    """
+    with historyLock:
+        oldest = numpy.nanmin(history['times']) if not numpy.isnan(history['times']).all() else None
+        if oldest is not None and oldest <= start:
+            return 'raw'
+        for tier in history['tiers']:
+            if not numpy.isnan(tier['times']).all() and numpy.nanmin(tier['times']) <= start:
+                return tier['name']
+    if history['tiers']:
+        return history['tiers'][-1]['name']
+    return 'raw'
+
+def query(selection, start, end, resolution):
+    """
+        Yields the history of the selected sensors over a time range. Raw samples hold a value for 
+        each time, the 10 second and 1 minute resolutions hold the minimum, maximum and average of each 
+        bucket. 1 minute buckets older than the ones kept in memory are read from the segment files,
+        one file for each piece of the answer, so a long range is never loaded all at once.
+        
+        @param selection: list of tuples with the xCAT node name, the nodeID and the full paths of the 
+                          sensors of each node
+        @param start: the time of the first reading, in seconds since the epoch
+        @param end: the time of the last reading, in seconds since the epoch
+        @param resolution: raw, 10s or 1m
+        @return: yields tuples with an array of times, and a dictionary of arrays with a row for each 
+                 time and a column for each selected sensor, keyed by value for raw samples or min, max 
+                 and avg, oldest first. The last piece holds the readings in memory and can be empty.
+    """
+    pairs = [(xcatNodeName, path) for xcatNodeName, nodeID, paths in selection for path in paths]
+    before = None
+    with historyLock:
+        cols = []
+        for xcatNodeName, nodeID, paths in selection:
+            current = history['columns'].get(nodeID)
+            nodeSlots = history['nodeSlots'].get(nodeID, {})
+            for path in paths:
+                cols.append(-1 if current is None or path not in nodeSlots else current[0] + nodeSlots[path])
+        cols = numpy.array(cols, dtype=numpy.intp)
+        tier = None
+        for candidate in history['tiers']:
+            if candidate['name'] == resolution:
+                tier = candidate
+        if resolution == 'raw':
+            order = (history['pos'] + numpy.arange(history['samples'])) % history['samples']
+            times = history['times'][order]
+            rows = order[(times >= start) & (times <= end)]
+            memTimes = history['times'][rows]
+            memData = {'value': takeColumns(history['raw'], rows, cols)}
+        elif tier is None:
+            memTimes = numpy.zeros(0)
+            memData = dict((key, numpy.zeros((0, len(pairs)))) for key in ('min', 'max', 'avg'))
+        else:
+            order = (tier['pos'] + numpy.arange(tier['buckets'])) % tier['buckets']
+            times = tier['times'][order]
+            rows = order[(times >= start) & (times <= end)]
+            memTimes = tier['times'][rows]
+            memData = dict((key, takeColumns(tier[key], rows, cols)) for key in ('min', 'max', 'avg'))
+            if numpy.isnan(times).all():
+                before = float('inf')
+            else:
+                before = numpy.nanmin(times)
+    if resolution == '1m' and tier is not None and config.telemHistoryDir:
+        for piece in readSegments(pairs, start, end, before):
+            yield piece
+    yield memTimes, memData
@@ -0,0 +1,269 @@
+#  Copyright 2017 IBM Corporation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""
+    Checks the telemetry readings against the rules configured in the telemetry_rules section, in the
+    socket server process. A rule covers a class of sensors, given by a sensor name, the start of the
+    sensor names or a sensor type, on every node or on a noderange. It can have a high and a low
+    threshold, with a hysteresis a reading has to move back past before it is normal again, and a
+    largest change per second. An event is raised when a sensor breaks a limit and again when it is
+    back within its limits, so the notify entities hear about an overheating GPU without waiting for
+    the BMC to log it, and without polling the BMC.
+
+    The sensors of all of the rules are checked together, with one read of the sensor table and a few
+    array comparisons, once per update interval. Only the sensors changing state become events.
+"""
+import syslog
+import config
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+global enabled
+enabled = False
+global rules
+rules = []
+global checks
+checks = None
+global table
+table = None
+global lastCheck
+lastCheck = None
+#set when the sensors of a rule changed and the checks have to be built again
+global sensorsChanged
+sensorsChanged = False
+#event IDs raised by the rules, described in the CSM policy table
+global ruleEventIDs
+ruleEventIDs = {'high': 'FQPSPEM0004M', 'low': 'FQPSPEM0005M', 'rate': 'FQPSPEM0006M', 'normal': 'FQPSPEM0007I',
+                'rateNormal': 'FQPSPEM0008I', 'thresholdNormal': 'FQPSPEM0009I'}
+#states that are a broken limit, the others are the end of one
+global ruleViolations
+ruleViolations = ['high', 'low', 'rate']
+
+def setup(sensorTable):
+    """
+        Prepares the rules configured in config.telemRules
+
+        @param sensorTable: the shared memory sensor table
+        @return: True if rules are checked
+    """
+    global enabled
+    global table
+    if not config.telemRules:
+        return False
+    if numpy is None:
+        config.errorLogger(syslog.LOG_WARNING, "The numpy package is not installed, telemetry rules are disabled.")
+        return False
+    table = {'values': numpy.frombuffer(sensorTable['values'], dtype=numpy.float64),
+             'scales': numpy.frombuffer(sensorTable['scales'], dtype=numpy.float64),
+             'ready': numpy.frombuffer(sensorTable['ready'], dtype=numpy.int8)}
+    for definition in config.telemRules:
+        rule = dict(definition)
+        rule['indexes'] = []
+        rule['sensors'] = []
+        rules.append(rule)
+    enabled = True
+    return True
+
+def setSensors(rule, indexes, sensors):
+    """
+        Sets the sensors checked by a rule
+
+        @param rule: dictionary describing the rule
+        @param indexes: list of the positions in the sensor table of the sensors
+        @param sensors: list with the nodeID and the name of each sensor
+    """
+    global sensorsChanged
+    rule['indexes'] = list(indexes)
+    rule['sensors'] = list(sensors)
+    sensorsChanged = True
+
+def ruleLimits(name, default, ruleOf):
+    """
+        Returns an array with a limit of the rule of every checked sensor, unset limits get the default
+    """
+    limits = numpy.array([default if rule[name] is None else rule[name] for rule in rules], dtype=numpy.float64)
+    return limits[ruleOf]
+
+def buildChecks():
+    """
+        Puts the sensors of all of the rules one after the other, with the limits of their rule next to
+        them. Sensors that were already checked keep their state, so a catalogue change doesn't raise
+        the events of a problem again.
+    """
+    global checks
+    global sensorsChanged
+    sensorsChanged = False
+    keys = []
+    indexes = []
+    ruleOf = []
+    for num, rule in enumerate(rules):
+        for index, sensor in zip(rule['indexes'], rule['sensors']):
+            keys.append((rule['name'], sensor[0], sensor[1]))
+            indexes.append(index)
+            ruleOf.append(num)
+    ruleOf = numpy.array(ruleOf, dtype=numpy.intp)
+    count = len(keys)
+    newChecks = {'keys': keys,
+                 'indexes': numpy.array(indexes, dtype=numpy.intp),
+                 'nodeIDs': numpy.array([key[1] for key in keys], dtype=numpy.intp),
+                 'high': ruleLimits('high', numpy.inf, ruleOf),
+                 'low': ruleLimits('low', -numpy.inf, ruleOf),
+                 'hysteresis': ruleLimits('hysteresis', 0, ruleOf),
+                 'rate': ruleLimits('rate', numpy.inf, ruleOf),
+                 'rateHold': ruleLimits('ratehold', 0, ruleOf),
+                 #1 above the high threshold, -1 below the low threshold
+                 'level': numpy.zeros(count, dtype=numpy.int8),
+                 #the time a rate of change violation can clear, 0 when there is none
+                 'fastUntil': numpy.zeros(count, dtype=numpy.float64),
+                 'last': numpy.full(count, numpy.nan)}
+    if checks is not None and count:
+        oldPositions = dict((key, pos) for pos, key in enumerate(checks['keys']))
+        old = numpy.array([oldPositions.get(key, -1) for key in keys], dtype=numpy.intp)
+        kept = old >= 0
+        for name in ['level', 'fastUntil', 'last']:
+            newChecks[name][kept] = checks[name][old[kept]]
+    checks = newChecks
+
+def check(now):
+    """
+        Checks the current readings in the sensor table against the rules. Nodes without readings yet
+        are skipped.
+
+        @param now: the time of the check, in seconds since the epoch
+        @return: list of dictionaries describing the sensors that changed state
+    """
+    global lastCheck
+    if not enabled:
+        return []
+    if checks is None or sensorsChanged:
+        buildChecks()
+    index = checks['indexes']
+    if not len(index):
+        lastCheck = now
+        return []
+    values = table['values'][index] * table['scales'][index]
+    ready = table['ready'][checks['nodeIDs']] != 0
+    level = checks['level']
+
+    #thresholds, a sensor is normal again once it is back past the threshold by the hysteresis
+    newLevel = level.copy()
+    newLevel[ready & (((level == 1) & (values <= checks['high'] - checks['hysteresis'])) |
+                      ((level == -1) & (values >= checks['low'] + checks['hysteresis'])))] = 0
+    newLevel[ready & (values > checks['high'])] = 1
+    newLevel[ready & (values < checks['low'])] = -1
+
+    #rate of change since the last check, a violation clears once the rate stayed within the limit for the hold time
+    fastUntil = checks['fastUntil']
+    if lastCheck is not None and now > lastCheck:
+        with numpy.errstate(invalid='ignore'):
+            tooFast = ready & (numpy.abs(values - checks['last']) / (now - lastCheck) > checks['rate'])
+    else:
+        tooFast = numpy.zeros(len(index), dtype=bool)
+    startFast = tooFast & (fastUntil == 0)
+    endFast = ~tooFast & (fastUntil > 0) & (fastUntil <= now)
+    newFastUntil = numpy.where(tooFast, now + checks['rateHold'], numpy.where(endFast, 0, fastUntil))
+
+    #the sensor is only back within all of its limits once neither a threshold nor the rate is broken,
+    #the end of one of them while the other is still broken has its own event
+    transitions = []
+    for pos in numpy.flatnonzero(newLevel != level).tolist():
+        if newLevel[pos] == 1:
+            transitions.append(describe(pos, 'high', values[pos], checks['high'][pos]))
+        elif newLevel[pos] == -1:
+            transitions.append(describe(pos, 'low', values[pos], checks['low'][pos]))
+        else:
+            limit = checks['high'][pos] if level[pos] == 1 else checks['low'][pos]
+            state = 'normal' if newFastUntil[pos] == 0 else 'thresholdNormal'
+            transitions.append(describe(pos, state, values[pos], limit))
+    for pos in numpy.flatnonzero(startFast).tolist():
+        transitions.append(describe(pos, 'rate', values[pos], checks['rate'][pos], checks['last'][pos]))
+    for pos in numpy.flatnonzero(endFast).tolist():
+        if newLevel[pos] != 0:
+            transitions.append(describe(pos, 'rateNormal', values[pos], checks['rate'][pos]))
+        elif level[pos] == 0:
+            transitions.append(describe(pos, 'normal', values[pos], checks['rate'][pos]))
+
+    checks['level'] = newLevel
+    checks['fastUntil'] = newFastUntil
+    checks['last'] = numpy.where(ready, values, checks['last'])
+    lastCheck = now
+    return transitions
+
+def describe(pos, state, value, limit, previous=None):
+    """
+        Returns the description of a sensor changing state
+
+        @param pos: the position of the sensor in the checks
+        @param state: high, low or rate for a broken limit, rateNormal when the rate is back within its
+                      limit while a threshold is still broken, thresholdNormal when the reading is back
+                      within the thresholds while the rate is still broken, normal when it is back within
+                      all of them
+        @param value: the reading of the sensor
+        @param limit: the limit broken, or the limit the sensor is back within
+        @param previous: the reading at the last check, for rate of change violations
+        @return: dictionary with the rule, nodeID, sensor, state, value, limit and previous reading
+    """
+    ruleName, nodeID, sensor = checks['keys'][pos]
+    return {'rule': ruleName, 'nodeID': nodeID, 'sensor': sensor, 'state': state,
+            'value': float(value), 'limit': float(limit), 'previous': None if previous is None else float(previous)}
+
+def createEvent(transition, timestamp):
+    """
+        Creates the event for a sensor changing state, with the same properties as the events
+        read from the BMCs.
+
+        @param transition: dictionary describing the change, from check
+        @param timestamp: the time of the change, in seconds since the epoch
+        @return: dictionary containing all the alert properties
+    """
+    sensor = transition['sensor']
+    reading = "{value:g}".format(value=transition['value'])
+    limit = "{limit:g}".format(limit=transition['limit'])
+    if transition['state'] == 'high':
+        message = "Telemetry sensor {sensor} is above its high threshold".format(sensor=sensor)
+        details = "reading {value} above the high threshold {limit}".format(value=reading, limit=limit)
+    elif transition['state'] == 'low':
+        message = "Telemetry sensor {sensor} is below its low threshold".format(sensor=sensor)
+        details = "reading {value} below the low threshold {limit}".format(value=reading, limit=limit)
+    elif transition['state'] == 'rate':
+        message = "Telemetry sensor {sensor} is changing faster than allowed".format(sensor=sensor)
+        details = "reading changed from {previous:g} to {value} faster than {limit} per second".format(
+            previous=transition['previous'], value=reading, limit=limit)
+    elif transition['state'] == 'thresholdNormal':
+        message = "Telemetry sensor {sensor} is back within its thresholds".format(sensor=sensor)
+        details = "reading {value} back within the threshold {limit}".format(value=reading, limit=limit)
+    elif transition['state'] == 'rateNormal':
+        message = "Telemetry sensor {sensor} is no longer changing faster than allowed".format(sensor=sensor)
+        details = "reading {value} changing within {limit} per second".format(value=reading, limit=limit)
+    else:
+        message = "Telemetry sensor {sensor} is back within its limits".format(sensor=sensor)
+        details = "reading {value}".format(value=reading)
+    violation = transition['state'] in ruleViolations
+    return {'CerID': ruleEventIDs[transition['state']],
+            'message': message,
+            'lengthyDescription': "Raised by the telemetry rule {rule} of ibm-crassd.".format(rule=transition['rule']),
+            'serviceable': 'Yes' if violation else 'No',
+            'callHome': 'No',
+            'severity': 'Critical' if violation else 'Information',
+            'eventType': 'Environmental' if violation else 'Recovery',
+            'vmMigration': 'False',
+            'subSystem': 'Systems Management - Events / Monitoring',
+            'userAction': 'Check the node and the readings of the sensor.' if violation else '',
+            'compInstance': sensor,
+            'timestamp': str(int(timestamp)),
+            'sensor': sensor,
+            'state': 'Asserted' if violation else 'Deasserted',
+            'additionalDetails': "rule {rule}: {details}".format(rule=transition['rule'], details=details)}
@@ -18,19 +18,22 @@
 """
     This module establishes websocket connections to all the managed bmcs then starts a socket based server.
     With the socket server, clients can subscribe to a stream of sensor readings using filters. Filters
-    can be based on sensor name and sensor type. A client can also adjust the frequency to a maximum rate of
+    can be based on sensor name, sensor type and node. A client can also adjust the frequency to a maximum rate of
     once per second. 
     
-    This module when establishing websocket connections, will assign a maximum of 50 nodes per subprocess. 
-    Each of the subprocesses will collect the push notification, and process it into the sensor data dictionary
-    structure. The socket server also establishes it's own subprocess so it can handle dealing with multiple
-    clients. Each websocket subprocess will receive an average rate of 2.5 Mbps worth per 50 monitored nodes.
+    This module when establishing websocket connections, will split the nodes between gatherer subprocesses, 
+    one for each core not needed by the other processes but no more than one for every 50 nodes, unless 
+    telemetryGatherers sets the number. Each of the subprocesses will collect the push notification, and 
+    process it into the shared sensor table. The socket server also establishes it's own subprocess so it can 
+    handle dealing with multiple clients. A gatherer will receive an average rate of 2.5 Mbps worth per 50 
+    monitored nodes. When telemetryRebalanceInterval is set, nodes are moved away from gatherers that fall 
+    behind. A moved node is only opened by its new gatherer once the old one has closed its websocket.
     
     The socket server will listen on all established network interfaces including the local host. This allows
     telemetry data to be streamed to a local service, or to a remote monitoring application. 
     
-    In the event of a connection loss to a BMC this module will also work on establishing a new connection
-    to the BMC and should only surface one connection loss message after 3 attempts of failing to reconnect. 
+    In the event of a connection loss to a BMC, websocketMux reconnects to the BMC with exponential backoff 
+    and this module should only surface one connection loss message, once reconnecting failed more than 3 times. 
     This error message will be sent to the established plugins to forward to a configured log manager like ELK. 
 """
 import websocket
@@ -50,10 +53,19 @@ import subprocess
 import os
 import socket
 import struct
+import bisect
+import heapq
+import math
+import zlib
 import config
 import syslog
 import signal
-import select
+import selectors
+import websocketMux
+import tlsSessions
+import telemetryHistory
+import telemetryAggregates
+import telemetryRules
 
 def sigHandler(signum, frame):
     """
@@ -176,7 +188,7 @@ def login(host, username, pw,jsonFormat):
     if(jsonFormat==False):
         print("Attempting login...")
     httpHeader = {'Content-Type':'application/json'}
-    mysess = requests.session()
+    mysess = tlsSessions.session()
     try:
         r = mysess.post('https://'+host+'/login', headers=httpHeader, json = {"data": [username, pw]}, verify=False, timeout=30)
         loginMessage = r.json()
@@ -189,59 +201,249 @@ def login(host, username, pw,jsonFormat):
         return (connectionErrHandler(jsonFormat, "ConnectionError", err))
 
 
-def initSensors(host, session, xcatNodeName):
+typeUnitDict = {'temperature': 'DegreesC', 
+                'power': 'Watts',
+                'fan_tach': 'RPMS',
+                'voltage': 'Volts',
+                'current': 'Amperes'}
+
+def createSensorTable(nodeCount):
+    """
+        Creates the shared memory sensor table. It must be created before the gatherer and socket server 
+        processes are started, so they all inherit it. Each node has a row of telemetryMaxSensors slots, 
+        indexed by its nodeID. Which sensor is in each slot is given by the sensor catalogue of the node, 
+        discovered from the sensors its BMC reports. The gatherers write the readings into the rows of 
+        their nodes and the socket server reads them without any copying through queues. 
+        
+        @param nodeCount: the number of node rows in the table
+    """
+    global sensorTable
+    rowSize = config.telemMaxSensors
+    sensorTable = {'rowSize': rowSize,
+                   'nodeCount': nodeCount,
+                   'values': multiprocessing.RawArray('d', nodeCount * rowSize),
+                   'scales': multiprocessing.RawArray('d', nodeCount * rowSize),
+                   'ready': multiprocessing.RawArray('b', nodeCount)}
+
+def internCatalogue(paths, types):
+    """
+        Returns the sensor catalogue for a list of sensor paths, creating it the first time the list is 
+        seen. Nodes of the same machine type report the same sensors, so they all share one catalogue
+        and its lookup tables. Each process keeps its own catalogues. 
+        
+        @param paths: tuple of the full sensor paths, in slot order
+        @param types: tuple with the type and unit of each sensor
+        @return: dictionary with the sensor names, paths and types, and the lookups used for filtering
+    """
+    with catalogueLock:
+        catalogue = catalogueIndex.get(paths)
+        if catalogue is not None:
+            return catalogue
+        shortNames = [path.split('/')[-1] for path in paths]
+        #a name reported under two sensor types is sent with its full path
+        names = [path if shortNames.count(shortNames[slot]) > 1 else shortNames[slot] for slot, path in enumerate(paths)]
+        exactIndex = {}
+        typeSlots = {}
+        for slot, sname in enumerate(names):
+            exactIndex[sname] = slot
+            exactIndex[paths[slot]] = slot
+            typeSlots.setdefault(types[slot][0], []).append(slot)
+        prefixNames = sorted(exactIndex)
+        catalogue = {'id': len(catalogues),
+                     'paths': paths,
+                     'names': names,
+                     'types': types,
+                     'sensorCount': len(paths),
+                     'slots': dict((path, slot) for slot, path in enumerate(paths)),
+                     'exactIndex': exactIndex,
+                     'prefixNames': prefixNames,
+                     'prefixSlots': [exactIndex[name] for name in prefixNames],
+                     'typeSlots': typeSlots}
+        catalogues.append(catalogue)
+        catalogueIndex[paths] = catalogue
+    return catalogue
+
+def setSensorValue(nodeID, slot, value):
+    """
+        Writes a sensor reading into the shared memory sensor table and marks it as changed if it differs
+        from the previous reading
+        
+        @param nodeID: the nodeID of the node, which is its row in the table
+        @param slot: the slot of the sensor in the row
+        @param value: the raw reading reported by the BMC
+    """
+    index = nodeID * sensorTable['rowSize'] + slot
+    try:
+        if sensorTable['values'][index] != value:
+            sensorTable['values'][index] = value
+            with deltaLock:
+                dirtySlots.add(index)
+    except TypeError:
+        pass
+
+def markNodeDirty(nodeID, sensorCount):
+    """
+        Marks every sensor of a node as changed
+        
+        @param nodeID: the nodeID of the node
+        @param sensorCount: the number of sensors in the catalogue of the node
+    """
+    base = nodeID * sensorTable['rowSize']
+    with deltaLock:
+        dirtySlots.update(range(base, base + sensorCount))
+
+def publishDeltas(gathererID):
+    """
+        Sends the indexes of the sensors changed since the last call to the socket server, with the next
+        sequence number of this gatherer. The values themselves are read from the shared memory table. If 
+        the socket server is behind and the queue is full the update is dropped, the server sees the gap
+        in the sequence numbers and rereads all of the nodes of this gatherer. 
+        
+        @param gathererID: the number of this gatherer process
+    """
+    global deltaSeq
+    with deltaLock:
+        if not dirtySlots:
+            return
+        changed = list(dirtySlots)
+        dirtySlots.clear()
+    deltaSeq += 1
+    try:
+        deltaQueue.put_nowait(('delta', gathererID, deltaSeq, changed))
+    except queue.Full:
+        pass
+
+def initSensors(node, session):
     '''
-        Gets initial values for sensors
+        Gets the sensors of a node and their initial values. The sensors reported by the BMC make up the
+        catalogue of the node, which is sent to the socket server whenever it changes. 
     '''
     httpHeader = {'Content-Type':'application/json'}
-    url="https://"+host+"/xyz/openbmc_project/sensors/enumerate"
+    url="https://"+node['bmcHostname']+"/xyz/openbmc_project/sensors/enumerate"
     try:
         res = session.get(url, headers=httpHeader, verify=False, timeout=30)
     except(requests.exceptions.Timeout):
         return(connectionErrHandler(True, "Timeout", None))
     
     sensors = res.json()["data"]
-    sensorData[xcatNodeName] = {}
-    for key in sensors:
-        if 'PowerSupplyRedundancy' in key:
-            continue
+    paths = []
+    types = []
+    for key in sorted(sensors):
         keyparts = key.split('/')
-        sensorType = keyparts[-2]
-        sensorname = keyparts[-1]
-        for sname in sensorList:
-            if sensorname in sname:
-                sensorData[xcatNodeName][sensorname] = {}
+        if len(keyparts) != 6 or keyparts[3] != 'sensors' or 'Value' not in sensors[key]:
+            continue
+        stype = keyparts[4]
+        unit = typeUnitDict.get(stype, str(sensors[key].get('Unit', '')).split('.')[-1])
+        paths.append(key)
+        types.append((stype, unit))
+    if len(paths) > sensorTable['rowSize']:
+        config.errorLogger(syslog.LOG_WARNING, "{bmc} reports {count} sensors, only the first {rowSize} will be streamed. Increase telemetryMaxSensors to stream all of them.".format(
+            bmc=node['bmcHostname'], count=len(paths), rowSize=sensorTable['rowSize']))
+        paths = paths[:sensorTable['rowSize']]
+        types = types[:sensorTable['rowSize']]
+    catalogue = internCatalogue(tuple(paths), tuple(types))
+    nodeID = node['nodeID']
+    if node.get('catalogue') is not catalogue:
+        node['catalogue'] = catalogue
+        node['cataloguePending'] = True
+    #sent before any of the readings, the socket server ignores nodes without a catalogue
+    sendCatalogue(node)
+    base = nodeID * sensorTable['rowSize']
+    for slot, key in enumerate(catalogue['paths']):
         if('Scale' in sensors[key]): 
-                scale = 10 ** sensors[key]['Scale'] 
+            scale = 10 ** sensors[key]['Scale'] 
         else: 
             scale = 1
-        typeUnitDict = {'temperature': 'DegreesC', 
-                         'power': 'Watts',
-                         'fan_tach': 'RPMS',
-                         'voltage': 'Volts',
-                         'current': 'Amperes'}
-        for sname in sensorList:
-            if sensorname in sname:
-                sensorData[xcatNodeName][sensorname]['scale'] = scale
-                sensorData[xcatNodeName][sensorname]['value'] =sensors[key]['Value']
-                sensorData[xcatNodeName][sensorname]['type'] = (sensorType, sensors[key]['Unit'].split('.')[-1])
-    
-    for key in sensorList:
-        if "logging" in key:
+        sensorTable['scales'][base + slot] = scale
+        setSensorValue(nodeID, slot, sensors[key].get('Value', 0))
+    sensorTable['ready'][nodeID] = 1
+    markNodeDirty(nodeID, catalogue['sensorCount'])
+
+def sendCatalogue(node):
+    """
+        Sends the catalogue of a node to the socket server if it has not been sent yet. This is called 
+        from the connector threads, so it never waits on the queue. When the queue is full the catalogue 
+        is sent again from the gatherer loop, and the socket server reads the node in full once it 
+        arrives. 
+        
+        @param node: dictionary containing the properties of the node
+        @return: True if the catalogue has been sent
+    """
+    if not node.get('cataloguePending'):
+        return True
+    catalogue = node['catalogue']
+    try:
+        deltaQueue.put_nowait(('catalogue', node['nodeID'], catalogue['paths'], catalogue['types']))
+    except queue.Full:
+        config.errorLogger(syslog.LOG_DEBUG, "The socket server is behind, the sensor catalogue of {bmc} will be sent later.".format(bmc=node['bmcHostname']))
+        return False
+    node['cataloguePending'] = False
+    return True
+
+def readSensor(index, sensorType):
+    """
+        Returns the reading of a sensor from the shared memory sensor table
+        
+        @param index: the position of the sensor in the table
+        @param sensorType: the type and unit of the sensor, from its catalogue
+        @return: dictionary with the value, scale and type of the sensor
+    """
+    value = sensorTable['values'][index]
+    scale = sensorTable['scales'][index]
+    #the table holds doubles, send whole numbers the way the BMC reported them
+    if value.is_integer():
+        value = int(value)
+    if scale.is_integer():
+        scale = int(scale)
+    return {'value': value, 'scale': scale, 'type': sensorType}
+
+def readSensorRow(nodeID):
+    """
+        Returns the readings of all of the sensors in the catalogue of a node from the shared memory sensor table
+        
+        @param nodeID: the nodeID of the node
+        @return: dictionary keyed by sensor name
+    """
+    catalogue = nodeCatalogues[nodeID]
+    base = nodeID * sensorTable['rowSize']
+    return dict((sname, readSensor(base + slot, catalogue['types'][slot])) for slot, sname in enumerate(catalogue['names']))
+
+def applySensorChanges(changed, refreshNodes):
+    """
+        Updates the sensor readings sent to the clients with the changed sensors. Nodes being refreshed 
+        and nodes not sent before are read in full. A new top level dictionary is made when nodes are 
+        added, so client threads iterating over the old one are not affected. 
+        
+        @param changed: iterable of the positions in the table of the changed sensors
+        @param refreshNodes: set of nodeIDs to read in full
+    """
+    global sensorData
+    global snapshotSeq
+    rowSize = sensorTable['rowSize']
+    rows = set(refreshNodes)
+    for index in changed:
+        nodeID, slot = divmod(index, rowSize)
+        if nodeID in rows:
             continue
-        keyparts = key.split('/')
-        stype = keyparts[-2]
-        sname = keyparts[-1]
-        if sname not in sensorData[xcatNodeName]:
-            sensorData[xcatNodeName][sname] = {}
-            sensorData[xcatNodeName][sname]['value'] = 0
-            sensorData[xcatNodeName][sname]['type'] = (stype, typeUnitDict[stype])
-            if 'fan_tach' in stype:
-                sensorData[xcatNodeName][sname]['scale'] = 1
-            elif 'power' in stype:
-                sensorData[xcatNodeName][sname]['scale'] = 10 ** -6
-            else:
-                sensorData[xcatNodeName][sname]['scale'] = 10 ** -3
+        catalogue = nodeCatalogues.get(nodeID)
+        if catalogue is None or slot >= catalogue['sensorCount']:
+            continue
+        node = config.getNodeByID(nodeID)
+        if node is None or node['xcatNodeName'] not in sensorData:
+            rows.add(nodeID)
+        else:
+            sensorData[node['xcatNodeName']][catalogue['names'][slot]] = readSensor(index, catalogue['types'][slot])
+    newData = None
+    for nodeID in rows:
+        node = config.getNodeByID(nodeID)
+        if node is None or not sensorTable['ready'][nodeID] or nodeID not in nodeCatalogues:
+            continue
+        if newData is None:
+            newData = dict(sensorData)
+        newData[node['xcatNodeName']] = readSensorRow(nodeID)
+    if newData is not None:
+        sensorData = newData
+    snapshotSeq += 1
     
 def processMessages():
     global killNow
@@ -254,12 +456,13 @@ def processMessages():
             if 'logging' in message['path']:
                 config.errorLogger(syslog.LOG_DEBUG, "Event notification received for {bmc}.".format(bmc=text['node']['bmcHostname']))
             if 'sensors' in message["path"]:
-                sensorName = message["path"].split('/')[-1]
-                if 'Value' in message['properties']:
-                    sensorData[text['node']['xcatNodeName']][sensorName]['value'] = message['properties']['Value']
+                catalogue = text['node'].get('catalogue')
+                slot = None if catalogue is None else catalogue['slots'].get(message["path"])
+                if slot is not None and 'Value' in message['properties']:
+                    setSensorValue(text['node']['nodeID'], slot, message['properties']['Value'])
 #                 config.errorLogger(syslog.LOG_DEBUG, "Updated sensor readings for {bmc}.".format(bmc=text['node']['bmcHostname']))
             else:
-                sendQueue.put(text['node'])
+                sendAlert(text['node'])
         except Exception as e:
             config.errorLogger(syslog.LOG_WARNING, "Error encountered processing BMC message from {bmc}".format(bmc=text['node']['bmcHostname']))
             config.errorLogger(syslog.LOG_DEBUG, "BMC message was: {msg}".format(msg=text['msg']))
@@ -270,57 +473,90 @@ def processMessages():
             
         messageQueue.task_done()
 
-def getNode():
-    thisNode = {}
-    for anode in config.mynodelist:
-        if 'telemlistener' in anode and anode['telemlistener'] is not None:
-            if anode['telemlistener'].getName() == threading.currentThread().getName():
-                thisNode = anode
-                break
-    return thisNode
-            
-def on_message(ws, message):
-    thisNode = getNode()
-    thisNode['activeTimer'] = time.time()
-    thisNode['down'] = False
-    messageQueue.put({'node': thisNode,'msg':message})
-#     config.errorLogger(syslog.LOG_DEBUG, "Got Sensor reading from {bmc}".format(bmc=thisNode['bmcHostname']))
-
-def on_error(ws, error):
-    thisNode = getNode()
-    if thisNode['websocket'] == ws:
-        thisNode['telemlistener'] = None
-    config.errorLogger(syslog.LOG_DEBUG, "Websocket error for {bmc}, details: {err}".format(bmc=thisNode['bmcHostname'], err=error))
-
-def on_close(ws):
-    thisNode = getNode()
-    if thisNode['websocket'] == ws:
-        thisNode['telemlistener'] = None
-    config.errorLogger(syslog.LOG_DEBUG, "Websocket closed for {bmc}".format(bmc=thisNode['bmcHostname']))
+def sendAlert(node):
+    """
+        Asks the main process to poll the node for new events. Only the nodeID is sent, the main process
+        finds the node in its registry.
+        
+        @param node: dictionary containing the properties of the node
+    """
+    config.alertMessageQueue.put(node['nodeID'])
+
+def sendRuleEvents(transitions, now):
+    """
+        Sends the events for the sensors that broke or are back within the limits of a telemetry rule to 
+        the main process, which passes them on to the notify entities. 
+        
+        @param transitions: list of the sensors that changed state, from telemetryRules.check
+        @param now: the time of the check, in seconds since the epoch
+    """
+    for transition in transitions:
+        config.alertMessageQueue.put(('rule', transition['nodeID'], telemetryRules.createEvent(transition, now)))
+
+def receiveAlerts():
+    """
+        Moves the nodes sent by the gatherer processes into the polling queue as soon as they arrive, and
+        the events raised by the telemetry rules into the telemetry events queue. Run in a thread of the 
+        main process. 
+    """
+    while not config.killNow:
+        try:
+            message = config.alertMessageQueue.get()
+            if message is None:
+                continue
+            if isinstance(message, tuple):
+                msgType, nodeID, event = message
+                node = config.getNodeByID(nodeID)
+                if node is not None:
+                    config.telemEvents.put((event, node))
+                continue
+            node = config.getNodeByID(message)
+            if node is not None:
+                config.nodes2poll.put(node)
+        except Exception as e:
+            config.errorLogger(syslog.LOG_ERR, "Error processing an alert message.")
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+            config.errorLogger(syslog.LOG_DEBUG, "Exception: Error: {err}, Details: {etype}, {fname}, {lineno}".format(err=e, etype=exc_type, fname=fname, lineno=exc_tb.tb_lineno))
+            traceback.print_tb(e.__traceback__)
+
+def on_message(node, message):
+    gathererTable['messages'][node['nodeID']] += 1
+    node['activeTimer'] = time.time()
+    node['down'] = False
+    node['retryCount'] = 0
+    messageQueue.put({'node': node,'msg':message})
+#     config.errorLogger(syslog.LOG_DEBUG, "Got Sensor reading from {bmc}".format(bmc=node['bmcHostname']))
+
+def on_close(node, reason):
+    if reason is not None:
+        config.errorLogger(syslog.LOG_DEBUG, "Websocket error for {bmc}, details: {err}".format(bmc=node['bmcHostname'], err=reason))
+    config.errorLogger(syslog.LOG_DEBUG, "Websocket closed for {bmc}".format(bmc=node['bmcHostname']))
     
-def on_open(ws):
-    #open the websocket and subscribe to the sensors
-    thisNode = getNode()
-    data = {"paths": sensorList, "interfaces": ["xyz.openbmc_project.Sensor.Value","xyz.openbmc_project.Logging.Entry"]}
+def on_open(node, ws):
+    #subscribe to the sensors
+    data = {"paths": ["/xyz/openbmc_project/sensors", "/xyz/openbmc_project/logging"], "interfaces": ["xyz.openbmc_project.Sensor.Value","xyz.openbmc_project.Logging.Entry"]}
     ws.send(json.dumps(data))
-    sendQueue.put(thisNode)
-    config.errorLogger(syslog.LOG_DEBUG, "Websocket opened for {bmc}".format(bmc=thisNode['bmcHostname']))
-
-def createWebsocket(sescookie, bmcIP, node):
-    cookieStr = ""
-    for key in sescookie:
-        if cookieStr != "":
-            cookieStr = cookieStr + ";"
-        cookieStr = cookieStr + key +"=" + sescookie[key]
-    ws = websocket.WebSocketApp("wss://{bmc}/subscribe".format(bmc=bmcIP),
-                              on_message = on_message,
-                              on_error = on_error,
-                              on_close = on_close,
-                              cookie = cookieStr)
-    node['websocket'] = ws
-    ws.on_open = on_open
-    wsClosed = False
-    ws.run_forever(sslopt={"cert_reqs": ssl.CERT_NONE})
+    sendAlert(node)
+    config.errorLogger(syslog.LOG_DEBUG, "Websocket opened for {bmc}".format(bmc=node['bmcHostname']))
+
+def telemLogin(node):
+    return login(node['bmcHostname'], node['username'], node['password'], True)
+
+def telemPrepare(node, session):
+    node['activeTimer'] = time.time()
+    initSensors(node, session)
+
+def telemLoginFailed(node, error):
+    config.errorLogger(syslog.LOG_CRIT, "Failed to login to bmc {bmc}".format(bmc=node['bmcHostname']))
+    config.errorLogger(syslog.LOG_ERR, str(error))
+
+telemHandlers = {'login': telemLogin,
+                 'prepare': telemPrepare,
+                 'on_open': on_open,
+                 'on_message': on_message,
+                 'on_close': on_close,
+                 'on_login_failed': telemLoginFailed}
 
 def setDefaultBMCCredentials(node):
     if config.mynodelist[-1]['accessType'] == "ipmi":
@@ -352,11 +588,13 @@ def buildNodeList():
                 config.mynodelist.append({'xcatNodeName': nodes2monitor[node]['xcatNodeName'], 
                                    'bmcHostname': nodes2monitor[node]['bmcHostname'],
                                    'accessType': nodes2monitor[node]['accessType'],
+                                   'groups': nodes2monitor[node].get('groups', []),
                                    'pollFailedCount': 0,
                                    'lastLogTime': '0',
                                    'dupTimeIDList': []})
                 
                 setDefaultBMCCredentials(config.mynodelist[-1])
+                config.registerNode(config.mynodelist[-1])
             if len(config.mynodelist)<1:
                 print("Failed getting node list from xcat. No nodes returned")
                 sys.exit(1)
@@ -374,63 +612,96 @@ def buildNodeList():
         sys.exit(1)
 
 
-def openWebSocketsThreads(node):            
-    bmcIP = node['bmcHostname']
-    systemName = node['xcatNodeName']
-    mysession = login(bmcIP,node['username'], node['password'], True)
-    if not isinstance(mysession, str):
+def startNodeMonitoring(node):
+    """
+        Opens the websocket used to stream the sensor readings of a node
+        
+        @param node: dictionary containing the properties of the node
+    """
+    if node['accessType'] == 'openbmcRest':
+        node['activeTimer'] = time.time()
+        node['retryCount'] = 0
+        node['down'] = False
+        websocketMux.addConnection(node, telemHandlers)
+
+def handOverNode(node, target):
+    """
+        Records the new gatherer of a released node in the gatherer table and asks it to adopt the node. 
+        Called by websocketMux once the websocket of the node is closed. 
+        
+        @param node: dictionary containing the properties of the node
+        @param target: the number of the gatherer adopting the node
+    """
+    try:
+        gathererTable['owner'][node['nodeID']] = target
+        gathererQueues[target].put(('adopt', node['nodeID'], target))
+    except Exception as e:
+        config.errorLogger(syslog.LOG_ERR, "Error handing {bmc} over to telemetry gatherer {num}.".format(bmc=node['bmcHostname'], num=target))
+        exc_type, exc_obj, exc_tb = sys.exc_info()
+        fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+        config.errorLogger(syslog.LOG_DEBUG, "Exception: Error: {err}, Details: {etype}, {fname}, {lineno}".format(err=e, etype=exc_type, fname=fname, lineno=exc_tb.tb_lineno))
+
+def gathererControl(nodeList, gathererID):
+    """
+        Moves nodes out of and into this gatherer as asked by the main process. A released node keeps this
+        gatherer as its owner until its websocket is closed, only then is the new gatherer recorded in the
+        gatherer table and asked to adopt it, so a node is never streamed by two gatherers. Run in a 
+        thread of each gatherer process. 
+        
+        @param nodeList: the list of nodes monitored by this gatherer
+        @param gathererID: the number of this gatherer process
+    """
+    while not killNow:
         try:
-            node['activeTimer'] = time.time()
-            sescookie= mysession.cookies.get_dict()
-            initSensors(bmcIP, mysession, systemName)
-            createWebsocket(sescookie, bmcIP, node)
-            node['retryCount'] = 0
+            action, nodeID, target = gathererQueues[gathererID].get()
+            node = config.getNodeByID(nodeID)
+            if node is None:
+                continue
+            if action == 'release':
+                if node not in nodeList:
+                    continue
+                nodeList.remove(node)
+                #the owner moves to the target once the websocket is closed
+                websocketMux.removeConnection(node, lambda node, target=target: handOverNode(node, target))
+            elif action == 'adopt':
+                if gathererTable['owner'][nodeID] != gathererID or node in nodeList:
+                    continue
+                nodeList.append(node)
+                startNodeMonitoring(node)
+                config.errorLogger(syslog.LOG_DEBUG, "Telemetry gatherer {num} is now streaming {bmc}.".format(num=gathererID, bmc=node['bmcHostname']))
         except Exception as e:
-            config.errorLogger(syslog.LOG_CRIT, "Failed to open the websocket with bmc {bmc}".format(bmc=bmcIP))
+            config.errorLogger(syslog.LOG_ERR, "Error moving a node between telemetry gatherers.")
             exc_type, exc_obj, exc_tb = sys.exc_info()
             fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
             config.errorLogger(syslog.LOG_DEBUG, "Exception: Error: {err}, Details: {etype}, {fname}, {lineno}".format(err=e, etype=exc_type, fname=fname, lineno=exc_tb.tb_lineno))
             traceback.print_tb(e.__traceback__)
-    else:
-        config.errorLogger(syslog.LOG_CRIT, "Failed to login to bmc {bmc}".format(bmc=bmcIP))
-        config.errorLogger(syslog.LOG_ERR, mysession)
 
-def startMonitoringProcess(nodeList, mngedNodeList):
+def startMonitoringProcess(nodeList, gathererID):
     killQueueThread = threading.Thread(target=killQueueChecker)
     killQueueThread.daemon = True
     killQueueThread.start()
     global activeThreads
     global lock
+    websocketMux.start()
     for node in nodeList:
-        if node['accessType'] == 'openbmcRest':
-            node['activeTimer'] = time.time()
-            node['retryCount'] = 0
-            node['down'] = False
-            ws = threading.Thread(target = openWebSocketsThreads, args=[node])
-            ws.daemon = True
-            ws.start() 
-            node['telemlistener'] = ws
+        startNodeMonitoring(node)
+    controlThread = threading.Thread(target=gathererControl, args=[nodeList, gathererID])
+    controlThread.daemon = True
+    controlThread.start()
     pm = threading.Thread(target = processMessages)
     pm.daemon = True
     pm.start()
-    activeThreads.append(ws)
     activeThreads.append(pm)
     time.sleep(10)
     global killNow
     while True:
         if killNow:
             break
-        if not sendQueue.empty():
-            pollNode = sendQueue.get()
-            if 'xcatNodeName' not in pollNode:
-                continue
-            else:
-                mngedNodeList.append(nodeReferenceDict[pollNode['xcatNodeName']])
-            sendQueue.task_done()
-        for node in nodeList:
+        #the nodes can be moved to another gatherer while they are checked
+        for node in list(nodeList):
             msgtimer = time.time() - node['activeTimer']
             if node['accessType'] == 'openbmcRest':
-                if not pm.isAlive():
+                if not pm.is_alive():
                     try:
                         pm = threading.Thread(target = processMessages)
                         pm.daemon = True
@@ -441,28 +712,15 @@ def startMonitoringProcess(nodeList, mngedNodeList):
                         fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
                         config.errorLogger(syslog.LOG_DEBUG, "Exception: Error: {err}, Details: {etype}, {fname}, {lineno}".format(err=e, etype=exc_type, fname=fname, lineno=exc_tb.tb_lineno))
                         traceback.print_tb(e.__traceback__)
-                if node['telemlistener'] is None:
-                    try:
-                        ws = threading.Thread(target = openWebSocketsThreads, args=[node])
-                        ws.daemon = True
-                        ws.start() 
-                        node['telemlistener'] = ws
-                        config.errorLogger(syslog.LOG_ERR, "No thread found for monitoring {bmc} telemetry data. A new thread has been started.".format(bmc=node['bmcHostname']))
-                    except Exception as e:
-                        config.errorLogger(syslog.LOG_ERR, "Error trying to restart a thread for monitoring bmc telemetry data.")
-                        exc_type, exc_obj, exc_tb = sys.exc_info()
-                        fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
-                        config.errorLogger(syslog.LOG_DEBUG, "Exception: Error: {err}, Details: {etype}, {fname}, {lineno}".format(err=e, etype=exc_type, fname=fname, lineno=exc_tb.tb_lineno))
-                        traceback.print_tb(e.__traceback__)
+                #closed websockets are reconnected with backoff by websocketMux
+                if node['listenerState'] != 'connected' and node['reconnectAttempts'] > 3 and not node['down']:
+                    config.errorLogger(syslog.LOG_CRIT, "ibm-crassd has failed to reconnect to BMC, {bmc}, more than three times.".format(bmc=node['bmcHostname']))
+                    node['down'] = True
                 elif msgtimer > 600:
                     try:
-                        if node['retryCount'] <=3:
-                            oldws = node['websocket']
-                            oldws.close()
-                            ws = threading.Thread(target = openWebSocketsThreads, args=[node])
-                            ws.daemon = True
-                            ws.start() 
-                            node['telemlistener'] = ws
+                        if node['retryCount'] <=3 and node['listenerState'] == 'connected':
+                            #the event loop closes the websocket and websocketMux reconnects it
+                            websocketMux.disconnect(node)
                             node['retryCount'] +=1
                         if node['retryCount'] >3 and msgtimer>=300:
                             if not node['down']:
@@ -476,197 +734,1079 @@ def startMonitoringProcess(nodeList, mngedNodeList):
                 else:
                     pass
         time.sleep(0.9)
-        telemUpdateQueue.put(sensorData)
+        for node in list(nodeList):
+            if node.get('cataloguePending'):
+                sendCatalogue(node)
+        publishDeltas(gathererID)
+        gathererTable['backlog'][gathererID] = messageQueue.qsize()
 
 def telemReceive():
+    """
+        Applies the changed sensors published by the gatherers to the sensor readings sent to the 
+        clients, once per update interval, checks them against the telemetry rules and records them in 
+        the history. The gatherers also send the catalogue of a node whenever it changes, the node is then 
+        read in full. Run in a thread of the socket server process. 
+    """
     global killNow
-    global sensorData
+    lastSeq = {}
+    changed = set()
+    #read every node in full the first time
+    refreshNodes = set(nodeID for nodeID, owner in enumerate(gathererTable['owner']) if owner >= 0)
+    aggregatesChanged = True
+    rulesChanged = True
+    nextUpdate = time.time()
     while True:
         if killNow:
             break
         try:
-            newData = telemUpdateQueue.get()
-            sensorData.update(newData)
+            try:
+                update = deltaQueue.get(timeout=max(0, nextUpdate - time.time()))
+                if update[0] == 'catalogue':
+                    msgType, nodeID, paths, types = update
+                    nodeCatalogues[nodeID] = internCatalogue(paths, types)
+                    telemetryHistory.setNodeSensors(nodeID, paths)
+                    refreshNodes.add(nodeID)
+                    aggregatesChanged = True
+                    rulesChanged = True
+                else:
+                    msgType, gathererID, seq, indexes = update
+                    if seq != lastSeq.get(gathererID, 0) + 1:
+                        config.errorLogger(syslog.LOG_DEBUG, "Missed sensor updates from gatherer {num}, rereading its nodes.".format(num=gathererID))
+                        refreshNodes.update(getGathererNodes(gathererID))
+                    else:
+                        changed.update(indexes)
+                    lastSeq[gathererID] = seq
+            except queue.Empty:
+                pass
+            if time.time() >= nextUpdate:
+                if changed or refreshNodes:
+                    #the socket server doesn't encode frames while the snapshot is being updated
+                    with snapshotLock:
+                        if telemetryAggregates.enabled:
+                            if aggregatesChanged:
+                                buildAggregateIndexes()
+                                aggregatesChanged = False
+                            #computed before the new snapshot is published, so its frames include them
+                            telemetryAggregates.compute()
+                        applySensorChanges(changed, refreshNodes)
+                    changed = set()
+                    refreshNodes = set()
+                    notifySnapshot()
+                if telemetryRules.enabled:
+                    if rulesChanged:
+                        buildRuleIndexes()
+                        rulesChanged = False
+                    now = time.time()
+                    sendRuleEvents(telemetryRules.check(now), now)
+                telemetryHistory.record(time.time())
+                nextUpdate = time.time() + update_every / 1000.0
         except Exception as e:
             config.errorLogger(syslog.LOG_DEBUG, "Error updating sensor data with new readings.")
             exc_type, exc_obj, exc_tb = sys.exc_info()
             fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
             config.errorLogger(syslog.LOG_DEBUG, "Exception: Error: {err}, Details: {etype}, {fname}, {lineno}".format(err=e, etype=exc_type, fname=fname, lineno=exc_tb.tb_lineno))
             traceback.print_tb(e.__traceback__)
+            time.sleep(update_every / 1000.0)
+
+def getGathererCount(nodeCount):
+    """
+        Returns the number of gatherer processes to start. Unless it is set with telemetryGatherers, there 
+        is one gatherer for each core left over by the main and socket server processes, but no more than 
+        one for every minNodesPerGatherer nodes. 
+        
+        @param nodeCount: the number of nodes to stream
+        @return: the number of gatherers, at least one and no more than the number of nodes
+    """
+    if config.telemGatherers > 0:
+        return max(1, min(config.telemGatherers, nodeCount))
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = multiprocessing.cpu_count()
+    return max(1, min(cores - 2, int(math.ceil(nodeCount / float(minNodesPerGatherer)))))
+
+def shardNodes(nodeIDs, rates, gathererCount):
+    """
+        Splits the nodes between the gatherers so they all receive about the same number of messages. The 
+        busiest nodes are handed out first, each to the gatherer with the fewest messages so far. Nodes 
+        without a measured rate count as one message per second. 
+        
+        @param nodeIDs: list of the nodeIDs to split
+        @param rates: dictionary with the measured messages per second of nodes, keyed by nodeID
+        @param gathererCount: the number of gatherers
+        @return: list with the nodeIDs of each gatherer, every node is given to exactly one gatherer
+    """
+    shards = [[] for num in range(gathererCount)]
+    loads = [(0.0, num) for num in range(gathererCount)]
+    for nodeID in sorted(nodeIDs, key=lambda nodeID: -rates.get(nodeID, 1.0)):
+        load, num = heapq.heappop(loads)
+        shards[num].append(nodeID)
+        heapq.heappush(loads, (load + rates.get(nodeID, 1.0), num))
+    return shards
+
+def getGathererNodes(gathererID):
+    """
+        Returns the nodeIDs of the nodes streamed by a gatherer, from the gatherer table
+        
+        @param gathererID: the number of the gatherer process
+    """
+    return [nodeID for nodeID, owner in enumerate(gathererTable['owner']) if owner == gathererID]
+
+def balanceGatherers():
+    """
+        Moves nodes away from the gatherers that fell behind. The messages per second of every node are 
+        measured since the last call, and a gatherer has fallen behind when more than a second of its 
+        messages, and at least minBehindMessages, are waiting to be processed. Its busiest nodes are moved 
+        to the least loaded gatherer that kept up, until the two receive about the same number of messages.
+        A gatherer behind while no busier than the others gives up one node on each call until it keeps up. 
+        Run from the main process every telemetryRebalanceInterval seconds. 
+        
+        @return: the number of nodes moved
+    """
+    global balanceState
+    now = time.time()
+    counts = list(gathererTable['messages'])
+    owners = list(gathererTable['owner'])
+    previous = balanceState
+    balanceState = {'time': now, 'counts': counts}
+    if previous is None or now <= previous['time']:
+        return 0
+    elapsed = now - previous['time']
+    rates = [(counts[nodeID] - previous['counts'][nodeID]) / elapsed for nodeID in range(len(counts))]
+    gathererCount = gathererTable['count']
+    loads = [0.0] * gathererCount
+    members = [[] for num in range(gathererCount)]
+    for nodeID, owner in enumerate(owners):
+        if owner >= 0:
+            loads[owner] += rates[nodeID]
+            members[owner].append(nodeID)
+    behind = [num for num in range(gathererCount) if gathererTable['backlog'][num] > max(minBehindMessages, loads[num])]
+    keepingUp = [num for num in range(gathererCount) if num not in behind]
+    moved = 0
+    for source in sorted(behind, key=lambda num: -loads[num]):
+        if not keepingUp:
+            break
+        target = min(keepingUp, key=lambda num: loads[num])
+        goal = (loads[source] + loads[target]) / 2
+        candidates = sorted([nodeID for nodeID in members[source] if rates[nodeID] > 0], key=lambda nodeID: -rates[nodeID])
+        moving = [nodeID for nodeID in candidates if loads[target] + rates[nodeID] <= goal]
+        if not moving and candidates:
+            #evenly loaded already, the gatherer is slower than the others, so it still gives up its quietest node
+            moving = candidates[-1:]
+        count = 0
+        for nodeID in moving:
+            if len(members[source]) <= 1 or (count and (loads[source] <= goal or loads[target] + rates[nodeID] > goal)):
+                break
+            gathererQueues[source].put(('release', nodeID, target))
+            members[source].remove(nodeID)
+            loads[source] -= rates[nodeID]
+            loads[target] += rates[nodeID]
+            count += 1
+        if count:
+            config.errorLogger(syslog.LOG_INFO, "Telemetry gatherer {source} fell behind with {backlog} messages waiting, moving {count} nodes to gatherer {target}.".format(
+                source=source, backlog=int(gathererTable['backlog'][source]), count=count, target=target))
+        moved += count
+    return moved
 
-def init(mngedNodeList):
+def init():
+    """
+        Splits the nodes between the gatherer processes and starts them. The gatherer table, shared with 
+        all of the processes, holds the gatherer streaming each node, the messages received from each node
+        and the messages each gatherer has waiting to be processed. 
+    """
     websocket.enableTrace(False)
     global gathererProcs
-    nodespercore = 50
-    if len(config.mynodelist)%nodespercore > 0:
-        oddNum = 1
-    else:   
-        oddNum = 0
-    nodeConcurrentProcs = int(len(config.mynodelist)/nodespercore) + oddNum
-    for num in range(nodeConcurrentProcs):
-        startNum = num*nodespercore
-        monitorNodeList = []
-        if oddNum == 1 and num == nodeConcurrentProcs:
-            monitorNodeList = config.mynodelist[startNum:-1]
-        else:
-            monitorNodeList = config.mynodelist[startNum:((num+1)*nodespercore)]
-        gathererProc = multiprocessing.Process(target=startMonitoringProcess, args=[monitorNodeList, mngedNodeList])
+    global gathererQueues
+    global gathererTable
+    global deltaQueue
+    global balanceState
+    deltaQueue = multiprocessing.Queue(maxsize=100)
+    balanceState = None
+    nodeIDs = [node['nodeID'] for node in config.mynodelist]
+    gathererCount = getGathererCount(len(nodeIDs))
+    nodeCount = len(config.nodeRegistry['byID'])
+    gathererTable = {'count': gathererCount,
+                     'owner': multiprocessing.RawArray('i', [-1] * nodeCount),
+                     'messages': multiprocessing.RawArray('d', nodeCount),
+                     'backlog': multiprocessing.RawArray('d', gathererCount)}
+    gathererQueues = [multiprocessing.Queue() for num in range(gathererCount)]
+    shards = shardNodes(nodeIDs, {}, gathererCount)
+    for num, shard in enumerate(shards):
+        for nodeID in shard:
+            gathererTable['owner'][nodeID] = num
+    for num, shard in enumerate(shards):
+        monitorNodeList = [config.getNodeByID(nodeID) for nodeID in shard]
+        gathererProc = multiprocessing.Process(target=startMonitoringProcess, args=[monitorNodeList, num])
         gathererProc.daemon = True
         gathererProc.start()
         gathererProcs.append(gathererProc)
+    config.errorLogger(syslog.LOG_INFO, "Started {count} telemetry gatherers for {nodes} nodes.".format(count=gathererCount, nodes=len(nodeIDs)))
                
-def recvall(sock, n):
-    #helper function to receive n bytes or return None if EOF is hit
-    data = b''
-    while len(data) < n:
-        packet = sock.recv(n - len(data))
-        if not packet:
-            return None
-        data += packet
-    return data
-     
 def process_data(filterData, addr):
     """
-        Processes the filter data received from a client. In the case of errors, defaults are used. 
-        For invalid names and types, they are removed from the list. The full path of the sensor name must be included.
+        Processes a message received from a client. The message is either new filters, or a request for
+        the history of some sensors. 
         
         @param filterData: The raw data received from the client. Must be in a JSON formatted string.
         @param addr: The address of the client as a string.
+        @return: the compiled filters, or a dictionary with the validated history request under the 
+                 history key
     """    
     try:
         filterDict = json.loads(filterData.decode())
-        if 'frequency' in filterDict:
-            if not isinstance(filterDict['frequency'], int):
-                try:
-                    filterDict['frequency'] = int(filterDict['frequency'])
-                except Exception as e:
-                    config.errorLogger(syslog.LOG_ERR, "{value} is not a valid frequency".format(value=filterDict['frequency']))
-                    filterDict['frequency'] = 1
-        if 'sensornames' in filterDict:
-            if not isinstance(filterDict['sensornames'], list):
-                config.errorLogger(syslog.LOG_ERR, "{value} is not a valid list of names".format(value=filterDict['sensornames']))
+        if 'history' in filterDict:
+            return {'history': process_history(filterDict['history'], addr)}
+        return validateFilter(filterDict, addr)
+    except Exception as e:
+        config.errorLogger(syslog.LOG_CRIT, "Unable to process message from client {addr}. Error details: {err}".format(addr=addr, err=e))
+
+def validateFilter(filterDict, addr):
+    """
+        Validates the filters received from a client. In the case of errors, defaults are used. 
+        Sensor names and types are matched against the catalogue of each node when its readings are
+        sent, so names and types not reported by any node yet are logged but kept, a node whose 
+        catalogue arrives later can still match them. 
+        
+        @param filterDict: Dictionary containing the filters received from the client
+        @param addr: The address of the client as a string.
+        @return: the compiled filters
+    """
+    if 'frequency' in filterDict:
+        if not isinstance(filterDict['frequency'], int):
+            try:
+                filterDict['frequency'] = int(filterDict['frequency'])
+            except Exception as e:
+                config.errorLogger(syslog.LOG_ERR, "{value} is not a valid frequency".format(value=filterDict['frequency']))
+                filterDict['frequency'] = 1
+    if 'sensornames' in filterDict:
+        if not isinstance(filterDict['sensornames'], list):
+            config.errorLogger(syslog.LOG_ERR, "{value} is not a valid list of names".format(value=filterDict['sensornames']))
+            filterDict.pop('sensornames', None)
+        else:
+            snames = []
+            for sname in filterDict['sensornames']:
+                if not isinstance(sname, str):
+                    config.errorLogger(syslog.LOG_ERR, "{value} is not a valid sensor name".format(value=sname))
+                    continue
+                if not any(findSensorSlots(catalogue, sname) for catalogue in list(catalogues)):
+                    config.errorLogger(syslog.LOG_WARNING, "{value} does not match a sensor of the nodes reporting so far".format(value=sname))
+                if sname not in snames:
+                    snames.append(sname)
+            #a list of only invalid names selects nothing rather than every sensor
+            if len(filterDict['sensornames'])<= 0:
                 filterDict.pop('sensornames', None)
             else:
-                fullpathnames = []
-                for sname in filterDict['sensornames']:
-                    found = False
-                    for fullSensName in sensorList:
-                        if sname in fullSensName:
-                            found = True
-                            fullpathnames.append(fullSensName)
-                            break
-                    if not found:
-                        config.errorLogger(syslog.LOG_ERR, "{value} is not a valid sensor name".format(value=sname))
-                filterDict['sensornames'] = fullpathnames
-                if len(filterDict['sensornames'])<= 0:
-                    filterDict.pop('sensornames', None)
-        if 'sensortypes' in filterDict:
-            if not isinstance(filterDict['sensortypes'], list):
-                config.errorLogger(syslog.LOG_ERR, "{value} is not a valid list of types".format(value=filterDict['sensortypes']))
-                filterDict.pop('sensornames', None)
+                filterDict['sensornames'] = snames
+    if 'sensortypes' in filterDict:
+        if not isinstance(filterDict['sensortypes'], list):
+            config.errorLogger(syslog.LOG_ERR, "{value} is not a valid list of types".format(value=filterDict['sensortypes']))
+            filterDict.pop('sensortypes', None)
+        else:
+            validSensorTypes = set(typeUnitDict)
+            for catalogue in list(catalogues):
+                validSensorTypes.update(catalogue['typeSlots'])
+            stypes = []
+            for stype in filterDict['sensortypes']:
+                if not isinstance(stype, str):
+                    config.errorLogger(syslog.LOG_ERR, "{value} is not a valid sensor type".format(value=stype))
+                    continue
+                if stype not in validSensorTypes:
+                    config.errorLogger(syslog.LOG_WARNING, "{value} is not a sensor type of the nodes reporting so far".format(value=stype))
+                stypes.append(stype)
+            #a list of only invalid types selects nothing rather than every sensor
+            if len(filterDict['sensortypes'])<= 0:
+                filterDict.pop('sensortypes', None)
             else:
-                validSensorTypes = ['current', 'power', 'voltage', 'temperature', 'fan_tach']
-                for stype in filterDict['sensortypes']:
-                    if stype not in validSensorTypes:
-                        config.errorLogger(syslog.LOG_ERR, "{value} is not a valid sensor type".format(value=stype))
-                        filterDict['sensortypes'].remove(stype)
-                if len(filterDict['sensortypes'])<= 0:
-                    filterDict.pop('sensortypes', None)
-        return filterDict
-    except Exception as e:
-        config.errorLogger(syslog.LOG_CRIT, "Unable to process message from client {addr}. Error details: {err}".format(addr=addr, err=e))
+                filterDict['sensortypes'] = stypes
+    filterDict['nodeIDs'] = None
+    if 'nodes' in filterDict or 'noderange' in filterDict or 'groups' in filterDict:
+        filterDict['nodeIDs'] = resolveNodeFilter(filterDict)
+        if len(filterDict['nodeIDs'])<= 0:
+            config.errorLogger(syslog.LOG_ERR, "No monitored nodes match the node filters from {addr}".format(addr=addr))
+            filterDict['nodeIDs'] = None
+    if 'aggregates' in filterDict:
+        if filterDict['aggregates'] is True:
+            filterDict['aggregates'] = telemetryAggregates.getNames()
+        if not isinstance(filterDict['aggregates'], list):
+            config.errorLogger(syslog.LOG_ERR, "{value} is not a valid list of aggregates".format(value=filterDict['aggregates']))
+            filterDict.pop('aggregates', None)
+        else:
+            for name in list(filterDict['aggregates']):
+                if name not in telemetryAggregates.getNames():
+                    config.errorLogger(syslog.LOG_ERR, "{value} is not a configured aggregate".format(value=name))
+                    filterDict['aggregates'].remove(name)
+            if len(filterDict['aggregates'])<= 0:
+                filterDict.pop('aggregates', None)
+            elif not any(key in filterDict for key in ['nodes', 'noderange', 'groups', 'sensornames', 'sensortypes']):
+                #only the aggregates were asked for
+                filterDict['nodeIDs'] = []
+    if 'format' in filterDict:
+        if filterDict['format'] not in ['json', 'binary']:
+            config.errorLogger(syslog.LOG_ERR, "{value} is not a valid format".format(value=filterDict['format']))
+            filterDict.pop('format', None)
+        elif filterDict['format'] == 'json':
+            filterDict.pop('format', None)
+    if 'compression' in filterDict:
+        if filterDict['compression'] not in ['zlib', 'none']:
+            config.errorLogger(syslog.LOG_ERR, "{value} is not a valid compression".format(value=filterDict['compression']))
+            filterDict.pop('compression', None)
+        elif filterDict['compression'] == 'none':
+            filterDict.pop('compression', None)
+    return compileFilter(filterDict)
 
-def getFilteredData(filterInfo, sensorData):
+def process_history(request, addr):
     """
-        Returns a dictionary containing the filtered sensors. 
-        @param filterInfo: Dictionary containing the filters
-        @return: Dictionary containing only the subscribed to sensors
-    """
-#     global sensorData
-    filteredDict = {}
-    #sensor names have the highest priority for filters
-    if "sensornames" in filterInfo:
-        for node in sensorData:
-            filteredDict[node] = {}
-            for sname in filterInfo['sensornames']:
-                filteredDict[node][sname.split('/')[-1]] = sensorData[node][sname.split('/')[-1]]
-        return filteredDict
-    elif 'sensortypes' in filterInfo:
-        for node in sensorData:
-            filteredDict[node] = {}
-            for sname in sensorData[node]:
-                if sensorData[node][sname]['type'][0] in filterInfo['sensortypes']:
-                    filteredDict[node][sname] = sensorData[node][sname]
-        return filteredDict
-    else:
-        return sensorData
-    
-    
-def on_new_client(clientsocket, addr):
+        Validates a history request received from a client. The request selects the nodes and sensors
+        the same way as the filters, and adds the time range and resolution. Times are in seconds since
+        the epoch, zero or negative times are relative to the current time. 
+        
+        @param request: Dictionary containing the history request
+        @param addr: The address of the client as a string.
+        @return: dictionary with the request id, the time range, the resolution and the compiled filters
+                 selecting the sensors, with the error to send back if the request is not valid
     """
-         Run in a thread,under a subprocess, sends telemetry data to a subscribed client
-           
-         @param clientsocket: the socket opened with the subscriber
-         @param addr: The address of the subscriber
-    """ 
-    last_run = next_run = now = get_millis()
-    clientSubRate = update_every
-    clientsocket.settimeout(0.1)
-    count = 0
-    config.errorLogger(syslog.LOG_INFO, "Telemetry streaming connected to {address}".format(address= addr))
-    global killNow
-    filterInfo = {}
-    while True:
-        if killNow:
-            break
+    if not isinstance(request, dict):
+        return {'id': None, 'error': 'The history request must be a JSON object'}
+    now = time.time()
+    historyRequest = {'id': request.get('id'), 'error': None}
+    try:
+        start = float(request.get('start', -300))
+        end = float(request.get('end', 0))
+    except (TypeError, ValueError):
+        config.errorLogger(syslog.LOG_ERR, "Invalid history time range from client {addr}".format(addr=addr))
+        historyRequest['error'] = 'start and end must be numbers'
+        return historyRequest
+    historyRequest['start'] = start if start > 0 else now + start
+    historyRequest['end'] = end if end > 0 else now + end
+    resolution = request.get('resolution', 'auto')
+    if resolution not in ['auto', 'raw', '10s', '1m']:
+        config.errorLogger(syslog.LOG_ERR, "{value} is not a valid history resolution".format(value=resolution))
+        resolution = 'auto'
+    historyRequest['resolution'] = resolution
+    filterDict = dict((key, request[key]) for key in ['sensornames', 'sensortypes', 'nodes', 'noderange', 'groups'] if key in request)
+    historyRequest['filterInfo'] = validateFilter(filterDict, addr)
+    if not telemetryHistory.enabled:
+        historyRequest['error'] = 'Telemetry history is not enabled'
+    return historyRequest
 
-        if next_run <= now:
-            count += 1
-            while next_run <=now:
-                next_run += clientSubRate
-            dt = now - last_run
-            last_run = now
-            
-            if count == 1:
-                dt = 0
-            filteredSensors = getFilteredData(filterInfo, sensorData)
-            data2send = (json.dumps(filteredSensors, indent=0, separators=(',', ':')).replace('\n','') +"\n").encode()
-#             data2send = (json.dumps(sensorData, indent=0, separators=(',', ':')).replace('\n','') +"\n").encode()
-            msg = struct.pack('>I', len(data2send)) + data2send
-            clientsocket.sendall(msg) 
-        time.sleep(0.3) #wait 1/3 of a second and check for new
-        now = get_millis()   
+def historyValues(values):
+    """
+        Converts an array of history values to a list for JSON, with missing values as null
+    """
+    return [None if value != value else float('%.6g' % value) for value in values.tolist()]
+
+def historyMessage(answer):
+    """
+        Encodes a chunk of a history answer as a length prefixed JSON message
+    """
+    data2send = (json.dumps({'history': answer}, separators=(',', ':')) + "\n").encode()
+    return struct.pack('>I', len(data2send)) + data2send
+
+def historySelection(historyRequest):
+    """
+        Resolves the nodes and sensors of a history request against the current catalogues. Called from
+        the socket server loop, which owns the catalogues.
+
+        @param historyRequest: the validated history request, from process_history
+        @return: tuple with the selection for telemetryHistory.query, and the list of the xCAT node name
+                 and sensor name of each selected sensor
+    """
+    selection = []
+    names = []
+    if historyRequest['error'] is not None:
+        return selection, names
+    filterInfo = historyRequest['filterInfo']
+    nodeIDs = filterInfo['nodeIDs'] if filterInfo['nodeIDs'] is not None else sorted(nodeCatalogues)
+    for nodeID in nodeIDs:
+        catalogue = nodeCatalogues.get(nodeID)
+        if catalogue is None:
+            continue
+        xcatNodeName = config.getNodeByID(nodeID)['xcatNodeName']
+        slots, snames = getCatalogueSlots(filterInfo, catalogue)
+        if slots:
+            selection.append((xcatNodeName, nodeID, [catalogue['paths'][slot] for slot in slots]))
+            names.extend((xcatNodeName, sname) for sname in snames)
+    return selection, names
+
+def historyChunks(historyRequest, selection, names):
+    """
+        Looks up a history request and yields the answer in chunks. Each chunk is a length prefixed JSON 
+        message with the history key, holding the times and values of some of the rows, so a large answer
+        is sent a piece at a time between the live readings. The last chunk has last set to true. 
         
+        @param historyRequest: the validated history request, from process_history
+        @param selection: the selected sensors, from historySelection
+        @param names: the xCAT node name and sensor name of each selected sensor, from historySelection
+    """
+    answer = {'id': historyRequest['id'], 'chunk': 0, 'last': True}
+    if historyRequest['error'] is not None:
+        answer['error'] = historyRequest['error']
+        yield historyMessage(answer)
+        return
+    resolution = historyRequest['resolution']
+    if resolution == 'auto':
+        resolution = telemetryHistory.getResolution(historyRequest['start'])
+    answer['resolution'] = resolution
+    #a chunk is held back until the next one is built, so the last one can be marked
+    previous = None
+    for times, data in telemetryHistory.query(selection, historyRequest['start'], historyRequest['end'], resolution):
+        keys = sorted(data)
+        rowsPerChunk = max(1, historyChunkValues // max(1, len(names) * len(keys)))
+        firsts = range(0, len(times), rowsPerChunk)
+        if not len(times) and previous is None:
+            #nothing in the range, answer with an empty chunk
+            firsts = [0]
+        for first in firsts:
+            rows = slice(first, first + rowsPerChunk)
+            nodes = {}
+            for column, (xcatNodeName, sname) in enumerate(names):
+                if resolution == 'raw':
+                    nodes.setdefault(xcatNodeName, {})[sname] = historyValues(data['value'][rows, column])
+                else:
+                    nodes.setdefault(xcatNodeName, {})[sname] = dict((key, historyValues(data[key][rows, column])) for key in keys)
+            if previous is not None:
+                previous['last'] = False
+                yield historyMessage(previous)
+                answer['chunk'] += 1
+            previous = dict(answer)
+            previous['times'] = [round(value, 3) for value in times[rows].tolist()]
+            previous['data'] = nodes
+    previous['last'] = True
+    yield historyMessage(previous)
+
+def startHistory(historyRequest):
+    """
+        Starts answering a history request in a worker thread, so reading the history never holds up 
+        the socket server loop. 
+        
+        @param historyRequest: the validated history request, from process_history
+        @return: dictionary with the queue of the encoded chunks of the answer
+    """
+    selection, names = historySelection(historyRequest)
+    job = {'chunks': queue.Queue(historyQueuedChunks), 'done': False, 'cancelled': False}
+    t = threading.Thread(target=historyWorker, args=[job, historyRequest, selection, names])
+    t.daemon = True
+    t.start()
+    return job
+
+def historyWorker(job, historyRequest, selection, names):
+    """
+        Encodes the chunks of a history answer and queues them for the socket server loop. Run in its 
+        own thread, at most historyThreads of them look up answers at once. The worker waits while the
+        chunks it queued are not sent yet, and stops when the subscriber disconnects.
+        
+        @param job: dictionary with the queue of the chunks, from startHistory
+        @param historyRequest: the validated history request, from process_history
+        @param selection: the selected sensors, from historySelection
+        @param names: the xCAT node name and sensor name of each selected sensor, from historySelection
+    """
+    with historySemaphore:
         try:
-            raw_msglen = recvall(clientsocket, 4)
-            if not raw_msglen:
-                break
-            msglen = struct.unpack('>I', raw_msglen)[0]
-            data = recvall(clientsocket, msglen)
-            if not data:
-                break
-            else:
-                filterInfo = process_data(data, addr)
-                if 'frequency' in filterInfo:
-                    clientSubRate = filterInfo['frequency'] * 1000
-        except socket.timeout:
-            pass
+            for msg in historyChunks(historyRequest, selection, names):
+                while not job['cancelled']:
+                    try:
+                        job['chunks'].put(msg, timeout=1)
+                        break
+                    except queue.Full:
+                        continue
+                if job['cancelled']:
+                    break
+                notifyHistory()
         except Exception as e:
-            config.errorLogger(syslog.LOG_ERR, "Error processing message filters from client at: {caddress}.".format(caddress=addr))
+            config.errorLogger(syslog.LOG_ERR, "Unable to answer the telemetry history request {id}".format(id=historyRequest['id']))
             exc_type, exc_obj, exc_tb = sys.exc_info()
             fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
             config.errorLogger(syslog.LOG_DEBUG, "Exception: Error: {err}, Details: {etype}, {fname}, {lineno}".format(err=e, etype=exc_type, fname=fname, lineno=exc_tb.tb_lineno))
-            traceback.print_tb(e.__traceback__)
+            try:
+                job['chunks'].put(historyMessage({'id': historyRequest['id'], 'chunk': 0, 'last': True,
+                                                  'error': 'The history could not be read'}), timeout=1)
+            except queue.Full:
+                pass
+        finally:
+            job['done'] = True
+            notifyHistory()
+
+def notifyHistory():
+    """
+         Wakes the socket server after a chunk of a history answer was queued
+    """ 
+    if historyWakeSend is None:
+        return
+    try:
+        historyWakeSend.send(b'\0')
+    except socket.error:
+        pass
+
+def pushHistory(sel):
+    """
+         Sends the next chunk of the history answers to the subscribers that have sent everything else 
+         queued for them, so history answers never hold back the live readings for long. 
+           
+         @param sel: the selector of the socket server
+         @return: True if chunks are left for subscribers that can take them right away
+    """ 
+    pending = False
+    for client in list(clientList):
+        if not client['history'] or client['outbuf'] or client['closed']:
+            continue
+        job = client['history'][0]
+        #read before taking a chunk, so a chunk queued just before the worker finished isn't missed
+        done = job['done']
+        try:
+            msg = job['chunks'].get_nowait()
+        except queue.Empty:
+            if done:
+                client['history'].pop(0)
+                pending = pending or bool(client['history'])
+            continue
+        if client['compressor'] is not None:
+            msg = compressMessage(client, msg)
+        client['outbuf'] = msg
+        writeClient(sel, client)
+        pending = pending or (not client['outbuf'] and not job['chunks'].empty())
+    return pending
+
+def resolveNodeFilter(filterDict):
+    """
+        Resolves the node filters of a client against the node registry. Nodes can be selected by a list
+        of xCAT node names, a list of xCAT groups, an xCAT style noderange, or any combination of them. 
+        Names that don't match a monitored node are logged and ignored. 
+        
+        @param filterDict: Dictionary containing the filters received from the client
+        @return: sorted list of the nodeIDs selected
+    """
+    nodeIDs = set()
+    if 'nodes' in filterDict:
+        if not isinstance(filterDict['nodes'], list):
+            config.errorLogger(syslog.LOG_ERR, "{value} is not a valid list of nodes".format(value=filterDict['nodes']))
+        else:
+            for xcatNodeName in filterDict['nodes']:
+                node = config.getNodeByXcatName(xcatNodeName)
+                if node is None:
+                    config.errorLogger(syslog.LOG_ERR, "{value} is not a monitored node".format(value=xcatNodeName))
+                else:
+                    nodeIDs.add(node['nodeID'])
+    if 'groups' in filterDict:
+        if not isinstance(filterDict['groups'], list):
+            config.errorLogger(syslog.LOG_ERR, "{value} is not a valid list of groups".format(value=filterDict['groups']))
+        else:
+            for group in filterDict['groups']:
+                nodes = config.getNodesByGroup(group)
+                if not nodes:
+                    config.errorLogger(syslog.LOG_ERR, "{value} is not a group of monitored nodes".format(value=group))
+                nodeIDs.update(node['nodeID'] for node in nodes)
+    if 'noderange' in filterDict:
+        if not isinstance(filterDict['noderange'], str):
+            config.errorLogger(syslog.LOG_ERR, "{value} is not a valid noderange".format(value=filterDict['noderange']))
+        else:
+            nodes, unknown = config.resolveNoderange(filterDict['noderange'])
+            for item in unknown:
+                config.errorLogger(syslog.LOG_ERR, "{value} does not match any monitored node".format(value=item))
+            nodeIDs.update(node['nodeID'] for node in nodes)
+    return sorted(nodeIDs)
 
+def findSensorSlots(catalogue, sname):
+    """
+        Finds the sensors of a catalogue matching a name from a subscription filter. An exact sensor name 
+        or full path selects that sensor, otherwise every sensor whose name or full path starts with it 
+        is selected.
         
-    for item in clientList:
-        if addr == item:
-            clientList.remove(item)
-    clientsocket.close()
+        @param catalogue: the sensor catalogue
+        @param sname: the sensor name, full path or prefix requested
+        @return: sorted list of sensor slots, empty if nothing matches
+    """
+    slot = catalogue['exactIndex'].get(sname)
+    if slot is not None:
+        return [slot]
+    return findPrefixSlots(catalogue, sname)
+
+def findPrefixSlots(catalogue, prefix):
+    """
+        Returns the slots of the sensors in a catalogue whose name or full path starts with a prefix
+        
+        @param catalogue: the sensor catalogue
+        @param prefix: the start of the sensor names
+        @return: sorted list of sensor slots
+    """
+    slots = []
+    prefixNames = catalogue['prefixNames']
+    i = bisect.bisect_left(prefixNames, prefix)
+    while i < len(prefixNames) and prefixNames[i].startswith(prefix):
+        if catalogue['prefixSlots'][i] not in slots:
+            slots.append(catalogue['prefixSlots'][i])
+        i += 1
+    return sorted(slots)
+
+def selectSensors(sensor, sensorType, noderange, owner):
+    """
+        Finds the sensors of the monitored nodes selected by a sensor name or a sensor type. A sensor name 
+        matching a sensor of a node exactly selects that sensor, otherwise all of the sensors of the node
+        starting with the name are used. 
+        
+        @param sensor: the sensor name, or None to select by type
+        @param sensorType: the sensor type, used when no sensor name is given
+        @param noderange: xCAT noderange limiting the nodes, or None for all of them
+        @param owner: description of what the sensors are selected for, used in the log
+        @return: list of tuples with the nodeID, the sensor slot and the catalogue of the node
+    """
+    if noderange:
+        nodes, unknown = config.resolveNoderange(noderange)
+        for item in unknown:
+            config.errorLogger(syslog.LOG_DEBUG, "{value} in the noderange of {owner} does not match any monitored node".format(value=item, owner=owner))
+    else:
+        nodes = config.nodeRegistry['byID']
+    selected = []
+    for node in nodes:
+        catalogue = nodeCatalogues.get(node['nodeID'])
+        if catalogue is None:
+            continue
+        if sensor is None:
+            slots = catalogue['typeSlots'].get(sensorType, [])
+        else:
+            slots = findSensorSlots(catalogue, sensor)
+        for slot in slots:
+            selected.append((node['nodeID'], slot, catalogue))
+    return selected
+
+def buildAggregateIndexes():
+    """
+        Works out the sensors covered by each aggregate from the catalogues of the nodes. 
+    """
+    rowSize = sensorTable['rowSize']
+    for aggregate in telemetryAggregates.aggregates:
+        indexes = []
+        sensorType = None
+        for nodeID, slot, catalogue in selectSensors(aggregate['sensor'], None, aggregate['noderange'], "aggregate " + aggregate['name']):
+            indexes.append(nodeID * rowSize + slot)
+            if sensorType is None:
+                sensorType = catalogue['types'][slot]
+        telemetryAggregates.setIndexes(aggregate, indexes, sensorType)
+
+def buildRuleIndexes():
+    """
+        Works out the sensors checked by each telemetry rule from the catalogues of the nodes. 
+    """
+    rowSize = sensorTable['rowSize']
+    for rule in telemetryRules.rules:
+        indexes = []
+        sensors = []
+        for nodeID, slot, catalogue in selectSensors(rule['sensor'], rule['type'], rule['noderange'], "telemetry rule " + rule['name']):
+            indexes.append(nodeID * rowSize + slot)
+            sensors.append((nodeID, catalogue['names'][slot]))
+        telemetryRules.setSensors(rule, indexes, sensors)
+
+def compileFilter(filterDict):
+    """
+        Resolves a filter once, when it is received, so sending the readings only has to pick the 
+        precomputed nodes and sensors. The sensors selected for each catalogue are worked out the first
+        time the catalogue is used, and kept with the filter, so catalogues arriving after the filter 
+        are matched as well. Sensor names have the highest priority. 
+        
+        @param filterDict: Dictionary containing the validated filters
+        @return: the same dictionary with the sensor names and types, the node names and the key of the
+                 filter added
+    """
+    snames = None
+    types = None
+    if 'sensornames' in filterDict:
+        snames = list(filterDict['sensornames'])
+    elif 'sensortypes' in filterDict:
+        types = sorted(set(filterDict['sensortypes']))
+    filterDict['snames'] = snames
+    filterDict['types'] = types
+    filterDict['catalogueSlots'] = {}
+    nodeIDs = filterDict.get('nodeIDs')
+    filterDict['nodeIDs'] = nodeIDs
+    filterDict['nodeNames'] = None if nodeIDs is None else [config.getNodeByID(nodeID)['xcatNodeName'] for nodeID in nodeIDs]
+    filterDict['aggregates'] = filterDict.get('aggregates')
+    #clients selecting the same nodes and sensors in the same format share the encoded frames
+    filterDict['key'] = json.dumps({'format': filterDict.get('format', 'json'), 'snames': snames, 'types': types, 'nodes': nodeIDs, 
+                                    'aggregates': filterDict['aggregates']})
+    return filterDict
+
+def getCatalogueSlots(filterInfo, catalogue):
+    """
+        Returns the sensors a filter selects from a catalogue, in the order they are sent
+        
+        @param filterInfo: Dictionary containing the compiled filters
+        @param catalogue: the sensor catalogue of a node
+        @return: tuple with the list of sensor slots and the list of their names
+    """
+    selected = filterInfo['catalogueSlots'].get(catalogue['id'])
+    if selected is None:
+        if filterInfo['snames'] is not None:
+            slots = []
+            for sname in filterInfo['snames']:
+                slots.extend(slot for slot in findSensorSlots(catalogue, sname) if slot not in slots)
+        elif filterInfo['types'] is not None:
+            slots = sorted(slot for stype in filterInfo['types'] for slot in catalogue['typeSlots'].get(stype, []))
+        else:
+            slots = list(range(catalogue['sensorCount']))
+        selected = (slots, [catalogue['names'][slot] for slot in slots])
+        filterInfo['catalogueSlots'][catalogue['id']] = selected
+    return selected
+
+def getFilteredData(filterInfo, sensorData):
+    """
+        Returns a dictionary containing the filtered sensors. Nodes without any of the selected sensors
+        are left out. The selected aggregates are added as the sensors of a node named aggregates. 
+        @param filterInfo: Dictionary containing the compiled filters
+        @return: Dictionary containing only the subscribed to nodes and sensors
+    """
+    nodeNames = filterInfo['nodeNames']
+    allSensors = filterInfo['snames'] is None and filterInfo['types'] is None
+    if allSensors and nodeNames is None and filterInfo['aggregates'] is None:
+        return sensorData
+    if nodeNames is None:
+        nodeNames = sensorData
+    filteredData = {}
+    for xcatNodeName in nodeNames:
+        if xcatNodeName not in sensorData:
+            continue
+        if allSensors:
+            filteredData[xcatNodeName] = sensorData[xcatNodeName]
+            continue
+        catalogue = nodeCatalogues.get(config.getNodeByXcatName(xcatNodeName)['nodeID'])
+        if catalogue is None:
+            continue
+        names = getCatalogueSlots(filterInfo, catalogue)[1]
+        if names:
+            filteredData[xcatNodeName] = dict((sname, sensorData[xcatNodeName][sname]) for sname in names)
+    if filterInfo['aggregates'] is not None:
+        aggregateValues = telemetryAggregates.aggregateValues
+        filteredData['aggregates'] = dict((name, aggregateValues[name]) for name in filterInfo['aggregates'] if name in aggregateValues)
+    return filteredData
+
+def getBinaryLayout(filterInfo):
+    """
+        Returns the layout of the binary frames for a filter. The layout is rebuilt when the nodes sent, 
+        their catalogues or their scales change, and is given a new id so the clients know to use the 
+        new catalogue. 
+        
+        @param filterInfo: Dictionary containing the filters
+        @return: dictionary with the layout id, the positions in the table of the sensors in the order 
+                 they are packed, and the length prefixed catalogue message describing them
+    """
+    global layoutSeq
+    key = getFilterKey(filterInfo)
+    layout = binaryLayouts.get(key)
+    if layout is not None and layout['seq'] == snapshotSeq:
+        return layout
+    rowSize = sensorTable['rowSize']
+    nodeIDs = []
+    for xcatNodeName in sensorData if filterInfo['nodeNames'] is None else filterInfo['nodeNames']:
+        node = config.getNodeByXcatName(xcatNodeName)
+        if node is not None and xcatNodeName in sensorData and node['nodeID'] in nodeCatalogues:
+            nodeIDs.append(node['nodeID'])
+    nodeIDs.sort()
+    rows = []
+    for nodeID in nodeIDs:
+        slots = getCatalogueSlots(filterInfo, nodeCatalogues[nodeID])[0]
+        if slots:
+            rows.append((nodeID, nodeCatalogues[nodeID]['id'], slots))
+    scales = [[sensorTable['scales'][nodeID * rowSize + slot] for slot in slots] for nodeID, catalogueID, slots in rows]
+    aggregateNames = filterInfo['aggregates'] or []
+    aggregateTypes = [telemetryAggregates.aggregateValues.get(name, {}).get('type') for name in aggregateNames]
+    signature = [(nodeID, catalogueID) for nodeID, catalogueID, slots in rows] + [aggregateTypes]
+    if layout is None or layout['signature'] != signature or layout['scales'] != scales:
+        layoutSeq += 1
+        #nodes with the same catalogue share one list of sensors
+        sensorSets = []
+        sensorSet = []
+        for nodeID, catalogueID, slots in rows:
+            if catalogueID not in sensorSets:
+                sensorSets.append(catalogueID)
+            sensorSet.append(sensorSets.index(catalogueID))
+        catalogue = {'catalogue': {'id': layoutSeq,
+                                   'nodes': [config.getNodeByID(nodeID)['xcatNodeName'] for nodeID, catalogueID, slots in rows],
+                                   'sensorSet': sensorSet,
+                                   'sensors': [getCatalogueSlots(filterInfo, catalogues[catalogueID])[1] for catalogueID in sensorSets],
+                                   'types': [[catalogues[catalogueID]['types'][slot] for slot in getCatalogueSlots(filterInfo, catalogues[catalogueID])[0]] for catalogueID in sensorSets],
+                                   'scales': scales}}
+        if aggregateNames:
+            #the aggregates are packed last, as the sensors of a node named aggregates
+            catalogue['catalogue']['nodes'].append('aggregates')
+            catalogue['catalogue']['sensorSet'].append(len(sensorSets))
+            catalogue['catalogue']['sensors'].append(aggregateNames)
+            catalogue['catalogue']['types'].append(aggregateTypes)
+            catalogue['catalogue']['scales'].append([1] * len(aggregateNames))
+        data2send = (json.dumps(catalogue, separators=(',', ':')) + "\n").encode()
+        layout = {'id': layoutSeq,
+                  'signature': signature,
+                  'scales': scales,
+                  'indexes': [nodeID * rowSize + slot for nodeID, catalogueID, slots in rows for slot in slots],
+                  'aggregates': aggregateNames,
+                  'message': struct.pack('>I', len(data2send)) + data2send}
+        binaryLayouts[key] = layout
+    layout['seq'] = snapshotSeq
+    return layout
+
+def encodeBinaryFrame(layout):
+    """
+        Packs the readings of a binary layout. The frame is the letter B, the layout id as an unsigned 
+        4 byte integer, the snapshot sequence number as an unsigned 8 byte integer, then the value of 
+        each sensor as an 8 byte float, node by node in catalogue order. All numbers are big endian. 
+        
+        @param layout: the binary layout, from getBinaryLayout
+        @return: the frame without the length prefix
+    """
+    values = sensorTable['values']
+    readings = [values[index] for index in layout['indexes']]
+    for name in layout['aggregates']:
+        value = telemetryAggregates.aggregateValues.get(name, {}).get('value')
+        readings.append(float('nan') if value is None else value)
+    return b'B' + struct.pack('>IQ%dd' % len(readings), layout['id'], snapshotSeq, *readings)
+
+def getFilterKey(filterInfo):
+    """
+        Returns a key identifying the sensors selected by a filter, clients with the same key are sent 
+        the same data
+        
+        @param filterInfo: Dictionary containing the compiled filters
+    """
+    return filterInfo['key']
+
+def getEncodedFrame(filterInfo):
+    """
+        Returns the length prefixed message with the filtered sensor readings. The message is encoded once
+        for each distinct filter and snapshot of the readings, and shared by all of the clients using 
+        that filter. It is encoded under the snapshot lock, so a new snapshot can't be published while 
+        the message is being encoded and the message only contains the readings of the snapshot it is 
+        cached for. 
+        
+        @param filterInfo: Dictionary containing the filters
+        @return: the bytes to send to the client
+    """
+    global frameCache
+    key = getFilterKey(filterInfo)
+    with snapshotLock:
+        if frameCache['seq'] != snapshotSeq:
+            frameCache = {'seq': snapshotSeq, 'frames': {}}
+        if key in frameCache['frames']:
+            return frameCache['frames'][key]
+        if filterInfo.get('format') == 'binary':
+            data2send = encodeBinaryFrame(getBinaryLayout(filterInfo))
+        else:
+            filteredSensors = getFilteredData(filterInfo, sensorData)
+            data2send = (json.dumps(filteredSensors, indent=0, separators=(',', ':')).replace('\n','') +"\n").encode()
+        msg = struct.pack('>I', len(data2send)) + data2send
+        frameCache['frames'][key] = msg
+    return msg
+
+def acceptClient(sel, servsocket):
+    """
+         Accepts a new subscriber and registers it with the selector
+           
+         @param sel: the selector of the socket server
+         @param servsocket: the listening socket
+    """ 
+    clientsocket, addr = servsocket.accept()
+    clientsocket.setblocking(False)
+    client = {'sock': clientsocket,
+              'addr': addr,
+              'filterInfo': compileFilter({}),
+              'rate': update_every,
+              'lastSent': 0,
+              'sentSeq': None,
+              'inbuf': b'',
+              'outbuf': b'',
+              'catalogueID': None,
+              'compressor': None,
+              'rawBytes': 0,
+              'compressedBytes': 0,
+              'compressTime': 0.0,
+              'history': [],
+              'closed': False}
+    sel.register(clientsocket, selectors.EVENT_READ, client)
+    clientList.append(client)
+    config.errorLogger(syslog.LOG_INFO, "Telemetry streaming connected to {address}".format(address= addr))
+    #send the current readings right away
+    queueFrame(sel, client, get_millis())
+
+def closeClient(sel, client):
+    """
+         Unregisters and closes the socket of a subscriber
+           
+         @param sel: the selector of the socket server
+         @param client: dictionary containing the state of the subscriber
+    """ 
+    if client['closed']:
+        return
+    client['closed'] = True
+    try:
+        sel.unregister(client['sock'])
+    except (KeyError, ValueError):
+        pass
+    client['sock'].close()
+    for job in client['history']:
+        job['cancelled'] = True
+    config.errorLogger(syslog.LOG_INFO, "Telemetry streaming disconnected from {address}".format(address=client['addr']))
+    if client['compressor'] is not None and client['compressedBytes'] > 0:
+        config.errorLogger(syslog.LOG_INFO, "Telemetry compression for {address}: {raw} bytes sent as {compressed} bytes, ratio {ratio:.1f}, {cpu:.0f} ms CPU".format(
+            address=client['addr'], raw=client['rawBytes'], compressed=client['compressedBytes'], 
+            ratio=float(client['rawBytes']) / client['compressedBytes'], cpu=client['compressTime'] * 1000))
+    if client in clientList:
+        clientList.remove(client)
+
+def compressMessage(client, msg):
+    """
+         Compresses a length prefixed message with the compression stream of a subscriber. The result is 
+         length prefixed as well, and its data is the letter Z followed by the compressed bytes. The stream
+         is flushed after each message, so every message can be decompressed as soon as it arrives, and 
+         repeated keys in later messages compress to almost nothing. 
+           
+         @param client: dictionary containing the state of the subscriber
+         @param msg: the length prefixed message
+         @return: the length prefixed compressed message
+    """ 
+    start = time.process_time()
+    data = b'Z' + client['compressor'].compress(msg[4:]) + client['compressor'].flush(zlib.Z_SYNC_FLUSH)
+    client['compressTime'] += time.process_time() - start
+    client['rawBytes'] += len(msg) - 4
+    client['compressedBytes'] += len(data)
+    return struct.pack('>I', len(data)) + data
+
+def queueFrame(sel, client, now):
+    """
+         Queues the current readings for a subscriber, using its filter. If the subscriber has not read 
+         the previous frame yet, it is skipped until it catches up. 
+           
+         @param sel: the selector of the socket server
+         @param client: dictionary containing the state of the subscriber
+         @param now: the current time in milliseconds
+    """ 
+    if client['outbuf'] or client['closed']:
+        return
+    with snapshotLock:
+        #the frame and its catalogue come from the same snapshot
+        messages = [getEncodedFrame(client['filterInfo'])]
+        if client['filterInfo'].get('format') == 'binary':
+            layout = getBinaryLayout(client['filterInfo'])
+            if client['catalogueID'] != layout['id']:
+                #the catalogue goes ahead of the first frame using it
+                messages.insert(0, layout['message'])
+                client['catalogueID'] = layout['id']
+        sentSeq = snapshotSeq
+    if client['compressor'] is not None:
+        messages = [compressMessage(client, msg) for msg in messages]
+    client['outbuf'] = b''.join(messages)
+    client['lastSent'] = now
+    client['sentSeq'] = sentSeq
+    writeClient(sel, client)
+
+def writeClient(sel, client):
+    """
+         Sends as much of the queued data as the socket of the subscriber accepts without blocking, 
+         and waits for the socket to be writable if some is left. 
+           
+         @param sel: the selector of the socket server
+         @param client: dictionary containing the state of the subscriber
+    """ 
+    try:
+        sent = client['sock'].send(client['outbuf'])
+        client['outbuf'] = client['outbuf'][sent:]
+    except (BlockingIOError, InterruptedError):
+        pass
+    except socket.error:
+        closeClient(sel, client)
+        return
+    if client['outbuf']:
+        sel.modify(client['sock'], selectors.EVENT_READ | selectors.EVENT_WRITE, client)
+    else:
+        sel.modify(client['sock'], selectors.EVENT_READ, client)
+
+def readClient(sel, client):
+    """
+         Reads the filter messages and history requests sent by a subscriber. Each message is a 4 byte 
+         length followed by the JSON formatted filter or request. 
+           
+         @param sel: the selector of the socket server
+         @param client: dictionary containing the state of the subscriber
+         @return: False if the subscriber disconnected
+    """ 
+    try:
+        data = client['sock'].recv(4096)
+    except (BlockingIOError, InterruptedError):
+        return True
+    if not data:
+        return False
+    client['inbuf'] += data
+    while len(client['inbuf']) >= 4:
+        msglen = struct.unpack('>I', client['inbuf'][:4])[0]
+        if len(client['inbuf']) < 4 + msglen:
+            break
+        message = client['inbuf'][4:4 + msglen]
+        client['inbuf'] = client['inbuf'][4 + msglen:]
+        filterInfo = process_data(message, client['addr'])
+        if filterInfo is None:
+            continue
+        if 'history' in filterInfo:
+            #answered in chunks between the live readings
+            client['history'].append(startHistory(filterInfo['history']))
+            continue
+        client['filterInfo'] = filterInfo
+        #once started, compression stays on for the rest of the connection
+        if filterInfo.get('compression') == 'zlib' and client['compressor'] is None:
+            client['compressor'] = zlib.compressobj(config.telemCompressionLevel)
+        if 'frequency' in filterInfo:
+            client['rate'] = filterInfo['frequency'] * 1000
+        #send the readings with the new filter right away
+        queueFrame(sel, client, get_millis())
+    return True
+
+def notifySnapshot():
+    """
+         Wakes the socket server after new readings have been applied
+    """ 
+    if snapshotWakeSend is None:
+        return
+    try:
+        snapshotWakeSend.send(b'\0')
+    except socket.error:
+        pass
+
+def pushFrames(sel, newSnapshot):
+    """
+         Sends frames to the subscribers that are due. When new readings arrive, subscribers whose 
+         interval has passed get them immediately. Without new readings, the current readings are 
+         resent once a subscriber's interval has passed by another update period. 
+           
+         @param sel: the selector of the socket server
+         @param newSnapshot: True if new readings were just applied
+         @return: the time in seconds until the next subscriber is due
+    """ 
+    now = get_millis()
+    wait = update_every
+    for client in list(clientList):
+        due = client['lastSent'] + client['rate']
+        if newSnapshot and client['sentSeq'] != snapshotSeq and now >= due - update_every / 2:
+            queueFrame(sel, client, now)
+        elif now >= due + update_every:
+            queueFrame(sel, client, now)
+        else:
+            wait = min(wait, due + update_every - now)
+    return max(wait, 0) / 1000.0
 
-    
 def socket_server(servsocket):
+    """
+         Event driven server streaming the sensor readings to the subscribers. A single selector waits 
+         for new connections, filter messages, writable client sockets and new readings. 
+           
+         @param servsocket: the socket to listen on
+    """ 
     global serverhostname
+    global snapshotWakeSend
+    global historyWakeSend
+    sel = selectors.DefaultSelector()
+    wakeRecv, snapshotWakeSend = socket.socketpair()
+    wakeRecv.setblocking(False)
+    sel.register(wakeRecv, selectors.EVENT_READ, 'wake')
+    historyWakeRecv, historyWakeSend = socket.socketpair()
+    historyWakeRecv.setblocking(False)
+    sel.register(historyWakeRecv, selectors.EVENT_READ, 'historyWake')
+    telemetryHistory.setup(sensorTable)
+    telemetryAggregates.setup(sensorTable)
+    telemetryRules.setup(sensorTable)
     dataUpdaterThread = threading.Thread(target=telemReceive)
     dataUpdaterThread.daemon = True
     dataUpdaterThread.start()
@@ -677,32 +1817,52 @@ def socket_server(servsocket):
     
     servsocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     servsocket.bind((serverhostname,config.telemPort))
-    servsocket.listen(15)
-    read_list = [servsocket]
+    servsocket.listen(128)
+    servsocket.setblocking(False)
+    sel.register(servsocket, selectors.EVENT_READ, 'listen')
     global killNow
+    timeout = 1
     while True:
         if killNow:
             break
         try:
-            if not dataUpdaterThread.isAlive():
+            if not dataUpdaterThread.is_alive():
                 dataUpdaterThread = threading.Thread(target=telemReceive)
                 dataUpdaterThread.daemon = True
                 dataUpdaterThread.start()
                 config.errorLogger(syslog.LOG_DEBUG, "Restarted the data consolidation thread")
-            readable, writeable, errored = select.select(read_list, [], [], 30)
-            for s in readable:
-                if s is servsocket:
-                    c, addr = servsocket.accept()
-                    t = threading.Thread(target=on_new_client, args =[c,addr])
-                    t.daemon = True
-                    t.start()
-                else:
-                    data = s.recv(1024)
-                    if data:
+            newSnapshot = False
+            for key, mask in sel.select(min(timeout, 1)):
+                if key.data == 'listen':
+                    acceptClient(sel, servsocket)
+                elif key.data == 'wake':
+                    try:
+                        while wakeRecv.recv(4096):
+                            pass
+                    except (BlockingIOError, InterruptedError):
                         pass
-                    else:
-                        s.close()
-                        read_list.remove(s)
+                    newSnapshot = True
+                elif key.data == 'historyWake':
+                    try:
+                        while historyWakeRecv.recv(4096):
+                            pass
+                    except (BlockingIOError, InterruptedError):
+                        pass
+                else:
+                    client = key.data
+                    try:
+                        if mask & selectors.EVENT_READ and not readClient(sel, client):
+                            closeClient(sel, client)
+                            continue
+                        if mask & selectors.EVENT_WRITE and not client['closed']:
+                            writeClient(sel, client)
+                    except Exception as e:
+                        config.errorLogger(syslog.LOG_ERR, "Error processing message filters from client at: {caddress}.".format(caddress=client['addr']))
+                        config.errorLogger(syslog.LOG_DEBUG, "Exception: Error: {err}".format(err=e))
+                        closeClient(sel, client)
+            timeout = pushFrames(sel, newSnapshot)
+            if pushHistory(sel):
+                timeout = 0
         except Exception as e:
             config.errorLogger(syslog.LOG_ERR, "Failed to open a telemetry server connection with a client.")
             exc_type, exc_obj, exc_tb = sys.exc_info()
@@ -713,8 +1873,6 @@ def socket_server(servsocket):
     servsocket.close()
   
 def main():
-    global telemUpdateQueue 
-    telemUpdateQueue= multiprocessing.Queue()
     global killQueue
     killQueue = multiprocessing.Queue()
     global messageQueue
@@ -725,123 +1883,42 @@ def main():
     outputData = {}
     global sensorData
     sensorData = {}
-    global sensorList
-    sensorList = [
-        "/xyz/openbmc_project/sensors/current/ps0_output_current",
-                    "/xyz/openbmc_project/sensors/current/ps1_output_current",
-                    "/xyz/openbmc_project/sensors/fan_tach/fan0_0",
-                    "/xyz/openbmc_project/sensors/fan_tach/fan0_1",
-                    "/xyz/openbmc_project/sensors/fan_tach/fan1_0",
-                    "/xyz/openbmc_project/sensors/fan_tach/fan1_1",
-                    "/xyz/openbmc_project/sensors/fan_tach/fan2_0",
-                    "/xyz/openbmc_project/sensors/fan_tach/fan2_1",
-                    "/xyz/openbmc_project/sensors/fan_tach/fan3_0",
-                    "/xyz/openbmc_project/sensors/fan_tach/fan3_1",
-                    "/xyz/openbmc_project/sensors/power/fan_disk_power",
-                    "/xyz/openbmc_project/sensors/power/io_power",
-                    "/xyz/openbmc_project/sensors/power/p0_gpu0_power",
-                    "/xyz/openbmc_project/sensors/power/p0_gpu1_power",
-                    "/xyz/openbmc_project/sensors/power/p0_gpu2_power",
-                    "/xyz/openbmc_project/sensors/power/p0_io_power",
-                    "/xyz/openbmc_project/sensors/power/p0_mem_power",
-                    "/xyz/openbmc_project/sensors/power/p0_power",
-                    "/xyz/openbmc_project/sensors/power/p1_gpu0_power",
-                    "/xyz/openbmc_project/sensors/power/p1_gpu1_power",
-                    "/xyz/openbmc_project/sensors/power/p1_gpu2_power",
-                    "/xyz/openbmc_project/sensors/power/p1_io_power",
-                    "/xyz/openbmc_project/sensors/power/p1_mem_power",
-                    "/xyz/openbmc_project/sensors/power/p1_power",
-                    "/xyz/openbmc_project/sensors/power/ps0_input_power",
-                    "/xyz/openbmc_project/sensors/power/ps1_input_power",
-                    "/xyz/openbmc_project/sensors/power/total_power",
-                    "/xyz/openbmc_project/sensors/temperature/ambient",
-                    "/xyz/openbmc_project/sensors/temperature/dimm0_temp",
-                    "/xyz/openbmc_project/sensors/temperature/dimm1_temp",
-                    "/xyz/openbmc_project/sensors/temperature/dimm10_temp",
-                    "/xyz/openbmc_project/sensors/temperature/dimm11_temp",
-                    "/xyz/openbmc_project/sensors/temperature/dimm12_temp",
-                    "/xyz/openbmc_project/sensors/temperature/dimm13_temp",
-                    "/xyz/openbmc_project/sensors/temperature/dimm14_temp",
-                    "/xyz/openbmc_project/sensors/temperature/dimm15_temp",
-                    "/xyz/openbmc_project/sensors/temperature/dimm2_temp",
-                    "/xyz/openbmc_project/sensors/temperature/dimm3_temp",
-                    "/xyz/openbmc_project/sensors/temperature/dimm4_temp",
-                    "/xyz/openbmc_project/sensors/temperature/dimm5_temp",
-                    "/xyz/openbmc_project/sensors/temperature/dimm6_temp",
-                    "/xyz/openbmc_project/sensors/temperature/dimm7_temp",
-                    "/xyz/openbmc_project/sensors/temperature/dimm8_temp",
-                    "/xyz/openbmc_project/sensors/temperature/dimm9_temp",
-                    "/xyz/openbmc_project/sensors/temperature/gpu0_core_temp",
-                    "/xyz/openbmc_project/sensors/temperature/gpu0_mem_temp",
-                    "/xyz/openbmc_project/sensors/temperature/gpu1_core_temp",
-                    "/xyz/openbmc_project/sensors/temperature/gpu1_mem_temp",
-                    "/xyz/openbmc_project/sensors/temperature/gpu2_core_temp",
-                    "/xyz/openbmc_project/sensors/temperature/gpu2_mem_temp",
-                    "/xyz/openbmc_project/sensors/temperature/gpu3_core_temp",
-                    "/xyz/openbmc_project/sensors/temperature/gpu3_mem_temp",
-                    "/xyz/openbmc_project/sensors/temperature/gpu4_core_temp",
-                    "/xyz/openbmc_project/sensors/temperature/gpu4_mem_temp",
-                    "/xyz/openbmc_project/sensors/temperature/gpu5_core_temp",
-                    "/xyz/openbmc_project/sensors/temperature/gpu5_mem_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p0_core0_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p0_core1_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p0_core10_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p0_core11_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p0_core12_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p0_core13_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p0_core14_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p0_core15_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p0_core18_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p0_core19_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p0_core2_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p0_core20_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p0_core21_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p0_core22_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p0_core23_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p0_core3_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p0_core4_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p0_core5_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p0_core6_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p0_core7_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p0_core8_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p0_core9_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p0_vcs_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p0_vdd_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p0_vddr_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p0_vdn_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p1_core0_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p1_core1_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p1_core10_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p1_core11_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p1_core12_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p1_core13_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p1_core14_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p1_core16_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p1_core17_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p1_core18_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p1_core19_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p1_core2_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p1_core20_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p1_core22_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p1_core23_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p1_core3_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p1_core4_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p1_core5_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p1_core6_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p1_core7_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p1_core8_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p1_core9_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p1_vcs_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p1_vdd_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p1_vddr_temp",
-                    "/xyz/openbmc_project/sensors/temperature/p1_vdn_temp",
-                    "/xyz/openbmc_project/sensors/temperature/pcie",
-                    "/xyz/openbmc_project/sensors/voltage/ps0_input_voltage",
-                    "/xyz/openbmc_project/sensors/voltage/ps0_output_voltage",
-                    "/xyz/openbmc_project/sensors/voltage/ps1_input_voltage",
-                    "/xyz/openbmc_project/sensors/voltage/ps1_output_voltage",
-                    "/xyz/openbmc_project/logging"
-                  ]
+    global snapshotSeq
+    snapshotSeq = 0
+    global frameCache
+    frameCache = {'seq': None, 'frames': {}}
+    global snapshotLock
+    snapshotLock = threading.RLock()
+    global binaryLayouts
+    binaryLayouts = {}
+    global layoutSeq
+    layoutSeq = 0
+    global snapshotWakeSend
+    snapshotWakeSend = None
+    global historyChunkValues
+    historyChunkValues = 20000
+    global historyQueuedChunks
+    historyQueuedChunks = 4
+    global historyThreads
+    historyThreads = 2
+    global historySemaphore
+    historySemaphore = threading.BoundedSemaphore(historyThreads)
+    global historyWakeSend
+    historyWakeSend = None
+    global dirtySlots
+    dirtySlots = set()
+    global deltaLock
+    deltaLock = threading.Lock()
+    global deltaSeq
+    deltaSeq = 0
+    global catalogues
+    catalogues = []
+    global catalogueIndex
+    catalogueIndex = {}
+    global catalogueLock
+    catalogueLock = threading.Lock()
+    global nodeCatalogues
+    nodeCatalogues = {}
     requests.packages.urllib3.disable_warnings(requests.packages.urllib3.exceptions.InsecureRequestWarning)
     global wsClosed
     wsClosed = False
@@ -853,10 +1930,6 @@ def main():
     activeThreads = []
     global get_millis
     get_millis = lambda: int(round(time.time() * 1000))
-    global sendQueue
-    sendQueue = queue.Queue()
-    nodeListManager = multiprocessing.Manager()
-    mngedNodeList = nodeListManager.list()
     global serversocket
     serversocket = socket.socket()
     global serverhostname
@@ -870,31 +1943,35 @@ def main():
     killNow = config.killNow
     global gathererProcs
     gathererProcs = []
-    global nodeReferenceDict
-    nodeReferenceDict = {}
-    for node in config.mynodelist:
-        nodeReferenceDict[node['xcatNodeName']] = node.copy()
-    init(mngedNodeList)
+    global minNodesPerGatherer
+    minNodesPerGatherer = 50
+    global minBehindMessages
+    minBehindMessages = 100
+    alertThread = threading.Thread(target=receiveAlerts)
+    alertThread.daemon = True
+    alertThread.start()
+    createSensorTable(len(config.nodeRegistry['byID']))
+    init()
     
     sockServProcess = multiprocessing.Process(target=socket_server, args=[serversocket])
     sockServProcess.daemon = True
     sockServProcess.start()
     config.errorLogger(syslog.LOG_INFO, 'Started Telemetry Streaming')
     
+    nextBalance = time.time() + config.telemRebalanceInterval
     while not config.killNow:
         time.sleep(1)
-        try:
-            while len(mngedNodeList)>0:
-#                 node = config.alertMessageQueue.get()
-                node = mngedNodeList.pop(0)
-                config.nodes2poll.put(node)
-#                 config.alertMessageQueue.task_done()
-        except Exception as e:
-            config.errorLogger(syslog.LOG_ERR, "Error processing an alert message.")
-            exc_type, exc_obj, exc_tb = sys.exc_info()
-            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
-            config.errorLogger(syslog.LOG_DEBUG, "Exception: Error: {err}, Details: {etype}, {fname}, {lineno}".format(err=e, etype=exc_type, fname=fname, lineno=exc_tb.tb_lineno))
-            traceback.print_tb(e.__traceback__)
+        if config.telemRebalanceInterval > 0 and time.time() >= nextBalance:
+            nextBalance = time.time() + config.telemRebalanceInterval
+            try:
+                balanceGatherers()
+            except Exception as e:
+                config.errorLogger(syslog.LOG_ERR, "Error balancing the nodes between the telemetry gatherers.")
+                exc_type, exc_obj, exc_tb = sys.exc_info()
+                fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+                config.errorLogger(syslog.LOG_DEBUG, "Exception: Error: {err}, Details: {etype}, {fname}, {lineno}".format(err=e, etype=exc_type, fname=fname, lineno=exc_tb.tb_lineno))
+    #wake the alert thread so it sees the service is stopping
+    config.alertMessageQueue.put(None)
     for i in range(1+len(gathererProcs)):
         killQueue.put(True)
     
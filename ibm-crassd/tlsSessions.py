@@ -0,0 +1,124 @@
+#  Copyright 2017 IBM Corporation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""
+    Keeps a TLS session per BMC so new connections resume the previous session instead of doing a full
+    handshake. The BMC processors are slow at public key operations, so this shortens reconnects and
+    lowers the load on the BMCs.
+
+    All connections must use the context returned by getContext(), sessions can only be resumed with
+    the context that created them. The cache is keyed by the peer address of the socket, since the
+    hostname is not passed down for BMCs configured by IP address.
+"""
+import ssl
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+global sessionCache
+sessionCache = {}
+global cacheLock
+cacheLock = threading.Lock()
+global context
+context = None
+global contextLock
+contextLock = threading.Lock()
+
+def getPeerKey(sock):
+    """
+        Returns the key used to cache the sessions of a socket, or None if the socket is not connected
+    """
+    try:
+        peer = sock.getpeername()
+        return (peer[0], peer[1])
+    except (OSError, IndexError):
+        return None
+
+def rememberSession(sslsock):
+    """
+        Stores the TLS session of a socket so the next connection to the same BMC can resume it. With
+        TLS 1.3 the session ticket only arrives after the handshake, so this should also be called
+        once data has been received on the socket.
+
+        @param sslsock: a connected ssl socket created with the shared context
+    """
+    key = getPeerKey(sslsock)
+    try:
+        session = sslsock.session
+    except (AttributeError, ValueError):
+        session = None
+    if key is not None and session is not None:
+        with cacheLock:
+            sessionCache[key] = session
+
+def forgetSessions():
+    """
+        Empties the session cache
+    """
+    with cacheLock:
+        sessionCache.clear()
+
+class ResumingContext(ssl.SSLContext):
+    """
+        SSL context that resumes the cached session of the BMC when wrapping a socket
+    """
+    def wrap_socket(self, sock, server_side=False, do_handshake_on_connect=True,
+                    suppress_ragged_eofs=True, server_hostname=None, session=None):
+        key = getPeerKey(sock)
+        if session is None and key is not None:
+            with cacheLock:
+                session = sessionCache.get(key)
+        try:
+            sslsock = super(ResumingContext, self).wrap_socket(sock, server_side=server_side,
+                                                               do_handshake_on_connect=do_handshake_on_connect,
+                                                               suppress_ragged_eofs=suppress_ragged_eofs,
+                                                               server_hostname=server_hostname, session=session)
+        except ssl.SSLError:
+            #a session the BMC no longer accepts must not keep failing the connections
+            with cacheLock:
+                sessionCache.pop(key, None)
+            raise
+        if do_handshake_on_connect:
+            rememberSession(sslsock)
+        return sslsock
+
+def getContext():
+    """
+        Returns the shared client context. The BMCs use self signed certificates, so the certificates
+        are not verified, the same as the verify=False used for all of the BMC requests.
+    """
+    global context
+    with contextLock:
+        if context is None:
+            newContext = ResumingContext(ssl.PROTOCOL_TLS_CLIENT)
+            newContext.check_hostname = False
+            newContext.verify_mode = ssl.CERT_NONE
+            context = newContext
+    return context
+
+class ResumingAdapter(HTTPAdapter):
+    """
+        Transport adapter for requests that opens its https connections with the shared context
+    """
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['ssl_context'] = getContext()
+        return super(ResumingAdapter, self).init_poolmanager(*args, **kwargs)
+
+def session():
+    """
+        Returns a requests session whose https connections resume the cached TLS sessions
+    """
+    mysess = requests.session()
+    mysess.mount('https://', ResumingAdapter())
+    return mysess
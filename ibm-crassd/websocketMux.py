@@ -0,0 +1,488 @@
+#  Copyright 2017 IBM Corporation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""
+    This module multiplexes the long running /subscribe websockets to the BMCs. Instead of one thread per
+    BMC, a small fixed number of event loop threads wait on all of the websockets with a selector, and a
+    small pool of connector threads performs the logins and websocket handshakes. The size of that pool
+    is the cap on concurrent handshakes for the whole process.
+
+    Closed websockets and failed logins are reconnected by a single scheduler, using exponential backoff
+    with full jitter so BMCs that went down together do not all reconnect on the same tick. The reconnect
+    state of each BMC is kept in its node as reconnectAttempts and nextReconnect. removeConnection stops
+    managing a BMC, closing its websocket without reconnecting it, so it can be handed to another process.
+    Its on_closed callback is called once the websocket is closed for good. Adding it again before then
+    keeps it managed, and it is reconnected.
+
+    The event loops send a websocket ping on any connection that has been idle for websocketPingInterval
+    seconds. A connection that does not answer within websocketPingTimeout seconds is closed, which
+    schedules it to be reconnected.
+
+    Users of this module provide a dictionary of handlers for each connection:
+        login(node): returns a logged in session, or an error string
+        prepare(node, session): optional, called after login and before the websocket is opened
+        on_open(node, ws): called once the websocket is open, used to send the subscription
+        on_message(node, message): called for every text message received
+        on_close(node, reason): called when the websocket is closed, reason is None or the error
+        on_login_failed(node, error): called when login did not return a session
+
+    The module keeps its state per process, so each telemetry gatherer process runs its own loops.
+"""
+import websocket
+import socket
+import selectors
+import threading
+import sys
+import os
+import syslog
+import traceback
+import time
+import random
+import heapq
+import itertools
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+import config
+import tlsSessions
+
+global loops
+loops = []
+global connectQueue
+connectQueue = queue.Queue()
+global startedPid
+startedPid = None
+global muxLock
+muxLock = threading.Lock()
+global reconnectHeap
+reconnectHeap = []
+global reconnectCond
+reconnectCond = threading.Condition()
+global reconnectSeq
+reconnectSeq = itertools.count()
+global managedNodes
+managedNodes = []
+
+def isString(var):
+    """
+        Returns True if the variable is a string, otherwise false.
+    """
+    if sys.version_info < (3,0):
+        return isinstance(var, basestring)
+    else:
+        return isinstance(var, str)
+
+def start():
+    """
+        Starts the event loop threads and the connector threads for this process. Calling it again from
+        the same process does nothing.
+    """
+    global loops
+    global connectQueue
+    global startedPid
+    global reconnectHeap
+    global reconnectCond
+    global managedNodes
+    with muxLock:
+        if startedPid == os.getpid():
+            return
+        startedPid = os.getpid()
+        loops = []
+        connectQueue = queue.Queue()
+        reconnectHeap = []
+        reconnectCond = threading.Condition()
+        managedNodes = []
+        for i in range(max(1, config.websocketLoops)):
+            loop = {'selector': selectors.DefaultSelector(), 'pending': queue.Queue(), 'count': 0}
+            loop['wakeRecv'], loop['wakeSend'] = socket.socketpair()
+            loop['wakeRecv'].setblocking(False)
+            loop['selector'].register(loop['wakeRecv'], selectors.EVENT_READ, None)
+            loops.append(loop)
+            t = threading.Thread(target=runLoop, args=[loop])
+            t.daemon = True
+            t.start()
+        for i in range(max(1, config.websocketConnectors)):
+            t = threading.Thread(target=connectorWorker)
+            t.daemon = True
+            t.start()
+        t = threading.Thread(target=reconnectScheduler)
+        t.daemon = True
+        t.start()
+
+def addConnection(node, handlers):
+    """
+        Queues a websocket to be opened to the BMC of the node. From then on the websocket is reconnected
+        by the scheduler whenever it closes. If the node is already managed, or was removed but its
+        websocket is still being opened or closed, it is managed again and reconnected as usual.
+
+        @param node: dictionary containing the properties of the node
+        @param handlers: dictionary of handler functions, see the module description
+    """
+    with muxLock:
+        if node not in managedNodes:
+            managedNodes.append(node)
+        if node.get('listenerState') in ('connecting', 'connected', 'closing', 'waiting'):
+            #whatever is handling the websocket now schedules its reconnect once it sees it isn't removed
+            if node.get('removed'):
+                node['removed'] = False
+                node['reconnectAttempts'] = 0
+                node.pop('onRemoved', None)
+            return
+        node['removed'] = False
+        node['listenerState'] = 'connecting'
+        node['reconnectAttempts'] = 0
+        node['nextReconnect'] = None
+        node['reconnectSeq'] = None
+    connectQueue.put((node, handlers))
+
+def removeConnection(node, on_closed=None):
+    """
+        Stops managing the websocket to the BMC of the node. The websocket is closed if it is open and is
+        not reconnected, waiting reconnects are dropped.
+
+        @param node: dictionary containing the properties of the node
+        @param on_closed: optional function called with the node once its websocket is closed, and no
+                          websocket to the BMC is being opened, called right away if there is none
+    """
+    with muxLock:
+        if node in managedNodes:
+            managedNodes.remove(node)
+        node['removed'] = True
+        node['onRemoved'] = on_closed
+        #nothing else will move a node waiting for its reconnect out of that state
+        if node.get('listenerState') in ('waiting', None):
+            node['listenerState'] = 'closed'
+            node['nextReconnect'] = None
+            node['reconnectSeq'] = None
+    disconnect(node)
+    finishRemoval(node)
+
+def finishRemoval(node):
+    """
+        Calls the on_closed callback given to removeConnection once a removed node is closed. Does nothing
+        for other nodes, and calls the callback only once.
+
+        @param node: dictionary containing the properties of the node
+    """
+    with muxLock:
+        if not node.get('removed') or node.get('listenerState') != 'closed':
+            return
+        callback = node.pop('onRemoved', None)
+    if callback is not None:
+        callback(node)
+
+def getReconnectDelay(attempts):
+    """
+        Returns the delay before the next reconnect attempt, using exponential backoff with full jitter
+
+        @param attempts: the number of consecutive failed attempts, starting at 1
+        @return: the delay in seconds
+    """
+    ceiling = min(config.websocketReconnectMax, config.websocketReconnectBase * (2 ** min(attempts - 1, 30)))
+    return random.uniform(0, ceiling)
+
+def scheduleReconnect(node, handlers):
+    """
+        Schedules the websocket to the BMC of the node to be opened again after a backoff delay. A removed
+        node is closed instead.
+
+        @param node: dictionary containing the properties of the node
+        @param handlers: dictionary of handler functions, see the module description
+    """
+    with muxLock:
+        closing = config.killNow or node.get('removed')
+        if closing:
+            node['listenerState'] = 'closed'
+        else:
+            node['reconnectAttempts'] = node.get('reconnectAttempts', 0) + 1
+            due = time.time() + getReconnectDelay(node['reconnectAttempts'])
+            seq = next(reconnectSeq)
+            node['nextReconnect'] = due
+            node['listenerState'] = 'waiting'
+            node['reconnectSeq'] = seq
+    if closing:
+        finishRemoval(node)
+        return
+    with reconnectCond:
+        heapq.heappush(reconnectHeap, (due, seq, node, handlers))
+        reconnectCond.notify()
+
+def reconnectScheduler():
+    """
+        Hands websockets whose backoff delay has expired to the connector threads. Run in its own thread.
+    """
+    while not config.killNow:
+        due = []
+        with reconnectCond:
+            now = time.time()
+            while reconnectHeap and reconnectHeap[0][0] <= now:
+                due.append(heapq.heappop(reconnectHeap))
+            if not due:
+                if reconnectHeap:
+                    reconnectCond.wait(min(1, reconnectHeap[0][0] - now))
+                else:
+                    reconnectCond.wait(1)
+        for when, seq, node, handlers in due:
+            with muxLock:
+                #dropped by removeConnection, or superseded by a later addConnection or reconnect
+                if node.get('reconnectSeq') != seq:
+                    continue
+                node['reconnectSeq'] = None
+                node['nextReconnect'] = None
+                removed = node.get('removed')
+                node['listenerState'] = 'closed' if removed else 'connecting'
+            if removed:
+                finishRemoval(node)
+                continue
+            connectQueue.put((node, handlers))
+
+def getReconnectState():
+    """
+        Returns the reconnect state of every BMC managed by this process
+
+        @return: dictionary keyed by BMC hostname containing the listenerState, the number of consecutive
+                 failed attempts and the time of the next attempt, or None if none is scheduled
+    """
+    with muxLock:
+        nodes = list(managedNodes)
+    return {node['bmcHostname']: {'state': node.get('listenerState'),
+                                  'attempts': node.get('reconnectAttempts', 0),
+                                  'nextReconnect': node.get('nextReconnect')} for node in nodes}
+
+def disconnect(node):
+    """
+        Closes the websocket to the BMC of the node. The on_close handler is called from the event loop.
+
+        @param node: dictionary containing the properties of the node
+    """
+    conn = node.get('connection')
+    if conn is not None and not conn['closed']:
+        wakeLoop(conn['loop'], ('close', node, conn))
+
+def wakeLoop(loop, action):
+    """
+        Hands an action to an event loop and wakes it up
+
+        @param loop: the event loop dictionary
+        @param action: tuple of the action name, the node and its connection dictionary
+    """
+    loop['pending'].put(action)
+    try:
+        loop['wakeSend'].send(b'\0')
+    except socket.error:
+        pass
+
+def connectorWorker():
+    """
+        Takes nodes off the connect queue, logs in and opens their websockets. Run in connector threads.
+    """
+    while not config.killNow:
+        node, handlers = connectQueue.get()
+        with muxLock:
+            removed = node.get('removed')
+            if removed:
+                node['listenerState'] = 'closed'
+        if removed:
+            finishRemoval(node)
+            connectQueue.task_done()
+            continue
+        try:
+            openConnection(node, handlers)
+        except Exception as e:
+            node['listenerState'] = 'closing'
+            config.errorLogger(syslog.LOG_ERR, "Failed to open the websocket with bmc {bmc}".format(bmc=node['bmcHostname']))
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+            config.errorLogger(syslog.LOG_DEBUG, "Exception: Error: {err}, Details: {etype}, {fname}, {lineno}".format(err=e, etype=exc_type, fname=fname, lineno=exc_tb.tb_lineno))
+            handlers['on_close'](node, e)
+            scheduleReconnect(node, handlers)
+        connectQueue.task_done()
+
+def openConnection(node, handlers):
+    """
+        Logs into the BMC, opens the websocket and hands it to the least loaded event loop
+
+        @param node: dictionary containing the properties of the node
+        @param handlers: dictionary of handler functions, see the module description
+    """
+    session = handlers['login'](node)
+    if session is None or isString(session):
+        node['listenerState'] = 'closing'
+        handlers['on_login_failed'](node, session)
+        scheduleReconnect(node, handlers)
+        return
+    if 'prepare' in handlers:
+        handlers['prepare'](node, session)
+    cookie = session.cookies.get_dict()
+    cookieStr = ";".join([key + "=" + cookie[key] for key in cookie])
+    ws = websocket.create_connection("wss://{bmc}/subscribe".format(bmc=node['bmcHostname']),
+                                     cookie=cookieStr,
+                                     sslopt={"context": tlsSessions.getContext()},
+                                     timeout=config.websocketTimeout)
+    node['websocket'] = ws
+    handlers['on_open'](node, ws)
+    #frames are read from the event loop, never block it waiting on a partial frame for long
+    ws.settimeout(config.websocketFrameTimeout)
+    conn = {'ws': ws, 'handlers': handlers, 'closed': False, 'openedTime': time.time(),
+            'lastActivity': time.time(), 'pingSent': None, 'sessionSaved': False}
+    with muxLock:
+        loop = min(loops, key=lambda aloop: aloop['count'])
+        loop['count'] += 1
+        conn['loop'] = loop
+    node['connection'] = conn
+    config.bindHandle(ws, node)
+    node['listenerState'] = 'connected'
+    wakeLoop(loop, ('add', node, conn))
+    #removed while the websocket was being opened
+    if node.get('removed'):
+        disconnect(node)
+
+def closeConnection(node, conn, reason=None):
+    """
+        Closes a websocket, calls its on_close handler and schedules it to be reconnected. Only called
+        from the event loop owning it.
+
+        @param node: dictionary containing the properties of the node
+        @param conn: the connection dictionary of the websocket to close
+        @param reason: None for a normal close, otherwise the error that caused it
+    """
+    if conn['closed']:
+        return
+    conn['closed'] = True
+    loop = conn['loop']
+    try:
+        loop['selector'].unregister(conn['ws'].sock)
+    except (KeyError, ValueError, AttributeError):
+        pass
+    try:
+        conn['ws'].shutdown()
+    except Exception:
+        pass
+    config.unbindHandle(conn['ws'])
+    with muxLock:
+        loop['count'] -= 1
+        node['listenerState'] = 'closing'
+    conn['handlers']['on_close'](node, reason)
+    #a connection that stayed up longer than the longest backoff was healthy, start the backoff over
+    if time.time() - conn['openedTime'] >= config.websocketReconnectMax:
+        node['reconnectAttempts'] = 0
+    scheduleReconnect(node, conn['handlers'])
+
+def readConnection(ws):
+    """
+        Reads every complete message available on a websocket, including data already decrypted and
+        buffered by the ssl layer, and passes it to the on_message handler.
+
+        @param ws: the websocket, used as the handle to find its node in the registry
+    """
+    node = config.getNodeByHandle(ws)
+    if node is None:
+        return
+    conn = node['connection']
+    try:
+        while True:
+            opcode, data = ws.recv_data(control_frame=True)
+            conn['lastActivity'] = time.time()
+            conn['pingSent'] = None
+            if not conn['sessionSaved']:
+                #TLS 1.3 session tickets are only received after the handshake
+                tlsSessions.rememberSession(ws.sock)
+                conn['sessionSaved'] = True
+            if opcode == websocket.ABNF.OPCODE_CLOSE:
+                closeConnection(node, conn)
+                return
+            elif opcode == websocket.ABNF.OPCODE_TEXT:
+                conn['handlers']['on_message'](node, data.decode('utf-8'))
+            elif opcode == websocket.ABNF.OPCODE_BINARY:
+                conn['handlers']['on_message'](node, data)
+            if not (hasattr(ws.sock, 'pending') and ws.sock.pending() > 0):
+                break
+    except Exception as e:
+        closeConnection(node, conn, e)
+
+def processPending(loop):
+    """
+        Registers new connections with the selector and closes connections as requested by other threads
+
+        @param loop: the event loop dictionary
+    """
+    try:
+        while True:
+            loop['wakeRecv'].recv(4096)
+    except socket.error:
+        pass
+    while True:
+        try:
+            action, node, conn = loop['pending'].get_nowait()
+        except queue.Empty:
+            break
+        if action == 'add' and not conn['closed']:
+            loop['selector'].register(conn['ws'].sock, selectors.EVENT_READ, conn['ws'])
+            #messages received during the handshake may already be buffered
+            if hasattr(conn['ws'].sock, 'pending') and conn['ws'].sock.pending() > 0:
+                readConnection(conn['ws'])
+        elif action == 'close':
+            closeConnection(node, conn)
+
+def checkKeepalive(loop):
+    """
+        Pings idle websockets and closes the ones that did not answer a ping in time
+
+        @param loop: the event loop dictionary
+    """
+    now = time.time()
+    for key in list(loop['selector'].get_map().values()):
+        if key.data is None:
+            continue
+        node = config.getNodeByHandle(key.data)
+        if node is None:
+            continue
+        conn = node['connection']
+        if conn['pingSent'] is not None:
+            if now - conn['pingSent'] > config.websocketPingTimeout:
+                config.errorLogger(syslog.LOG_WARNING, "No ping response from {bmc} in {timeout} seconds.".format(
+                    bmc=node['bmcHostname'], timeout=config.websocketPingTimeout))
+                closeConnection(node, conn, "keepalive timeout")
+        elif now - conn['lastActivity'] >= config.websocketPingInterval:
+            try:
+                conn['ws'].ping()
+                conn['pingSent'] = now
+            except Exception as e:
+                closeConnection(node, conn, e)
+
+def runLoop(loop):
+    """
+        Event loop waiting on all of the websockets assigned to it. Run in its own thread.
+
+        @param loop: the event loop dictionary
+    """
+    lastCheck = time.time()
+    while not config.killNow:
+        try:
+            events = loop['selector'].select(1)
+            for key, mask in events:
+                if key.data is None:
+                    processPending(loop)
+                else:
+                    readConnection(key.data)
+            if config.websocketPingInterval > 0 and time.time() - lastCheck >= 1:
+                lastCheck = time.time()
+                checkKeepalive(loop)
+        except Exception as e:
+            config.errorLogger(syslog.LOG_ERR, "Error in the websocket event loop.")
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+            config.errorLogger(syslog.LOG_DEBUG, "Exception: Error: {err}, Details: {etype}, {fname}, {lineno}".format(err=e, etype=exc_type, fname=fname, lineno=exc_tb.tb_lineno))
+            traceback.print_tb(e.__traceback__)
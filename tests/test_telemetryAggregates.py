@@ -0,0 +1,126 @@
+#  Copyright 2017 IBM Corporation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""
+    Tests the computation of the telemetry aggregates from the sensor table.
+    Run from the top of the repository with: python3 -m unittest discover tests
+"""
+import os
+import sys
+import math
+import unittest
+import multiprocessing
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ibm-crassd'))
+import config
+import telemetryAggregates
+
+class AggregateComputeTest(unittest.TestCase):
+    def setUp(self):
+        telemetryAggregates.enabled = False
+        telemetryAggregates.aggregates = []
+        telemetryAggregates.aggregateValues = {}
+        telemetryAggregates.groups = None
+        telemetryAggregates.table = None
+        self.savedAggregates = config.telemAggregates
+        config.telemAggregates = [{'name': 'totalPower', 'function': 'sum'},
+                                  {'name': 'rackPower', 'function': 'sum'},
+                                  {'name': 'avgTemp', 'function': 'avg'},
+                                  {'name': 'minTemp', 'function': 'min'},
+                                  {'name': 'maxTemp', 'function': 'max'},
+                                  {'name': 'gpus', 'function': 'count'},
+                                  {'name': 'unused', 'function': 'max'}]
+        self.table = {'values': multiprocessing.RawArray('d', 8), 'scales': multiprocessing.RawArray('d', 8)}
+        #slots 0-3 are power readings in watts, slots 4-7 temperatures reported in millidegrees
+        for index, value in enumerate([100, 200, 300, 400, 40000, 50000, 60000, 70000]):
+            self.table['values'][index] = value
+            self.table['scales'][index] = 1 if index < 4 else 0.001
+        if not telemetryAggregates.setup(self.table):
+            self.skipTest("numpy is not installed")
+        aggregates = dict((aggregate['name'], aggregate) for aggregate in telemetryAggregates.aggregates)
+        telemetryAggregates.setIndexes(aggregates['totalPower'], [0, 1, 2, 3], ['power', 'Watts'])
+        telemetryAggregates.setIndexes(aggregates['rackPower'], [2, 3], ['power', 'Watts'])
+        telemetryAggregates.setIndexes(aggregates['avgTemp'], [4, 5, 6, 7], ['temperature', 'DegreesC'])
+        telemetryAggregates.setIndexes(aggregates['minTemp'], [4, 5, 6, 7], ['temperature', 'DegreesC'])
+        telemetryAggregates.setIndexes(aggregates['maxTemp'], [5, 6], ['temperature', 'DegreesC'])
+        telemetryAggregates.setIndexes(aggregates['gpus'], [4, 5, 6], ['temperature', 'DegreesC'])
+
+    def tearDown(self):
+        config.telemAggregates = self.savedAggregates
+
+    def values(self):
+        return dict((name, reading['value']) for name, reading in telemetryAggregates.aggregateValues.items())
+
+    def test_functions(self):
+        telemetryAggregates.compute()
+        values = self.values()
+        self.assertEqual(values['totalPower'], 1000)
+        self.assertEqual(values['rackPower'], 700)
+        self.assertTrue(math.isclose(values['avgTemp'], 55))
+        self.assertTrue(math.isclose(values['minTemp'], 40))
+        self.assertTrue(math.isclose(values['maxTemp'], 60))
+        self.assertEqual(values['gpus'], 3)
+
+    def test_without_sensors(self):
+        telemetryAggregates.compute()
+        self.assertIsNone(self.values()['unused'])
+        self.assertIsNone(telemetryAggregates.aggregateValues['unused']['type'])
+
+    def test_types(self):
+        telemetryAggregates.compute()
+        readings = telemetryAggregates.aggregateValues
+        self.assertEqual(readings['totalPower']['type'], ['power', 'Watts'])
+        self.assertEqual(readings['avgTemp']['type'], ['temperature', 'DegreesC'])
+        self.assertEqual(readings['gpus']['type'], ['count', ''])
+        self.assertEqual(readings['totalPower']['scale'], 1)
+
+    def test_groups(self):
+        #the aggregates of one function share a group, with one reduction over all of their sensors
+        telemetryAggregates.compute()
+        groups = dict((group['function'], group) for group in telemetryAggregates.groups)
+        self.assertEqual(sorted(groups), ['avg', 'max', 'min', 'sum'])
+        self.assertEqual(groups['sum']['names'], ['totalPower', 'rackPower'])
+        self.assertEqual(groups['sum']['indexes'].tolist(), [0, 1, 2, 3, 2, 3])
+        self.assertEqual(groups['sum']['offsets'].tolist(), [0, 4])
+        self.assertEqual(groups['max']['names'], ['maxTemp'])
+
+    def test_new_readings(self):
+        telemetryAggregates.compute()
+        self.table['values'][3] = 1400
+        self.table['values'][4] = 10000
+        telemetryAggregates.compute()
+        values = self.values()
+        self.assertEqual(values['totalPower'], 2000)
+        self.assertEqual(values['rackPower'], 1700)
+        self.assertTrue(math.isclose(values['minTemp'], 10))
+        self.assertTrue(math.isclose(values['avgTemp'], 47.5))
+
+    def test_new_indexes(self):
+        telemetryAggregates.compute()
+        aggregates = dict((aggregate['name'], aggregate) for aggregate in telemetryAggregates.aggregates)
+        telemetryAggregates.setIndexes(aggregates['unused'], [0, 1], ['power', 'Watts'])
+        telemetryAggregates.setIndexes(aggregates['rackPower'], [], None)
+        self.assertIsNone(telemetryAggregates.groups)
+        telemetryAggregates.compute()
+        values = self.values()
+        self.assertEqual(values['unused'], 200)
+        self.assertIsNone(values['rackPower'])
+        self.assertEqual(values['totalPower'], 1000)
+
+    def test_disabled(self):
+        telemetryAggregates.enabled = False
+        telemetryAggregates.compute()
+        self.assertEqual(telemetryAggregates.aggregateValues, {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+#  Copyright 2017 IBM Corporation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""
+    Tests compiling the subscription filters of the telemetry clients against the sensor catalogues.
+    Run from the top of the repository with: python3 -m unittest discover tests
+"""
+import os
+import sys
+import threading
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ibm-crassd'))
+import config
+import telemetryServer
+
+ac922Paths = ('/xyz/openbmc_project/sensors/power/total_power',
+              '/xyz/openbmc_project/sensors/temperature/p0_core0_temp',
+              '/xyz/openbmc_project/sensors/temperature/p0_core1_temp',
+              '/xyz/openbmc_project/sensors/temperature/ambient')
+ac922Types = (('power', 'Watts'), ('temperature', 'DegreesC'), ('temperature', 'DegreesC'), ('temperature', 'DegreesC'))
+otherPaths = ('/xyz/openbmc_project/sensors/power/total_power',
+              '/xyz/openbmc_project/sensors/fan_tach/fan0')
+otherTypes = (('power', 'Watts'), ('fan_tach', 'RPMS'))
+
+class FilterCompileTest(unittest.TestCase):
+    def setUp(self):
+        self.logged = []
+        self.errorLogger = config.errorLogger
+        config.errorLogger = lambda level, message: self.logged.append(message)
+        telemetryServer.catalogues = []
+        telemetryServer.catalogueIndex = {}
+        telemetryServer.catalogueLock = threading.Lock()
+        telemetryServer.nodeCatalogues = {}
+
+    def tearDown(self):
+        config.errorLogger = self.errorLogger
+
+    def selected(self, filterInfo, catalogue):
+        return telemetryServer.getCatalogueSlots(filterInfo, catalogue)[1]
+
+    def test_subscribe_before_catalogue(self):
+        filterInfo = telemetryServer.validateFilter({'sensornames': ['total_power', 'p0_core']}, 'client')
+        self.assertEqual(filterInfo['sensornames'], ['total_power', 'p0_core'])
+        self.assertTrue(self.logged)
+        catalogue = telemetryServer.internCatalogue(ac922Paths, ac922Types)
+        self.assertEqual(self.selected(filterInfo, catalogue), ['total_power', 'p0_core0_temp', 'p0_core1_temp'])
+
+    def test_catalogue_of_another_machine_type_later(self):
+        first = telemetryServer.internCatalogue(ac922Paths, ac922Types)
+        filterInfo = telemetryServer.validateFilter({'sensornames': ['total_power', 'fan0']}, 'client')
+        self.assertEqual(self.selected(filterInfo, first), ['total_power'])
+        later = telemetryServer.internCatalogue(otherPaths, otherTypes)
+        self.assertEqual(self.selected(filterInfo, later), ['total_power', 'fan0'])
+
+    def test_exact_name_before_prefix(self):
+        catalogue = telemetryServer.internCatalogue(ac922Paths, ac922Types)
+        filterInfo = telemetryServer.validateFilter({'sensornames': ['ambient', '/xyz/openbmc_project/sensors/power/']}, 'client')
+        self.assertEqual(self.selected(filterInfo, catalogue), ['ambient', 'total_power'])
+
+    def test_types_before_catalogue(self):
+        filterInfo = telemetryServer.validateFilter({'sensortypes': ['fan_tach']}, 'client')
+        catalogue = telemetryServer.internCatalogue(otherPaths, otherTypes)
+        self.assertEqual(self.selected(filterInfo, catalogue), ['fan0'])
+
+    def test_invalid_types_keep_names(self):
+        filterInfo = telemetryServer.validateFilter({'sensornames': ['ambient'], 'sensortypes': 'power'}, 'client')
+        catalogue = telemetryServer.internCatalogue(ac922Paths, ac922Types)
+        self.assertEqual(self.selected(filterInfo, catalogue), ['ambient'])
+
+    def test_invalid_names_select_nothing(self):
+        filterInfo = telemetryServer.validateFilter({'sensornames': [1, None]}, 'client')
+        catalogue = telemetryServer.internCatalogue(ac922Paths, ac922Types)
+        self.assertEqual(self.selected(filterInfo, catalogue), [])
+
+    def test_no_sensor_filter(self):
+        filterInfo = telemetryServer.validateFilter({}, 'client')
+        catalogue = telemetryServer.internCatalogue(otherPaths, otherTypes)
+        self.assertEqual(self.selected(filterInfo, catalogue), ['total_power', 'fan0'])
+
+if __name__ == '__main__':
+    unittest.main()
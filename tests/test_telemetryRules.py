@@ -0,0 +1,105 @@
+#  Copyright 2017 IBM Corporation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""
+    Tests the threshold and rate of change checks of the telemetry rules.
+    Run from the top of the repository with: python3 -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+import multiprocessing
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ibm-crassd'))
+import config
+import telemetryRules
+
+class RuleChecksTest(unittest.TestCase):
+    def setUp(self):
+        telemetryRules.enabled = False
+        telemetryRules.rules = []
+        telemetryRules.checks = None
+        telemetryRules.lastCheck = None
+        config.telemRules = [{'name': 'temp', 'sensor': 'temp', 'type': None, 'noderange': None, 'high': 10.0,
+                              'low': 0.0, 'hysteresis': 2.0, 'rate': 5.0, 'ratehold': 2.0}]
+        self.table = {'values': multiprocessing.RawArray('d', 2), 'scales': multiprocessing.RawArray('d', 2),
+                      'ready': multiprocessing.RawArray('b', 1)}
+        self.table['scales'][0] = 1
+        self.table['scales'][1] = 1
+        self.table['ready'][0] = 1
+        if not telemetryRules.setup(self.table):
+            self.skipTest("numpy is not installed")
+        telemetryRules.setSensors(telemetryRules.rules[0], [0], [(0, 'temp0')])
+
+    def checkReadings(self, readings):
+        """
+            Checks a reading per second and returns the event IDs raised at each check
+        """
+        raised = []
+        for now, value in enumerate(readings):
+            self.table['values'][0] = value
+            transitions = telemetryRules.check(float(now))
+            raised.append([telemetryRules.createEvent(transition, now)['CerID'] for transition in transitions])
+        return raised
+
+    def test_hysteresis(self):
+        raised = self.checkReadings([5, 6, 10.5, 9, 8.5, 8, 7, 3, -0.5, 1, 2])
+        self.assertEqual(raised, [[], [], ['FQPSPEM0004M'], [], [], ['FQPSPEM0007I'], [], [], ['FQPSPEM0005M'], [],
+                                  ['FQPSPEM0007I']])
+
+    def test_rate_held(self):
+        #the rate is back within its limit at 2 but has to stay there for the hold time
+        raised = self.checkReadings([1, 7, 8, 9, 9, 9])
+        self.assertEqual(raised, [[], ['FQPSPEM0006M'], [], ['FQPSPEM0007I'], [], []])
+
+    def test_rate_extended(self):
+        #another fast change during the hold time starts the hold time over without a new event
+        raised = self.checkReadings([1, 7, 1, 2, 3, 4])
+        self.assertEqual(raised, [[], ['FQPSPEM0006M'], [], [], ['FQPSPEM0007I'], []])
+
+    def test_rate_clears_before_threshold(self):
+        raised = self.checkReadings([5, 20, 20, 20, 20, 16, 12, 7.9])
+        self.assertEqual(raised, [[], ['FQPSPEM0004M', 'FQPSPEM0006M'], [], ['FQPSPEM0008I'], [], [], [],
+                                  ['FQPSPEM0007I']])
+
+    def test_threshold_clears_before_rate(self):
+        raised = self.checkReadings([5, 11, 5, 5, 5, 5])
+        self.assertEqual(raised, [[], ['FQPSPEM0004M', 'FQPSPEM0006M'], ['FQPSPEM0009I'], [], ['FQPSPEM0007I'], []])
+
+    def test_threshold_and_rate_clear_together(self):
+        raised = self.checkReadings([5, 11, 10.5, 8, 8])
+        self.assertEqual(raised, [[], ['FQPSPEM0004M', 'FQPSPEM0006M'], [], ['FQPSPEM0007I'], []])
+
+    def test_recovery_events(self):
+        self.checkReadings([5, 11])
+        self.table['values'][0] = 5
+        transitions = telemetryRules.check(2.0)
+        event = telemetryRules.createEvent(transitions[0], 2)
+        self.assertEqual(event['message'], "Telemetry sensor temp0 is back within its thresholds")
+        self.assertEqual(event['state'], 'Deasserted')
+        self.assertEqual(event['eventType'], 'Recovery')
+
+    def test_not_ready(self):
+        self.table['ready'][0] = 0
+        self.assertEqual(self.checkReadings([5, 20, 20]), [[], [], []])
+
+    def test_rebuild_keeps_state(self):
+        self.checkReadings([5, 20])
+        telemetryRules.setSensors(telemetryRules.rules[0], [1, 0], [(0, 'temp1'), (0, 'temp0')])
+        self.table['values'][1] = 5
+        transitions = telemetryRules.check(2.0)
+        self.assertEqual(transitions, [])
+        self.assertEqual(telemetryRules.checks['level'].tolist(), [0, 1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+#  Copyright 2017 IBM Corporation
+#
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""
+    Tests handing a node between telemetry gatherers while its websocket is opened, closed or waits to be
+    reconnected.
+    Run from the top of the repository with: python3 -m unittest discover tests
+"""
+import os
+import sys
+import time
+import queue
+import threading
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ibm-crassd'))
+import config
+import websocketMux
+
+class ReleaseAndAdoptTest(unittest.TestCase):
+    def setUp(self):
+        config.killNow = False
+        config.websocketReconnectBase = 0.05
+        config.websocketReconnectMax = 0.05
+        websocketMux.connectQueue = queue.Queue()
+        websocketMux.reconnectHeap = []
+        websocketMux.managedNodes = []
+        self.scheduler = threading.Thread(target=websocketMux.reconnectScheduler)
+        self.scheduler.daemon = True
+        self.scheduler.start()
+        self.node = {'bmcHostname': 'bmc1'}
+        self.handlers = {}
+
+    def tearDown(self):
+        config.killNow = True
+        with websocketMux.reconnectCond:
+            websocketMux.reconnectCond.notify()
+        self.scheduler.join()
+        config.killNow = False
+
+    def takeConnect(self):
+        node, handlers = websocketMux.connectQueue.get(timeout=1)
+        self.assertIs(node, self.node)
+        return node
+
+    def test_release_then_adopt(self):
+        websocketMux.addConnection(self.node, self.handlers)
+        self.takeConnect()
+        websocketMux.scheduleReconnect(self.node, self.handlers)
+        self.assertEqual(self.node['listenerState'], 'waiting')
+
+        websocketMux.removeConnection(self.node)
+        self.assertEqual(self.node['listenerState'], 'closed')
+        #the dropped reconnect is never handed to the connectors
+        time.sleep(0.2)
+        self.assertTrue(websocketMux.connectQueue.empty())
+        self.assertEqual(self.node['listenerState'], 'closed')
+
+        websocketMux.addConnection(self.node, self.handlers)
+        self.assertEqual(self.node['listenerState'], 'connecting')
+        self.assertIn(self.node, websocketMux.managedNodes)
+        self.takeConnect()
+
+    def test_adopt_before_stale_reconnect(self):
+        websocketMux.addConnection(self.node, self.handlers)
+        self.takeConnect()
+        websocketMux.scheduleReconnect(self.node, self.handlers)
+        websocketMux.removeConnection(self.node)
+        websocketMux.addConnection(self.node, self.handlers)
+        self.takeConnect()
+        #the reconnect scheduled before the release does not open a second websocket
+        time.sleep(0.2)
+        self.assertTrue(websocketMux.connectQueue.empty())
+        self.assertEqual(self.node['listenerState'], 'connecting')
+
+    def test_removed_after_reconnect_scheduled(self):
+        websocketMux.addConnection(self.node, self.handlers)
+        self.takeConnect()
+        websocketMux.scheduleReconnect(self.node, self.handlers)
+        #removed without removeConnection seeing it waiting, the scheduler closes it
+        self.node['removed'] = True
+        time.sleep(0.2)
+        self.assertTrue(websocketMux.connectQueue.empty())
+        self.assertEqual(self.node['listenerState'], 'closed')
+
+    def test_adopt_while_closing(self):
+        websocketMux.addConnection(self.node, self.handlers)
+        self.takeConnect()
+        self.node['listenerState'] = 'connected'
+        websocketMux.removeConnection(self.node)
+        #adopted again before the event loop closed the websocket
+        websocketMux.addConnection(self.node, self.handlers)
+        self.assertTrue(websocketMux.connectQueue.empty())
+        self.assertFalse(self.node['removed'])
+        self.assertIn(self.node, websocketMux.managedNodes)
+        #the close schedules the reconnect instead of dropping the node
+        self.node['listenerState'] = 'closing'
+        websocketMux.scheduleReconnect(self.node, self.handlers)
+        self.assertEqual(self.node['listenerState'], 'waiting')
+        self.takeConnect()
+        self.assertEqual(self.node['listenerState'], 'connecting')
+
+    def test_adopt_while_connecting(self):
+        websocketMux.addConnection(self.node, self.handlers)
+        websocketMux.removeConnection(self.node)
+        websocketMux.addConnection(self.node, self.handlers)
+        #the connect queued first is still used, and no second one is queued
+        self.takeConnect()
+        self.assertTrue(websocketMux.connectQueue.empty())
+        self.assertFalse(self.node['removed'])
+
+    def test_removed_while_closing(self):
+        websocketMux.addConnection(self.node, self.handlers)
+        self.takeConnect()
+        self.node['listenerState'] = 'closing'
+        websocketMux.removeConnection(self.node)
+        websocketMux.scheduleReconnect(self.node, self.handlers)
+        self.assertEqual(self.node['listenerState'], 'closed')
+        time.sleep(0.2)
+        self.assertTrue(websocketMux.connectQueue.empty())
+
+    def test_on_closed(self):
+        closed = []
+        websocketMux.addConnection(self.node, self.handlers)
+        self.takeConnect()
+        self.node['listenerState'] = 'connected'
+        websocketMux.removeConnection(self.node, closed.append)
+        #the websocket is still open
+        self.assertEqual(closed, [])
+        self.node['listenerState'] = 'closing'
+        websocketMux.scheduleReconnect(self.node, self.handlers)
+        self.assertEqual(closed, [self.node])
+
+    def test_on_closed_while_waiting(self):
+        closed = []
+        websocketMux.addConnection(self.node, self.handlers)
+        self.takeConnect()
+        websocketMux.scheduleReconnect(self.node, self.handlers)
+        websocketMux.removeConnection(self.node, closed.append)
+        self.assertEqual(closed, [self.node])
+
+    def test_on_closed_while_connecting(self):
+        closed = []
+        websocketMux.addConnection(self.node, self.handlers)
+        websocketMux.removeConnection(self.node, closed.append)
+        self.assertEqual(closed, [])
+        #a connector thread takes the queued connect and drops it
+        connector = threading.Thread(target=websocketMux.connectorWorker)
+        connector.daemon = True
+        connector.start()
+        for wait in range(100):
+            if closed:
+                break
+            time.sleep(0.01)
+        self.assertEqual(closed, [self.node])
+        self.assertEqual(self.node['listenerState'], 'closed')
+
+    def test_adopted_before_closed(self):
+        closed = []
+        websocketMux.addConnection(self.node, self.handlers)
+        self.takeConnect()
+        self.node['listenerState'] = 'connected'
+        websocketMux.removeConnection(self.node, closed.append)
+        websocketMux.addConnection(self.node, self.handlers)
+        self.node['listenerState'] = 'closing'
+        websocketMux.scheduleReconnect(self.node, self.handlers)
+        self.assertEqual(closed, [])
+
+if __name__ == '__main__':
+    unittest.main()